@@ -1,7 +1,11 @@
-# from __future__ import absolute_import, unicode_literals
+from __future__ import absolute_import, unicode_literals
 
-# # This will make sure the app is always imported when
-# # Django starts, so Celery tasks are available.
-# from .celery import app as celery_app
+# Celery is optional; background jobs run in-process unless TASK_BACKEND = 'celery'.
+# When it is installed, this makes sure the app is always imported when
+# Django starts, so Celery tasks are available.
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
 
-# __all__ = ('celery_app',)
+__all__ = ('celery_app',)
@@ -0,0 +1,95 @@
+"""
+SQLite configuration for serving concurrent traffic.
+
+Out of the box Django's SQLite connections use the rollback journal, give up
+on a lock after five seconds and start every transaction DEFERRED, so two
+bookings that both read and then write deadlock and one fails with "database
+is locked". The profile built here:
+
+- switches the database to WAL, so readers never block the writer;
+- applies synchronous/cache_size/mmap_size/temp_store pragmas to every new
+  connection (app/signals.py runs `apply_pragmas` on connection_created);
+- keeps connections open across requests, health-checked before reuse;
+- opens write transactions with BEGIN IMMEDIATE, so writers queue on the busy
+  timeout instead of failing when they upgrade a read lock.
+
+Every value can be overridden from the environment (DB_NAME, DB_TIMEOUT, ...).
+
+Read replicas are listed in DB_REPLICAS as comma-separated file paths and
+become the aliases replica1, replica2, ... that app/routers.py reads from.
+SQLite has no replication of its own: ship the primary with a tool such as
+Litestream, or run `manage.py sync_replicas` to copy it locally.
+"""
+import os
+
+PRAGMA_DEFAULTS = {
+    'journal_mode': 'WAL',
+    # Durable at checkpoints, which WAL makes safe against corruption
+    'synchronous': 'NORMAL',
+    # Negative sizes are KiB: 64 MiB of page cache per connection
+    'cache_size': '-64000',
+    'mmap_size': str(256 * 1024 * 1024),
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+
+def env(name, default):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def sqlite_pragmas():
+    return {
+        pragma: env(f'DB_{pragma.upper()}', value)
+        for pragma, value in PRAGMA_DEFAULTS.items()
+    }
+
+
+def sqlite_database(name):
+    """
+    A DATABASES entry for the SQLite file `name`, tuned for concurrent access.
+    """
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': int(env('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+        'OPTIONS': {
+            # Seconds a connection waits for a lock before raising "database is locked"
+            'timeout': float(env('DB_TIMEOUT', 20)),
+            'transaction_mode': env('DB_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
+        'PRAGMAS': sqlite_pragmas(),
+    }
+
+
+def replica_databases():
+    """
+    DATABASES entries for the replicas in DB_REPLICAS, keyed replica1, replica2, ...
+    """
+    paths = [path.strip() for path in env('DB_REPLICAS', '').split(',') if path.strip()]
+    return {
+        # Tests read replicas through the primary's test database
+        f'replica{number}': {**sqlite_database(path), 'TEST': {'MIRROR': 'default'}}
+        for number, path in enumerate(paths, start=1)
+    }
+
+
+def apply_pragmas(connection):
+    """
+    Run the PRAGMAS from `connection`'s settings on a freshly opened SQLite connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    # On the driver's connection, past any execute wrappers, so that setting up a
+    # reconnection is not counted as queries of the request that happened to open it
+    for pragma, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {pragma} = {value}')
@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
+from .database import replica_databases, sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -58,6 +61,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',
+    'app.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,6 +71,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.ReplicaStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'Flavorscape.urls'
@@ -102,9 +108,21 @@ WSGI_APPLICATION = 'Flavorscape.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # orjson when installed, DRF's stdlib-based classes otherwise (see app/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'app.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
@@ -113,19 +131,62 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'app.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'app.serializers.FastBlacklistTokenRefreshSerializer',
+}
+
+# In-memory blacklist membership and expired token compaction; see app/blacklist.py
+TOKEN_BLACKLIST = {
+    'SYNC_SECONDS': 5,
+    'REBUILD_SECONDS': 3600,
+    'COMPACT_BATCH_SIZE': 1000,
+}
+
+# Users resolved from access tokens are cached for TTL seconds; see app/authentication.py
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+    'SHARED': False,
+    'TOKEN_USER': False,
 }
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# WAL, tuned pragmas, persistent connections and BEGIN IMMEDIATE; each value
+# can be overridden with a DB_* environment variable (see Flavorscape/database.py)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        **sqlite_database(os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3')),
+        # A file-backed test database lets concurrent connections wait on each
+        # other's locks; the shared in-memory one fails them immediately.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    **replica_databases(),
+}
+
+# Listings, history and insights read from these when configured (see app/routers.py)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['app.routers.PrimaryReplicaRouter']
+# How long a user who just wrote keeps reading from the primary
+REPLICA_STICKY_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory is per process; use a shared backend (file, Redis, Memcached)
+# when running several workers so response cache invalidation reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Seconds a cached read response is kept; writes invalidate it sooner
+RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -176,6 +237,52 @@ CORS_ALLOW_CREDENTIALS = True
 
 AUTH_USER_MODEL = 'app.CustomUser'
 
+# Reservations are booked in fixed slots; a reservation occupies the slot its time falls into.
+RESERVATION_SLOT_MINUTES = 60
+# Most slots one batch or recurring reservation request may book
+RESERVATION_BATCH_LIMIT = 100
+
+# Opening hours and range limit of the availability calendar (see app/availability.py)
+CALENDAR = {
+    'OPENS': '11:00',
+    'CLOSES': '23:00',
+    'MAX_DAYS': 31,
+}
+
+# Per-route request metrics, scraped from metrics/ (see app/metrics.py)
+METRICS = {
+    'ENABLED': True,
+    'QUERY_SAMPLE_RATE': 1.0,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+}
+
+# Views running more queries than their @query_budget are logged ('warn') or fail ('raise');
+# ROUTES overrides budgets by URL name (see app/budgets.py)
+QUERY_BUDGET = {
+    'MODE': 'warn' if DEBUG else 'off',
+    'ROUTES': {},
+}
+
+# Server-sent availability events on tables/events/ (see app/events.py)
+EVENTS = {
+    'BUFFER': 256,
+    'HISTORY': 1024,
+    'HEARTBEAT': 15,
+    'RETRY_MS': 3000,
+}
+
+# In-memory free-table index behind reservations/assign/ (see app/assignment.py)
+ASSIGNMENT_INDEX = {
+    'MAX_SLOTS': 4096,
+    'TTL': 60,
+}
+# Tables tried per assignment when other workers win the race for them
+ASSIGNMENT_ATTEMPTS = 5
+
+# Rows fetched per query and bytes sent per piece by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_BYTES = 64 * 1024
+
 # Use the Django database as the backend
 # CELERY_BROKER_URL = 'django://'  # Indicate no external broker; Django acts as the broker
 # CELERY_RESULT_BACKEND = 'django-db'  # Store task results in the database
@@ -220,12 +327,43 @@ DEFAULT_FROM_EMAIL = 'no-reply@flavorscape.com'  # Default sender for email comm
 #     fail_silently=False,
 # )
 
+# Login and registration hash passwords on a bounded process pool (see app/hashing.py)
+PASSWORD_HASHING = {
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    'MAX_QUEUE': 32,
+    'POOL': 'process',
+}
+
+# Where background jobs run: 'local' (in-process worker thread), 'celery' or 'sync'
+TASK_BACKEND = 'local'
+
+# Outgoing notifications are queued in the database and sent by dispatch_outbox
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': 100,
+    'WORKERS': 4,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'LEASE_SECONDS': 300,
+}
+
+# Waitlist entries queue per (date, capacity); promoted entries hold a table this long (see app/waitlist.py)
+WAITLIST = {
+    'HOLD_MINUTES': 15,
+    'MAX_QUEUES': 4096,
+    'TTL': 60,
+}
+
 CRON_CLASSES = [
     "app.crons.CheckAvailabilityCronJob",
+    "app.crons.DispatchOutboxCronJob",
+    "app.crons.CompactTokensCronJob",
 ]
 
 CRONJOBS = [
-    ('*/2 * * * *', 'app.crons.CheckAvailabilityCronJob'),
+    ('*/5 * * * *', 'app.crons.CheckAvailabilityCronJob'),
+    ('* * * * *', 'app.crons.DispatchOutboxCronJob'),
+    ('30 3 * * *', 'app.crons.CompactTokensCronJob'),
 ]
 
 LOGGING = {
@@ -4,5 +4,7 @@ from .models import *
 # Register your models here.
 admin.site.register(Table)
 admin.site.register(Reservation)
+admin.site.register(TableSlot)
 admin.site.register(Waitlist)
 admin.site.register(CustomUser)
+admin.site.register(OutboxEmail)
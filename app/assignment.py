@@ -0,0 +1,146 @@
+"""
+Best-fit table assignment.
+
+For each (date, slot) that has been asked about, the index keeps the free
+tables as a list sorted by (capacity, table_number). The smallest table that
+seats a party is found by bisection, so an assignment never scans tables or
+bookings. A slot's list is loaded with one query the first time it is needed.
+Bookings and cancellations made through app/booking.py keep it up to date
+once they commit.
+
+The index lives in one process. Other workers' bookings reach it when a
+slot's entry expires after ASSIGNMENT_INDEX['TTL'] seconds, and tables they
+add, resize or take out of service when the roster of tables in service
+expires after the same TTL. In the meantime booking still checks the table
+is in service, and the unique constraint on TableSlot stops a stale entry
+from double-booking: a lost race marks the table taken and tries the next fit.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from time import monotonic
+
+from django.conf import settings
+
+from .models import Table, TableSlot, slot_time
+
+DEFAULTS = {
+    # (date, slot) entries kept before the least recently used is dropped
+    'MAX_SLOTS': 4096,
+    'TTL': 60,
+}
+
+
+def assignment_setting(name):
+    return getattr(settings, 'ASSIGNMENT_INDEX', {}).get(name, DEFAULTS[name])
+
+
+class FreeTables:
+    """
+    The free tables of one slot, as sorted (capacity, table_number, table_id) tuples.
+    """
+
+    def __init__(self, tables=()):
+        self.tables = sorted(tables)
+
+    def best_fit(self, party_size):
+        """
+        The smallest free table seating `party_size`, or None.
+        """
+        position = bisect_left(self.tables, (party_size,))
+        return self.tables[position] if position < len(self.tables) else None
+
+    def take(self, table):
+        position = bisect_left(self.tables, table)
+        if position < len(self.tables) and self.tables[position] == table:
+            del self.tables[position]
+
+    def put(self, table):
+        position = bisect_left(self.tables, table)
+        if position == len(self.tables) or self.tables[position] != table:
+            insort(self.tables, table, lo=position)
+
+    def __len__(self):
+        return len(self.tables)
+
+
+class AssignmentIndex:
+    def __init__(self):
+        self.slots = OrderedDict()
+        self.tables = None
+        self.tables_expire = 0
+        self.lock = threading.Lock()
+
+    def in_service(self):
+        """
+        Every table in service, by id, as (capacity, table_number, table_id); call with the lock held.
+
+        The roster is reloaded once it is TTL seconds old.
+        """
+        if self.tables is None or self.tables_expire < monotonic():
+            self.tables = {
+                table_id: (capacity, number, table_id)
+                for table_id, number, capacity in Table.objects.filter(availability_status=True).values_list(
+                    'id', 'table_number', 'capacity')
+            }
+            self.tables_expire = monotonic() + assignment_setting('TTL')
+        return self.tables
+
+    def load(self, date, slot):
+        taken = set(TableSlot.objects.filter(date=date, time=slot).values_list('table_id', flat=True))
+        return FreeTables(table for table_id, table in self.in_service().items() if table_id not in taken)
+
+    def free_tables(self, date, time):
+        """
+        The FreeTables for the slot containing `time` on `date`; call with the lock held.
+        """
+        key = (date, slot_time(time))
+        entry = self.slots.get(key)
+        if entry is None or entry[1] < monotonic():
+            free = self.load(*key)
+            # No slot outlives the roster it was built from
+            entry = (free, min(monotonic() + assignment_setting('TTL'), self.tables_expire))
+            self.slots[key] = entry
+        self.slots.move_to_end(key)
+        while len(self.slots) > assignment_setting('MAX_SLOTS'):
+            self.slots.popitem(last=False)
+        return entry[0]
+
+    def best_fit(self, date, time, party_size):
+        """
+        (capacity, table_number, table_id) of the smallest free table seating `party_size`, or None.
+        """
+        with self.lock:
+            return self.free_tables(date, time).best_fit(party_size)
+
+    def claim(self, table_id, date, time):
+        self.claim_many([(table_id, date, time)])
+
+    def claim_many(self, slots):
+        """
+        Mark each (table_id, date, time) in `slots` as booked.
+        """
+        with self.lock:
+            for table_id, date, time in slots:
+                key = (date, slot_time(time))
+                table = (self.tables or {}).get(table_id)
+                if key in self.slots and table is not None:
+                    self.slots[key][0].take(table)
+
+    def release(self, table_id, date, time):
+        with self.lock:
+            key = (date, slot_time(time))
+            table = (self.tables or {}).get(table_id)
+            if key in self.slots and table is not None:
+                self.slots[key][0].put(table)
+
+    def clear(self):
+        """
+        Forget everything, e.g. after a table's capacity or service status changed.
+        """
+        with self.lock:
+            self.slots.clear()
+            self.tables = None
+
+
+index = AssignmentIndex()
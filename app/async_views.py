@@ -0,0 +1,86 @@
+"""
+Native async versions of the DRF generic views.
+
+DRF's APIView is synchronous, so under ASGI Django would run each of its
+requests in a worker thread. AsyncAPIView makes `dispatch` a coroutine
+instead. DRF's authentication, permission and throttling hooks are sync, so
+they still run in a thread, but handlers are awaited directly and query the
+database with Django's async ORM. Responses must hold plain data; nothing
+should evaluate a queryset while rendering.
+
+Under WSGI Django runs these views through async_to_sync, so they keep
+working there too.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework import generics
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncGenericAPIView(AsyncAPIView, generics.GenericAPIView):
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+
+class AsyncListAPIView(AsyncGenericAPIView):
+    """
+    An async ListAPIView. Serializers must not touch the database per row.
+
+    With a `projection` (app/projections.py) rows are fetched with values()
+    and formatted by it; `serializer_class` then only describes the schema.
+    """
+    projection = None
+
+    async def get(self, request, *args, **kwargs):
+        return await self.alist(request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.projection is not None:
+            # Keyset pagination reads its cursor from the ordering columns
+            ordering = [field.lstrip('-') for field in getattr(self, 'keyset_ordering', ())]
+            queryset = queryset.values(*self.projection.lookups(*ordering))
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.represent(page))
+
+        return Response(self.represent([row async for row in queryset]))
+
+    def represent(self, rows):
+        if self.projection is not None:
+            return self.projection.format_many(rows)
+        return self.get_serializer(rows, many=True).data
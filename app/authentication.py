@@ -0,0 +1,189 @@
+"""
+JWT authentication without a user query on every request.
+
+CachedJWTAuthentication resolves the token's user through a small in-process
+LRU cache with a TTL, optionally backed by Django's shared cache so all
+workers benefit. Saving or deleting a CustomUser evicts it (see
+app/signals.py). With AUTH_USER_CACHE['SHARED'] on, the eviction also bumps
+a per-user version in the shared cache that every worker checks before
+trusting its own copy, so deactivations and password changes apply on the
+next request everywhere. Without it, other workers keep their copy until
+it expires after AUTH_USER_CACHE['TTL'] seconds.
+
+With settings.AUTH_USER_CACHE['TOKEN_USER'] enabled, the user is built from the
+signed email, full_name and is_staff claims instead and the database is
+never consulted. Those claims are only as fresh as the token: refreshing
+re-reads the user and stamps them again, so use this mode only when
+short-lived access tokens are acceptable for staff changes.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .blacklist import revoked_tokens
+
+DEFAULTS = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+    # Also keep users in the default cache, shared by every worker
+    'SHARED': False,
+    # Build request.user from token claims and skip the database entirely
+    'TOKEN_USER': False,
+}
+
+
+def auth_cache_setting(name):
+    return getattr(settings, 'AUTH_USER_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class UserCache:
+    """
+    Users by id, bounded in size and age.
+
+    Each entry is stored with the user's version in the shared cache when it
+    was read, and dropped once the version moves on. Callers get their own
+    copy of the user, so nothing a request does to it reaches the cache.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def shared_key(self, user_id):
+        return f'auth:user:{user_id}'
+
+    def version_key(self, user_id):
+        return f'auth:user:{user_id}:version'
+
+    def version(self, user_id):
+        """
+        The user's version in the shared cache; read it before loading the user to cache.
+        """
+        if auth_cache_setting('SHARED'):
+            return cache.get(self.version_key(user_id), 0)
+        return 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.entries.move_to_end(user_id)
+                else:
+                    del self.entries[user_id]
+                    entry = None
+
+        if not auth_cache_setting('SHARED'):
+            return copy.deepcopy(entry[0]) if entry is not None else None
+
+        if entry is not None:
+            version = self.version(user_id)
+            if entry[2] == version:
+                return copy.deepcopy(entry[0])
+            shared = cache.get(self.shared_key(user_id))
+        else:
+            values = cache.get_many([self.shared_key(user_id), self.version_key(user_id)])
+            shared, version = values.get(self.shared_key(user_id)), values.get(self.version_key(user_id), 0)
+        # Stored with the version it was read at, so a copy from before an eviction never matches
+        if shared is not None and shared[0] == version:
+            self.store(user_id, shared[1], version)
+            return copy.deepcopy(shared[1])
+        return None
+
+    def set(self, user_id, user, version=0):
+        """
+        Cache `user`, read from the database at `version` (see version()).
+        """
+        self.store(user_id, copy.deepcopy(user), version)
+        if auth_cache_setting('SHARED'):
+            cache.set(self.shared_key(user_id), (version, user), auth_cache_setting('TTL'))
+
+    def store(self, user_id, user, version):
+        with self.lock:
+            self.entries[user_id] = (user, time.monotonic() + auth_cache_setting('TTL'), version)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > auth_cache_setting('MAX_SIZE'):
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+        if auth_cache_setting('SHARED'):
+            try:
+                cache.incr(self.version_key(user_id))
+            except ValueError:
+                cache.add(self.version_key(user_id), 1, timeout=None)
+            cache.delete(self.shared_key(user_id))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+class FlavorscapeRefreshToken(RefreshToken):
+    """
+    A refresh token that carries the claims token-user mode reads and checks
+    the blacklist through the in-memory revoked set.
+
+    Access tokens derived from it copy these claims.
+    """
+
+    def check_blacklist(self):
+        if revoked_tokens.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.stamp(user)
+        return token
+
+    def stamp(self, user):
+        """
+        Set the claims token-user mode reads from `user`.
+        """
+        self['email'] = user.email
+        self['full_name'] = user.full_name
+        self['is_staff'] = user.is_staff
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if auth_cache_setting('TOKEN_USER'):
+            if api_settings.USER_ID_CLAIM not in validated_token:
+                raise InvalidToken("Token contained no recognizable user identification")
+            return TokenUser(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        user = user_cache.get(user_id)
+        if user is None:
+            version = user_cache.version(user_id)
+            # Loads the user and applies simplejwt's active and revocation checks
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user, version)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return user
@@ -0,0 +1,108 @@
+"""
+Availability calendar.
+
+The free slots of every table over a range of days, as bitmaps: for each day
+and table, bit j of an int is set when slot j of that day is free, counting
+slots of `slot_minutes` from CALENDAR['OPENS']. Booked reservations in the
+range come from one query on the (date, time) index, and each clears the
+bits of the slots it overlaps with a single mask, so the grid is built in one
+pass over the bookings whatever the number of slots per day.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Reservation, Table, slot_time
+
+DEFAULTS = {
+    'OPENS': '11:00',
+    'CLOSES': '23:00',
+    'MAX_DAYS': 31,
+}
+
+
+def calendar_setting(name):
+    return getattr(settings, 'CALENDAR', {}).get(name, DEFAULTS[name])
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def slot_labels(slot_minutes):
+    """
+    The start time of each slot of the day, as "HH:MM".
+    """
+    opens = minutes(datetime.time.fromisoformat(calendar_setting('OPENS')))
+    closes = minutes(datetime.time.fromisoformat(calendar_setting('CLOSES')))
+    return [f'{start // 60:02d}:{start % 60:02d}' for start in range(opens, closes - slot_minutes + 1, slot_minutes)]
+
+
+def build_calendar(start, end, slot_minutes, party_size=None, now=None):
+    """
+    Free-slot bitmaps for the tables in service seating `party_size`, from `start` to `end` inclusive.
+
+    Slots that have already started are never free.
+    """
+    opens = minutes(datetime.time.fromisoformat(calendar_setting('OPENS')))
+    slots = slot_labels(slot_minutes)
+    every_slot = (1 << len(slots)) - 1
+    booking_minutes = getattr(settings, 'RESERVATION_SLOT_MINUTES', 60)
+
+    tables = Table.objects.filter(availability_status=True).order_by('table_number')
+    if party_size:
+        tables = tables.filter(capacity__gte=party_size)
+    tables = list(tables.values('id', 'table_number', 'capacity'))
+    columns = {table['id']: column for column, table in enumerate(tables)}
+
+    days = (end - start).days + 1
+    grid = [[every_slot] * len(tables) for _ in range(days)]
+
+    now = timezone.localtime(now)
+    # Slots of today that started before now; every slot of earlier days
+    started = max(0, min(len(slots), -((opens - minutes(now)) // slot_minutes)))
+    for day in range(min(days, (now.date() - start).days + 1)):
+        past = every_slot if start + datetime.timedelta(days=day) < now.date() else (1 << started) - 1
+        grid[day] = [free & ~past for free in grid[day]]
+
+    # Dates and times come back as text and are looked up in the small dicts
+    # below, which skips parsing every row into date and time objects
+    bookings = Reservation.objects.filter(date__range=(start, end), status="booked").values_list(
+        'table_id', Cast('date', CharField()), Cast('time', CharField()))
+    rows = {(start + datetime.timedelta(days=day)).isoformat(): row for day, row in enumerate(grid)}
+    masks = {}
+    for table_id, date, time in bookings:
+        column = columns.get(table_id)
+        if column is None:
+            continue
+        mask = masks.get(time)
+        if mask is None:
+            # The calendar slots overlapping the booking slot [begins, begins + booking_minutes)
+            begins = minutes(slot_time(datetime.time.fromisoformat(time))) - opens
+            first = max(0, begins // slot_minutes)
+            last = min(len(slots) - 1, (begins + booking_minutes - 1) // slot_minutes)
+            mask = masks[time] = ~(((1 << (last - first + 1)) - 1) << first) if first <= last else -1
+        rows[date][column] &= mask
+
+    calendar = {}
+    for day, row in enumerate(grid):
+        any_table = 0
+        for free in row:
+            any_table |= free
+        calendar[(start + datetime.timedelta(days=day)).isoformat()] = {
+            'any': format(any_table, 'x'),
+            'tables': [format(free, 'x') for free in row],
+        }
+
+    return {
+        'start': start,
+        'end': end,
+        'slot_minutes': slot_minutes,
+        'party_size': party_size,
+        'slots': slots,
+        'tables': tables,
+        'days': calendar,
+    }
@@ -0,0 +1,121 @@
+"""
+Load generation for the run_benchmarks command.
+
+A run is a list of requests, each (method, path, JSON body or None, bearer
+token or None), dealt out to `concurrency` workers that each send their
+share one after another and time every request. Workers are threads or
+processes, and send either through Django's test client inside the worker
+or over HTTP to a running server. Nothing here imports models, so worker
+processes can be spawned and set Django up themselves.
+"""
+import json
+import multiprocessing
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
+
+import django
+from django.db import connections
+from django.test import Client, override_settings
+
+
+def client_sender():
+    client = Client(raise_request_exception=False)
+
+    def send(method, path, body, token):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        data = json.dumps(body) if body is not None else ''
+        response = client.generic(method, path, data, content_type='application/json', headers=headers)
+        if response.streaming:
+            # Exports are streamed; reading the whole body is part of the request
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    return send
+
+
+def server_sender(base_url):
+    def send(method, path, body, token):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base_url.rstrip('/') + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+        except OSError:
+            # Refused, reset or timed out: no response at all
+            return 0
+
+    return send
+
+
+def drive(server, requests):
+    """
+    Send `requests` in turn, returning (seconds, status) for each.
+    """
+    send = client_sender() if server is None else server_sender(server)
+    timings = []
+    try:
+        for request in requests:
+            started = time.perf_counter()
+            status = send(*request)
+            timings.append((time.perf_counter() - started, status))
+    finally:
+        connections.close_all()
+    return timings
+
+
+def setup_process(overrides):
+    django.setup()
+    override_settings(**overrides).enable()
+    from app import hashing
+
+    # A worker process waits for its children as it exits, without running
+    # atexit hooks, so the password hashing pool has to be stopped first. The
+    # high priority runs this before the finalizers that close the pool's queues.
+    Finalize(None, hashing.pool.shutdown, exitpriority=100)
+
+
+class LoadGenerator:
+    """
+    A pool of worker threads or processes, kept for a whole run.
+
+    `overrides` are settings applied in worker processes; threads share the
+    settings of the process that starts them.
+    """
+
+    def __init__(self, mode, concurrency, server=None, overrides=None):
+        self.concurrency = concurrency
+        self.server = server
+        if mode == 'processes':
+            # Spawned rather than forked, so no worker inherits an open database connection
+            self.executor = ProcessPoolExecutor(
+                concurrency, mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_process, initargs=(overrides or {},),
+            )
+            # Start every worker now rather than during the first measurement
+            list(self.executor.map(drive, [server] * concurrency, [[]] * concurrency))
+        else:
+            self.executor = ThreadPoolExecutor(concurrency)
+
+    def run(self, requests):
+        """
+        Send `requests` spread over the workers, returning the (seconds, status) of each and the wall time.
+        """
+        shares = [requests[worker::self.concurrency] for worker in range(self.concurrency)]
+        started = time.perf_counter()
+        results = list(self.executor.map(drive, [self.server] * len(shares), shares))
+        elapsed = time.perf_counter() - started
+        return [timing for share in results for timing in share], elapsed
+
+    def close(self):
+        self.executor.shutdown()
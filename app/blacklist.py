@@ -0,0 +1,119 @@
+"""
+In-memory view of the refresh token blacklist.
+
+RevokedTokens mirrors the jti of every BlacklistedToken row in a hash set.
+The set is loaded on first use and gains this process's blacklist writes
+straight from the post_save signal. A jti found in it is revoked; any other
+is not, and is answered without a query unless the set is due a sync. Rows
+written since the last sync, by other processes too, are pulled with a
+primary key range query when either
+
+- a blacklist write anywhere has bumped the version in the shared cache
+  since then (see announce_revocation), or
+- SYNC_SECONDS have passed.
+
+With a cache shared by every process, a revocation therefore applies
+everywhere on the next check. With a per-process cache such as locmem,
+another process's revocation can go unseen for up to SYNC_SECONDS. SQLite
+commits one writer at a time, so a row never turns up later with an id
+below one already seen.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+DEFAULTS = {
+    'SYNC_SECONDS': 5,
+    # Full reload, which also drops tokens removed by compact_tokens
+    'REBUILD_SECONDS': 3600,
+    'COMPACT_BATCH_SIZE': 1000,
+}
+
+
+def blacklist_setting(name):
+    return getattr(settings, 'TOKEN_BLACKLIST', {}).get(name, DEFAULTS[name])
+
+
+VERSION_KEY = 'blacklist:version'
+
+
+def blacklist_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def announce_revocation():
+    """
+    Tell every process to sync its revoked set; call once a blacklist write has committed.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+class RevokedTokens:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jtis = set()
+        self.watermark = 0
+        self.version = None
+        self.loaded_at = None
+        self.synced_at = None
+
+    def rebuild(self):
+        # Read first, so a revocation announced during the load is synced next time
+        version = blacklist_version()
+        rows = BlacklistedToken.objects.values_list('id', 'token__jti')
+        jtis = set()
+        watermark = 0
+        for pk, jti in rows.iterator(chunk_size=5000):
+            jtis.add(jti)
+            watermark = max(watermark, pk)
+        now = time.monotonic()
+        with self.lock:
+            self.jtis = jtis
+            self.watermark = watermark
+            self.version = version
+            self.loaded_at = self.synced_at = now
+
+    def sync(self):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= blacklist_setting('REBUILD_SECONDS'):
+            self.rebuild()
+            return
+        version = blacklist_version()
+        if version == self.version and now - self.synced_at < blacklist_setting('SYNC_SECONDS'):
+            return
+
+        rows = list(BlacklistedToken.objects.filter(id__gt=self.watermark).values_list('id', 'token__jti'))
+        with self.lock:
+            for pk, jti in rows:
+                self.jtis.add(jti)
+                self.watermark = max(self.watermark, pk)
+            self.version = version
+            self.synced_at = now
+
+    def add(self, jti):
+        # The watermark only moves on sync so rows other processes wrote meanwhile are still fetched
+        with self.lock:
+            self.jtis.add(jti)
+
+    def is_revoked(self, jti):
+        if jti in self.jtis:
+            return True
+        # Not revoked as far as this process knows; sync if another one may have revoked it since
+        self.sync()
+        return jti in self.jtis
+
+    def clear(self):
+        with self.lock:
+            self.jtis = set()
+            self.watermark = 0
+            self.version = None
+            self.loaded_at = self.synced_at = None
+
+
+revoked_tokens = RevokedTokens()
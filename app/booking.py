@@ -0,0 +1,148 @@
+"""
+Booking and cancellation of table slots.
+"""
+from django.db import IntegrityError, transaction
+
+from . import assignment, events, rollups, tasks, waitlist
+from .cache import bump_generation
+from .models import Reservation, Table, TableSlot, slot_time
+
+
+class SlotUnavailable(Exception):
+    """
+    Raised when the requested table slot has already been booked.
+
+    For batches, `conflicts` lists each rejected (table, date, time, reason).
+    """
+
+    def __init__(self, message, conflicts=()):
+        super().__init__(message)
+        self.conflicts = list(conflicts)
+
+
+def book_table(user, table, date, time):
+    """
+    Reserve `table` for `user` and claim its slot in one transaction.
+
+    The unique constraint on TableSlot settles races between concurrent
+    bookings: the losing insert fails and takes its reservation down with it.
+    The table's service status is checked again inside the transaction, since
+    callers may hold a copy read earlier or built from the assignment index,
+    and so are the waitlist holds of other guests.
+    """
+    try:
+        with transaction.atomic():
+            if not Table.objects.filter(pk=table.pk, availability_status=True).exists():
+                raise SlotUnavailable(f"Table {table.table_number} is not in service.")
+            if waitlist.held_conflicts(user, [(table, date, time)]):
+                raise SlotUnavailable(f"Table {table.table_number} is held for a waitlisted guest on {date}.")
+            reservation = Reservation.objects.create(user_id=user.pk, table=table, date=date, time=time, status="booked")
+            TableSlot.objects.create(table=table, date=date, time=slot_time(time), reservation=reservation)
+            rollups.record_booking(reservation)
+            waitlist.confirm(user, [date])
+            transaction.on_commit(lambda: assignment.index.claim(table.pk, date, time))
+    except IntegrityError:
+        raise SlotUnavailable(f"Table {table.table_number} is already booked on {date} at {slot_time(time)}.")
+    return reservation
+
+
+def find_conflicts(user, slots):
+    """
+    The (table, date, time, reason) of every slot in `slots` whose table is
+    out of service, that is already booked, that repeats an earlier one or
+    that would take a table held for another guest's waitlist entry,
+    checked with up to three queries (five when someone else holds a table).
+    """
+    keys = [(table.pk, date, slot_time(time)) for table, date, time in slots]
+    table_ids = {key[0] for key in keys}
+    # Read again here, since callers check service status before the transaction
+    in_service = set(Table.objects.filter(pk__in=table_ids, availability_status=True).values_list('pk', flat=True))
+    # A superset of the clashes, narrowed to exact (table, date, slot) matches below
+    taken = set(TableSlot.objects.filter(
+        table_id__in=table_ids,
+        date__in={key[1] for key in keys},
+        time__in={key[2] for key in keys},
+    ).values_list('table_id', 'date', 'time'))
+
+    conflicts = []
+    bookable = []
+    seen = set()
+    for slot, key in zip(slots, keys):
+        if key[0] not in in_service:
+            conflicts.append((*slot, "not in service"))
+        elif key in taken:
+            conflicts.append((*slot, "already booked"))
+        elif key in seen:
+            conflicts.append((*slot, "repeated in this request"))
+        else:
+            bookable.append(slot)
+        seen.add(key)
+    if bookable:
+        conflicts += waitlist.held_conflicts(user, bookable)
+    return conflicts
+
+
+def book_slots(user, slots):
+    """
+    Reserve every (table, date, time) in `slots` for `user`, or none of them.
+
+    Conflicts are checked up front in the same transaction; the unique
+    constraint on TableSlot still catches a booking that slips in between.
+    bulk_create sends no model signals, so the response cache is invalidated
+    and the slot events are published here.
+    """
+    try:
+        with transaction.atomic():
+            conflicts = find_conflicts(user, slots)
+            if conflicts:
+                raise SlotUnavailable(f"{len(conflicts)} of {len(slots)} slots are unavailable.", conflicts)
+            reservations = Reservation.objects.bulk_create([
+                Reservation(user_id=user.pk, table=table, date=date, time=time, status="booked")
+                for table, date, time in slots
+            ])
+            TableSlot.objects.bulk_create([
+                TableSlot(table=reservation.table, date=reservation.date, time=slot_time(reservation.time),
+                          reservation=reservation)
+                for reservation in reservations
+            ])
+            rollups.record_bookings(reservations)
+            waitlist.confirm(user, {date for _, date, _ in slots})
+            transaction.on_commit(bump_generation)
+            transaction.on_commit(lambda: assignment.index.claim_many(
+                (table.pk, date, time) for table, date, time in slots
+            ))
+            transaction.on_commit(lambda: events.publish_slots(
+                ((table.pk, date, slot_time(time)) for table, date, time in slots), "booked"
+            ))
+    except IntegrityError:
+        conflicts = find_conflicts(user, slots)
+        raise SlotUnavailable(f"{len(conflicts)} of {len(slots)} slots are unavailable.", conflicts)
+    return reservations
+
+
+def cancel_reservation(reservation):
+    """
+    Cancel `reservation` and release the slot it was holding. Returns False,
+    changing nothing, if it was no longer booked.
+
+    The status changes only from booked, in one conditional update, so of two
+    concurrent cancellations exactly one releases the slot and counts in the
+    rollups. Once the cancellation commits, the waitlist for that table and
+    date is promoted in the background.
+    """
+    with transaction.atomic():
+        if not Reservation.objects.filter(pk=reservation.pk, status="booked").update(status="cancelled"):
+            return False
+        reservation.status = "cancelled"
+        TableSlot.objects.filter(reservation=reservation).delete()
+        rollups.record_cancellation(reservation)
+        # update() sends no model signals
+        transaction.on_commit(bump_generation)
+        if reservation.table_id:
+            transaction.on_commit(lambda: assignment.index.release(
+                reservation.table_id, reservation.date, reservation.time
+            ))
+            transaction.on_commit(lambda: tasks.enqueue(
+                tasks.promote_waitlist, reservation.table_id, reservation.date.isoformat()
+            ))
+    return True
@@ -0,0 +1,64 @@
+"""
+Query budgets: the most database queries a view may run per request.
+
+Views declare theirs with @query_budget(n), counting the user lookup token
+authentication makes on a cache miss and any on-commit hooks, and
+QUERY_BUDGET['ROUTES'] can override them by URL name. app/tests.py pins the
+actual count of every route. QueryBudgetMiddleware counts each request's
+queries through the execute wrapper in app/metrics.py, so queries run in
+sync_to_async threads count too. Depending on QUERY_BUDGET['MODE'], it logs
+a warning ('warn') or raises QueryBudgetExceeded ('raise') when a view goes
+over. It is meant for development and tests; 'off' leaves it out of the stack.
+"""
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MODE': 'off',
+    'ROUTES': {},
+}
+
+
+def budget_setting(name):
+    return getattr(settings, 'QUERY_BUDGET', {}).get(name, DEFAULTS[name])
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries):
+    """
+    Class or function decorator declaring the most queries a view may run per request.
+    """
+    def decorate(view):
+        view.query_budget = queries
+        return view
+    return decorate
+
+
+def budget_for(match):
+    """
+    The query budget of the view `match` (a ResolverMatch) resolved to, or None.
+    """
+    routes = budget_setting('ROUTES')
+    if match.view_name in routes:
+        return routes[match.view_name]
+    view = getattr(match.func, 'view_class', match.func)
+    return getattr(view, 'query_budget', None)
+
+
+def check(request, queries):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return
+    budget = budget_for(match)
+    if budget is None or queries <= budget:
+        return
+    message = f'{match.view_name} ran {queries} queries, over its budget of {budget}.'
+    if budget_setting('MODE') == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
@@ -0,0 +1,111 @@
+"""
+Response caching for read endpoints.
+
+Cached responses are keyed on a generation counter that every write to the
+models behind them bumps (see app/signals.py), so a single increment
+invalidates all of them without tracking individual keys. The generation
+also drives the ETag and Last-Modified headers, which lets polling clients
+revalidate with a conditional GET and get an empty 304 back. Responses read
+from a replica are cached apart from those read from the primary, so a user
+pinned to the primary after a write (see app/routers.py) sees their write.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.query import QuerySet
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import replica_reads
+
+GENERATION_KEY = 'responses:generation'
+MODIFIED_KEY = 'responses:modified'
+
+
+def get_generation():
+    """
+    The current (generation, last modified timestamp) pair, starting one if the cache is cold.
+    """
+    values = cache.get_many([GENERATION_KEY, MODIFIED_KEY])
+    if GENERATION_KEY in values and MODIFIED_KEY in values:
+        return values[GENERATION_KEY], values[MODIFIED_KEY]
+    now = int(time.time())
+    cache.add(GENERATION_KEY, 1, timeout=None)
+    cache.add(MODIFIED_KEY, now, timeout=None)
+    return cache.get(GENERATION_KEY, 1), cache.get(MODIFIED_KEY, now)
+
+
+def bump_generation():
+    """
+    Invalidate every cached response.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+    cache.set(MODIFIED_KEY, int(time.time()), timeout=None)
+
+
+def plain(data):
+    """
+    Response data reduced to builtins so it can be pickled into the cache.
+    """
+    if isinstance(data, dict):
+        return {key: plain(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple, QuerySet)):
+        return [plain(value) for value in data]
+    return data
+
+
+class CachedResponseMixin:
+    """
+    Cache successful GET responses per URL and answer conditional GETs with a 304.
+
+    For async views. Permission checks still run on every request; only the
+    handler is skipped. Views with their own `get` can await `cached_response`.
+    Django's cache backends implement their async API as a hop to a worker
+    thread, so the sync calls here are the cheaper way to reach them.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        return await self.cached_response(request, lambda: super(CachedResponseMixin, self).get(request, *args, **kwargs))
+
+    async def cached_response(self, request, build):
+        """
+        The cached response for this URL, or the one `await build()` returns, with validators attached.
+        """
+        generation, modified = get_generation()
+        path = request.get_full_path()
+        # A response built on a lagging replica may predate the generation it is stored under, so
+        # users pinned to the primary after a write neither get nor revalidate one
+        source = 'replica' if replica_reads.get() else 'primary'
+        etag = 'W/' + quote_etag(f'{generation}-{hashlib.md5(f"{source}:{path}".encode()).hexdigest()[:16]}')
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = etag in [tag.strip() for tag in if_none_match.split(',')]
+        else:
+            since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+            not_modified = since is not None and modified <= since
+
+        if not_modified:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'responses:{generation}:{source}:{path}'
+            data = cache.get(key)
+            if data is None:
+                response = await build()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, plain(response.data), getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        # Clients may keep the response but must revalidate it before reuse
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -5,7 +5,9 @@ from django.core.management import call_command
 logger = logging.getLogger(__name__)
 
 class CheckAvailabilityCronJob(CronJobBase):
-    RUN_EVERY_MINS = 2  # Check every 2 minutes
+    # Cancellations promote the waitlist as they happen; this run expires lapsed
+    # holds, so it bounds how long past its deadline a hold can last
+    RUN_EVERY_MINS = 5
 
     schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
     code = 'app.check_availability'  # A unique identifier for this job
@@ -14,3 +16,27 @@ class CheckAvailabilityCronJob(CronJobBase):
         logger.info("Starting CheckAvailabilityCronJob")  # Debug log
         call_command('check_availability')
         logger.info("Completed CheckAvailabilityCronJob")  # Debug log
+
+
+class DispatchOutboxCronJob(CronJobBase):
+    RUN_EVERY_MINS = 1
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'app.dispatch_outbox'
+
+    def do(self):
+        logger.info("Starting DispatchOutboxCronJob")
+        call_command('dispatch_outbox')
+        logger.info("Completed DispatchOutboxCronJob")
+
+
+class CompactTokensCronJob(CronJobBase):
+    RUN_EVERY_MINS = 24 * 60
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'app.compact_tokens'
+
+    def do(self):
+        logger.info("Starting CompactTokensCronJob")
+        call_command('compact_tokens')
+        logger.info("Completed CompactTokensCronJob")
@@ -0,0 +1,189 @@
+"""
+Live table and slot availability changes, for the server-sent event stream.
+
+`publish` is called once a change has committed (see app/signals.py and
+app/booking.py). Each event is numbered and encoded once, kept in a ring
+buffer of the last EVENTS['HISTORY'] events, and handed to every subscriber's
+queue on the subscriber's own event loop. A subscriber that falls more than
+EVENTS['BUFFER'] events behind is dropped rather than slowing anyone else
+down; its client reconnects with Last-Event-ID and resumes from the ring
+buffer, or gets a "reset" event when the events it missed are gone.
+
+Event ids start from the process start time in milliseconds, so an id from
+before a restart is older than anything in the buffer and resumes as a reset.
+The broadcaster lives in one process and only sees changes made in it.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+DEFAULTS = {
+    # Events queued per subscriber before it is dropped
+    'BUFFER': 256,
+    # Past events kept for clients resuming with Last-Event-ID
+    'HISTORY': 1024,
+    # Seconds between keep-alive comments on an idle stream
+    'HEARTBEAT': 15,
+    # Milliseconds clients wait before reconnecting
+    'RETRY_MS': 3000,
+}
+
+
+def events_setting(name):
+    return getattr(settings, 'EVENTS', {}).get(name, DEFAULTS[name])
+
+
+def encode(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+class Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.dropped = False
+
+    def deliver(self, message):
+        # Runs on the subscriber's loop
+        if self.dropped:
+            return
+        if self.queue.qsize() >= events_setting('BUFFER'):
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = None
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        """
+        The next encoded event, '' after `timeout` seconds without one, or None once dropped.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return ''
+
+
+class Broadcaster:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.history = deque(maxlen=events_setting('HISTORY'))
+        self.last_id = int(time.time() * 1000)
+
+    def publish(self, event, data):
+        """
+        Number, encode and fan out one event; safe to call from any thread.
+        """
+        with self.lock:
+            self.last_id += 1
+            message = encode(self.last_id, event, data)
+            self.history.append((self.last_id, message))
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.deliver, message)
+                except RuntimeError:
+                    # Its event loop has closed
+                    self.subscribers.discard(subscriber)
+        return self.last_id
+
+    def subscribe(self, last_event_id=None):
+        """
+        A Subscriber on the running loop and the encoded events it missed since `last_event_id`.
+
+        Registering and reading the backlog happen under one lock, so no event
+        is both replayed and delivered, or neither.
+        """
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.add(subscriber)
+            return subscriber, self.backlog(last_event_id)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def since(self, last_event_id=None):
+        with self.lock:
+            return self.backlog(last_event_id)
+
+    def backlog(self, last_event_id):
+        # Call with the lock held
+        if last_event_id is None:
+            # Nothing to replay, but give the client an id to resume from
+            return [f'id: {self.last_id}\n\n']
+        if last_event_id == self.last_id:
+            return []
+        oldest = self.history[0][0] if self.history else self.last_id + 1
+        if not oldest - 1 <= last_event_id < self.last_id:
+            # Missed events are gone, or the id is from another process
+            return [encode(self.last_id, 'reset', {})]
+        return [message for event_id, message in self.history if event_id > last_event_id]
+
+
+broadcaster = Broadcaster()
+
+
+def publish(event, data):
+    return broadcaster.publish(event, data)
+
+
+def publish_slot(table_id, date, time, status):
+    publish('slot', {'table': table_id, 'date': date, 'time': time, 'status': status})
+
+
+def publish_slots(slots, status):
+    for table_id, date, time in slots:
+        publish_slot(table_id, date, time, status)
+
+
+def publish_table(table, deleted=False):
+    if deleted:
+        publish('table', {'id': table.pk, 'deleted': True})
+    else:
+        publish('table', {
+            'id': table.pk,
+            'table_number': table.table_number,
+            'capacity': table.capacity,
+            'availability_status': table.availability_status,
+        })
+
+
+def parse_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def astream(last_event_id=None):
+    """
+    The event stream for one client: missed events, then live ones with keep-alives between.
+    """
+    subscriber, backlog = broadcaster.subscribe(last_event_id)
+    try:
+        yield f'retry: {events_setting("RETRY_MS")}\n\n'
+        for message in backlog:
+            yield message
+        while True:
+            message = await subscriber.get(events_setting('HEARTBEAT'))
+            if message is None:
+                # Too far behind; the client resumes from its last event id
+                return
+            yield message or ': keep-alive\n\n'
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def stream(last_event_id=None):
+    """
+    For WSGI, where a worker thread per open stream is too dear: the missed
+    events only, after which the client reconnects with its last event id.
+    """
+    yield f'retry: {events_setting("RETRY_MS")}\n\n'
+    yield from broadcaster.since(last_event_id)
@@ -0,0 +1,150 @@
+"""
+Streaming exports of reservations and the waitlist.
+
+Rows are read with QuerySet.iterator() as flat value tuples, formatted as
+NDJSON or CSV and handed out in pieces of about EXPORT_BUFFER_BYTES,
+optionally gzipped on the fly. Only one chunk of rows and one output buffer
+are held at a time, so memory stays flat however many rows are exported.
+"""
+import csv
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Reservation, Waitlist
+
+# Output column and the lookup it is read from
+EXPORTS = {
+    'reservations': (Reservation, [
+        ('id', 'id'),
+        ('user_id', 'user_id'),
+        ('user_email', 'user__email'),
+        ('table_number', 'table__table_number'),
+        ('date', 'date'),
+        ('time', 'time'),
+        ('status', 'status'),
+        ('created_at', 'created_at'),
+    ]),
+    'waitlist': (Waitlist, [
+        ('id', 'id'),
+        ('user_id', 'user_id'),
+        ('user_email', 'user__email'),
+        ('table_number', 'table__table_number'),
+        ('date', 'date'),
+        ('status', 'status'),
+        ('created_at', 'created_at'),
+    ]),
+}
+
+OUTPUTS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def export_queryset(kind, start=None, end=None):
+    """
+    Value tuples for an export in primary key order, optionally limited to dates in [start, end].
+    """
+    model, columns = EXPORTS[kind]
+    queryset = model.objects.all()
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(date__lte=end)
+    return queryset.order_by('id').values_list(*[lookup for _, lookup in columns])
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+class Line:
+    """
+    Hands back what csv.writer writes, so rows can be formatted one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+class Encoder:
+    """
+    Turns rows into output bytes, released in buffer-sized pieces.
+    """
+
+    def __init__(self, kind, output, compress=False):
+        self.names = [name for name, _ in EXPORTS[kind][1]]
+        self.output = output
+        self.buffer = []
+        self.size = 0
+        self.limit = getattr(settings, 'EXPORT_BUFFER_BYTES', 64 * 1024)
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        if output == 'csv':
+            self.writer = csv.writer(Line())
+            self.add(self.writer.writerow(self.names))
+        else:
+            self.encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    def add(self, line):
+        self.buffer.append(line)
+        self.size += len(line)
+
+    def feed(self, row):
+        """
+        Add one row; returns bytes to send once the buffer is full, else b''.
+        """
+        if self.output == 'csv':
+            self.add(self.writer.writerow(row))
+        else:
+            self.add(self.encoder.encode(dict(zip(self.names, row))) + '\n')
+        return self.flush() if self.size >= self.limit else b''
+
+    def flush(self):
+        data = ''.join(self.buffer).encode()
+        self.buffer = []
+        self.size = 0
+        return self.compressor.compress(data) if self.compressor else data
+
+    def finish(self):
+        data = self.flush()
+        return data + self.compressor.flush() if self.compressor else data
+
+
+def stream(queryset, encoder):
+    for row in queryset.iterator(chunk_size=chunk_size()):
+        data = encoder.feed(row)
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+async def astream(queryset, encoder):
+    """
+    stream() for ASGI, fetching and encoding each chunk of rows in a worker thread.
+
+    QuerySet.aiterator() is no use here: a values_list() iterator runs its
+    query as soon as it is created, which aiterator() does on the event loop.
+    """
+    size = chunk_size()
+    rows = None
+
+    def next_chunk():
+        nonlocal rows
+        if rows is None:
+            rows = queryset.iterator(chunk_size=size)
+        chunk = list(islice(rows, size))
+        data = b''.join(encoder.feed(row) for row in chunk)
+        if len(chunk) < size:
+            return data + encoder.finish(), True
+        return data, False
+
+    done = False
+    while not done:
+        data, done = await sync_to_async(next_chunk)()
+        if data:
+            yield data
@@ -0,0 +1,213 @@
+"""
+Password hashing off the request workers.
+
+PBKDF2 costs tens of milliseconds of CPU per call. Login and registration send
+it to a small pool of worker processes so a burst of sign-ins uses at most
+PASSWORD_HASHING['WORKERS'] cores and leaves the rest to reservation traffic.
+The pool accepts at most PASSWORD_HASHING['MAX_QUEUE'] hashes at a time;
+beyond that requests fail fast with a 503 instead of queueing for seconds.
+
+Only the hasher's pure encode/verify step crosses the process boundary. Salts,
+hasher choice and database access stay in the request process, so workers
+need no Django setup and follow PASSWORD_HASHERS as the caller sees it.
+
+Async views use the a-prefixed functions. They run their queries through the
+default thread-sensitive sync_to_async and await the hash itself, so no
+executor thread waits on the pool.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import hashers
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+DEFAULTS = {
+    # Leave at least half the cores to everything else
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    # Hashes queued or running before new ones are refused
+    'MAX_QUEUE': 32,
+    # 'process', 'thread' or 'inline' (in the calling thread, no limit)
+    'POOL': 'process',
+}
+
+
+def hashing_setting(name):
+    return getattr(settings, 'PASSWORD_HASHING', {}).get(name, DEFAULTS[name])
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress, try again shortly.'
+    default_code = 'hashing_busy'
+
+
+def hasher_path(hasher):
+    return f'{type(hasher).__module__}.{type(hasher).__qualname__}'
+
+
+def encode(path, password, salt):
+    return import_string(path)().encode(password, salt)
+
+
+def verify(path, password, encoded):
+    return import_string(path)().verify(password, encoded)
+
+
+class HashingPool:
+    """
+    A lazily started executor that refuses work past a fixed depth.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.kind = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        kind = hashing_setting('POOL')
+        if self.executor is None or self.kind != kind:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            workers = hashing_setting('WORKERS')
+            if kind == 'process':
+                # Spawned, not forked: forking a process with live threads can deadlock
+                self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self.executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+            self.kind = kind
+        return self.executor
+
+    def submit(self, func, *args):
+        """
+        A future for func(*args) run on the pool; inline, it has already run.
+        """
+        if hashing_setting('POOL') == 'inline':
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self.lock:
+            if self.pending >= hashing_setting('MAX_QUEUE'):
+                raise HashingBusy()
+            self.pending += 1
+            executor = self.start()
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future=None):
+        with self.lock:
+            self.pending -= 1
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    async def arun(self, func, *args):
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.executor = None
+
+
+pool = HashingPool()
+
+
+def make_password(password):
+    """
+    hashers.make_password with the work done on the pool.
+    """
+    hasher = hashers.get_hasher('default')
+    return pool.run(encode, hasher_path(hasher), password, hasher.salt())
+
+
+async def amake_password(password):
+    hasher = hashers.get_hasher('default')
+    return await pool.arun(encode, hasher_path(hasher), password, hasher.salt())
+
+
+def stored_hasher(user, password):
+    """
+    The hasher of `user`'s stored password, or None when `password` cannot match it.
+    """
+    if password is None or not hashers.is_password_usable(user.password):
+        return None
+    try:
+        return hashers.identify_hasher(user.password)
+    except ValueError:
+        return None
+
+
+def outdated(hasher, encoded):
+    preferred = hashers.get_hasher('default')
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def check_password(user, password):
+    """
+    user.check_password with the work done on the pool, upgrading outdated hashes.
+    """
+    hasher = stored_hasher(user, password)
+    if hasher is None or not pool.run(verify, hasher_path(hasher), password, user.password):
+        return False
+    if outdated(hasher, user.password):
+        user.password = make_password(password)
+        user.save(update_fields=['password'])
+    return True
+
+
+async def acheck_password(user, password):
+    hasher = stored_hasher(user, password)
+    if hasher is None or not await pool.arun(verify, hasher_path(hasher), password, user.password):
+        return False
+    if outdated(hasher, user.password):
+        user.password = await amake_password(password)
+        await sync_to_async(user.save)(update_fields=['password'])
+    return True
+
+
+def authenticate(email, password):
+    """
+    Like django.contrib.auth.authenticate for the email/password backend, with
+    the user looked up here and only the hash comparison sent to the pool.
+    """
+    UserModel = auth.get_user_model()
+    try:
+        user = UserModel._default_manager.get_by_natural_key(email)
+    except UserModel.DoesNotExist:
+        # Hash anyway so unknown emails take as long as wrong passwords
+        make_password(password)
+        return None
+    if check_password(user, password) and user.is_active:
+        return user
+    return None
+
+
+async def aauthenticate(email, password):
+    UserModel = auth.get_user_model()
+    try:
+        user = await sync_to_async(UserModel._default_manager.get_by_natural_key)(email)
+    except UserModel.DoesNotExist:
+        await amake_password(password)
+        return None
+    if await acheck_password(user, password) and user.is_active:
+        return user
+    return None
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import CustomUser
+
+
+def default_paths():
+    return [
+        reverse('list_tables') + '?party_size=2',
+        reverse('all_tables'),
+        reverse('list_reservations'),
+        reverse('reservation_insights'),
+    ]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    centiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(centiles[49] * 1000, 2),
+        'p95_ms': round(centiles[94] * 1000, 2),
+        'p99_ms': round(centiles[98] * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compares the read endpoints served through the WSGI handler on threads and the ASGI handler on one event loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='User to authenticate as (defaults to the first staff user).')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path and handler.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight at once.')
+        parser.add_argument('--path', action='append', dest='paths', help='Path to request; repeatable.')
+        parser.add_argument('--cached', action='store_true', help='Leave the response cache on.')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('-is_staff', 'id')
+        user = users.filter(email=options['email']).first() if options['email'] else users.first()
+        if user is None:
+            raise CommandError('No user to authenticate as; create one first.')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+        # A timeout of 0 stores nothing, so every request reaches the database
+        timeout = {} if options['cached'] else {'RESPONSE_CACHE_TIMEOUT': 0}
+        results = {}
+        with override_settings(**timeout):
+            for path in options['paths'] or default_paths():
+                results[path] = {
+                    'wsgi_threads': self.run_wsgi(path, headers, options['requests'], options['concurrency']),
+                    'asgi': asyncio.run(self.run_asgi(path, headers, options['requests'], options['concurrency'])),
+                }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_wsgi(self, path, headers, requests, concurrency):
+        def fetch(_):
+            started = time.perf_counter()
+            response = Client().get(path, headers=headers)
+            if response.status_code != 200:
+                raise CommandError(f'{path} returned {response.status_code} under WSGI.')
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(fetch, range(requests)))
+        return summarize(latencies, time.perf_counter() - started)
+
+    async def run_asgi(self, path, headers, requests, concurrency):
+        # AsyncClient only honours headers given per request
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                if response.status_code != 200:
+                    raise CommandError(f'{path} returned {response.status_code} under ASGI.')
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(fetch() for _ in range(requests)))
+        return summarize(latencies, time.perf_counter() - started)
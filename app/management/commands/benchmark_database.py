@@ -0,0 +1,138 @@
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from Flavorscape.database import sqlite_database
+
+SCHEMA = """
+CREATE TABLE slot (
+    id INTEGER PRIMARY KEY,
+    table_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    UNIQUE (table_id, day, hour)
+);
+"""
+
+
+def profiles():
+    tuned = sqlite_database(':memory:')
+    return {
+        # What Django does with an empty OPTIONS: rollback journal, DEFERRED, 5s timeout
+        'default': {'timeout': 5.0, 'begin': 'BEGIN', 'pragmas': {}},
+        'tuned': {
+            'timeout': tuned['OPTIONS']['timeout'],
+            'begin': f"BEGIN {tuned['OPTIONS']['transaction_mode']}",
+            'pragmas': tuned['PRAGMAS'],
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compares mixed read/write throughput on SQLite with the default and the tuned connection settings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent connections.')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that book a slot.')
+        parser.add_argument('--tables', type=int, default=50, help='Tables to book across.')
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, profile in profiles().items():
+            with tempfile.TemporaryDirectory() as directory:
+                results[name] = self.run(os.path.join(directory, 'bench.sqlite3'), profile, options)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def connect(self, path, profile):
+        # Autocommit at the driver level; transactions are opened explicitly below
+        connection = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None, check_same_thread=False)
+        for pragma, value in profile['pragmas'].items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        return connection
+
+    def run(self, path, profile, options):
+        setup = self.connect(path, profile)
+        setup.executescript(SCHEMA)
+        setup.close()
+
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        stats = {'reads': [], 'writes': [], 'locked': 0, 'conflicts': 0}
+
+        def worker(seed):
+            rng = random.Random(seed)
+            connection = self.connect(path, profile)
+            reads, writes, locked, conflicts = [], [], 0, 0
+            while time.monotonic() < deadline:
+                table, day, hour = rng.randrange(options['tables']), rng.randrange(30), rng.randrange(12, 23)
+                started = time.perf_counter()
+                try:
+                    if rng.random() < options['write_ratio']:
+                        # Check-then-insert, the shape of a booking
+                        connection.execute(profile['begin'])
+                        try:
+                            taken = connection.execute(
+                                'SELECT 1 FROM slot WHERE table_id = ? AND day = ? AND hour = ?', (table, day, hour)
+                            ).fetchone()
+                            if taken is None:
+                                connection.execute(
+                                    'INSERT INTO slot (table_id, day, hour) VALUES (?, ?, ?)', (table, day, hour)
+                                )
+                            else:
+                                conflicts += 1
+                            connection.execute('COMMIT')
+                        except BaseException:
+                            if connection.in_transaction:
+                                connection.execute('ROLLBACK')
+                            raise
+                        writes.append(time.perf_counter() - started)
+                    else:
+                        connection.execute(
+                            'SELECT table_id FROM slot WHERE day = ? AND hour = ?', (day, hour)
+                        ).fetchall()
+                        reads.append(time.perf_counter() - started)
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    locked += 1
+            connection.close()
+            with lock:
+                stats['reads'] += reads
+                stats['writes'] += writes
+                stats['locked'] += locked
+                stats['conflicts'] += conflicts
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        return {
+            'operations_per_second': round((len(stats['reads']) + len(stats['writes'])) / elapsed, 1),
+            'reads': self.summarize(stats['reads']),
+            'writes': self.summarize(stats['writes']),
+            # Operations that failed with "database is locked"
+            'locked_errors': stats['locked'],
+            'slot_conflicts': stats['conflicts'],
+        }
+
+    def summarize(self, latencies):
+        if len(latencies) < 2:
+            return {'count': len(latencies)}
+        centiles = statistics.quantiles(latencies, n=100)
+        return {
+            'count': len(latencies),
+            'p50_ms': round(centiles[49] * 1000, 3),
+            'p99_ms': round(centiles[98] * 1000, 3),
+        }
@@ -0,0 +1,72 @@
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from app.hashing import HashingBusy, hashing_setting, hasher_path, pool, verify
+
+
+class Command(BaseCommand):
+    help = 'Measures password verifications (logins) per second and per core through the hashing pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Verifications per run.')
+        parser.add_argument('--concurrency', type=int, default=32, help='Simulated request threads.')
+        parser.add_argument('--workers', type=int, action='append',
+                            help='Pool sizes to try; repeatable. Defaults to 1 and the configured size.')
+
+    def handle(self, *args, **options):
+        hasher = hashers.get_hasher('default')
+        encoded = hasher.encode('benchmark-password', hasher.salt())
+        work = (verify, hasher_path(hasher), 'benchmark-password', encoded)
+
+        # Inline hashing runs on the request threads and can use every core
+        cores = os.cpu_count() or 1
+        runs = {'inline': self.run(dict(POOL='inline'), work, options['logins'], options['concurrency'], cores)}
+        for workers in options['workers'] or sorted({1, hashing_setting('WORKERS')}):
+            config = dict(POOL='process', WORKERS=workers, MAX_QUEUE=hashing_setting('MAX_QUEUE'))
+            runs[f'process_{workers}'] = self.run(config, work, options['logins'], options['concurrency'], workers)
+
+        self.stdout.write(json.dumps({
+            'hasher': hasher.algorithm,
+            'cpu_count': os.cpu_count(),
+            'runs': runs,
+        }, indent=2))
+
+    def run(self, config, work, logins, concurrency, cores):
+        def login(_):
+            started = time.perf_counter()
+            try:
+                pool.run(*work)
+            except HashingBusy:
+                return None
+            return time.perf_counter() - started
+
+        with override_settings(PASSWORD_HASHING=config):
+            pool.shutdown()
+            # Start the workers before timing so process startup is not counted
+            pool.run(*work)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(login, range(logins)))
+            elapsed = time.perf_counter() - started
+            pool.shutdown()
+
+        latencies = sorted(result for result in results if result is not None)
+        centiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        rate = len(latencies) / elapsed
+        return {
+            'logins': len(latencies),
+            # Refused with a 503 because the queue was full
+            'rejected': len(results) - len(latencies),
+            'logins_per_second': round(rate, 1),
+            'logins_per_second_per_core': round(rate / cores, 1),
+            'p50_ms': round(centiles[49] * 1000, 2) if latencies else None,
+            'p99_ms': round(centiles[98] * 1000, 2) if latencies else None,
+        }
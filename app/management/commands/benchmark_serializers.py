@@ -0,0 +1,79 @@
+import datetime
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from app.models import Reservation, Table
+from app.renderers import FastJSONRenderer, orjson
+from app.serializers import ReservationSerializer, TableSerializer, reservation_projection, table_projection
+
+
+def per_row(func, rows, repeat):
+    """
+    Best time per row over `repeat` runs of func(), in microseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / rows * 1e6, 3)
+
+
+class Command(BaseCommand):
+    help = 'Measures per-row cost of the list endpoints: ModelSerializer + JSONRenderer vs projection + fast renderer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per run.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the best is reported.')
+        parser.add_argument('--from-db', action='store_true',
+                            help='Also time fetching existing reservations, with instances vs values().')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        tables = [Table(id=n, table_number=n, capacity=4, availability_status=True) for n in range(1, rows + 1)]
+        reservations = [
+            Reservation(id=n, date=datetime.date(2030, 1, 1) + datetime.timedelta(days=n % 365),
+                        time=datetime.time(12 + n % 10, 30))
+            for n in range(1, rows + 1)
+        ]
+        # The rows values() would return for the same objects
+        table_rows = [{field: getattr(table, field) for field in table_projection.lookups()} for table in tables]
+        reservation_rows = [
+            {field: getattr(reservation, field) for field in reservation_projection.lookups('id')}
+            for reservation in reservations
+        ]
+
+        results = {'orjson': orjson is not None, 'rows': rows}
+        for name, serializer, instances, projection, values in [
+            ('tables', TableSerializer, tables, table_projection, table_rows),
+            ('reservations', ReservationSerializer, reservations, reservation_projection, reservation_rows),
+        ]:
+            before = serializer(instances, many=True).data
+            after = projection.format_many(values)
+            if json.loads(JSONRenderer().render(before)) != json.loads(FastJSONRenderer().render(after)):
+                raise CommandError(f'The {name} projection does not match its serializer.')
+            results[name] = {
+                'model_serializer_us_per_row': per_row(lambda: serializer(instances, many=True).data, rows, repeat),
+                'projection_us_per_row': per_row(lambda: projection.format_many(values), rows, repeat),
+                'json_renderer_us_per_row': per_row(lambda: JSONRenderer().render(before), rows, repeat),
+                'fast_renderer_us_per_row': per_row(lambda: FastJSONRenderer().render(after), rows, repeat),
+            }
+
+        if options['from_db']:
+            queryset = Reservation.objects.order_by('id')[:rows]
+            count = queryset.count()
+            if count:
+                results['reservations_from_db'] = {
+                    'rows': count,
+                    'before_us_per_row': per_row(lambda: JSONRenderer().render(
+                        ReservationSerializer(queryset.all(), many=True).data), count, repeat),
+                    'after_us_per_row': per_row(lambda: FastJSONRenderer().render(
+                        reservation_projection.format_many(queryset.values(*reservation_projection.lookups('id')))
+                    ), count, repeat),
+                }
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -1,55 +1,40 @@
 import datetime
+import time
 from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
-from app.models import Table, Waitlist
+from app.models import Waitlist
+from app.waitlist import expire_holds, promote
 
 
 class Command(BaseCommand):
-    help = 'Checks for table availability and notifies users on the waitlist.'
+    help = 'Expires lapsed waitlist holds and notifies the next users in line.'
 
     def handle(self, *args, **kwargs):
-        # Get the current date
+        started = time.monotonic()
         today = datetime.date.today()
 
-        # Get all tables that are currently available
-        available_tables = Table.objects.filter(availability_status=True)
-
-        # If there are available tables, proceed with checking the waitlist
-        if available_tables.exists():
-            for table in available_tables:
-                # Find waitlist entries for this table and today's date
-                waitlist_entries = Waitlist.objects.filter(table=table, date=today, status="waiting")
-
-                # Notify each user on the waitlist
-                for entry in waitlist_entries:
-                    try:
-                        # Send email notification to the user
-                        send_mail(
-                            subject='Table Available Notification',
-                            message=f'Dear {entry.user.full_name},\n\n'
-                                    f'A table (Table {table.table_number}) is now available on {today}.\n'
-                                    f'Please log in to confirm your reservation.',
-                            from_email='no-reply@flavorscape.com',
-                            recipient_list=[entry.user.email],
-                            fail_silently=False,
-                        )
-
-                        # After sending the email, update the waitlist status to 'notified'
-                        entry.status = 'notified'
-                        entry.save()
-
-                        # Log success to the command output
-                        self.stdout.write(self.style.SUCCESS(
-                            f'Notified {entry.user.email} for table {table.table_number}.'
-                        ))
-
-                    except Exception as e:
-                        # If an error occurs while sending the email, log it to stderr
-                        self.stderr.write(f"Failed to notify {entry.user.email}: {str(e)}")
-        else:
-            # If no available tables are found, log that information
+        # Lapsed holds pass their table to the next entry in the same queue
+        expired, entries = expire_holds()
+        # Cancellations and joins promote their own queue; this run catches anything missed.
+        buckets = (Waitlist.objects.filter(status="waiting", date__gte=today, table__isnull=False)
+                   .values_list('date', 'table__capacity').distinct())
+        # Every queue is promoted together, in a fixed number of queries
+        entries += promote(buckets)
+        finished = time.monotonic()
+
+        if expired:
+            self.stdout.write(self.style.WARNING(f'{expired} waitlist hold(s) expired.'))
+        if not entries:
             self.stdout.write(self.style.SUCCESS('No available tables found to notify waitlist users.'))
-
+            return
+
+        # Status changes and their emails commit together; dispatch_outbox does the sending
+        for entry in entries:
+            self.stdout.write(self.style.SUCCESS(
+                f'Queued notification to {entry.user.email} for a table for {entry.table.capacity}.'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(entries)} notified in {finished - started:.3f}s.'
+        ))
 
 
 
@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from app.blacklist import blacklist_setting
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired outstanding and blacklisted refresh tokens in bounded batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Tokens deleted per transaction.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or blacklist_setting('COMPACT_BATCH_SIZE')
+        started = time.monotonic()
+        now = timezone.now()
+        batches = outstanding = blacklisted = 0
+
+        while options['max_batches'] is None or batches < options['max_batches']:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lt=now)
+                .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            # Short transactions keep the write lock away from logins and refreshes
+            with transaction.atomic():
+                blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+            batches += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {outstanding} outstanding and {blacklisted} blacklisted tokens '
+            f'in {batches} batches ({time.monotonic() - started:.3f}s).'
+        ))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from app.outbox import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Sends due emails from the outbox over a pool of worker threads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Messages claimed per batch.')
+        parser.add_argument('--workers', type=int, help='Worker threads, each with its own mail connection.')
+        parser.add_argument('--once', action='store_true', help='Send a single batch instead of draining the outbox.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        totals = [0, 0, 0]
+
+        while True:
+            counts = dispatch(batch_size=options['batch_size'], workers=options['workers'])
+            totals = [total + count for total, count in zip(totals, counts)]
+            # A batch that sent nothing means the rest is backing off or the outbox is empty
+            if options['once'] or counts[0] == 0:
+                break
+
+        sent, retried, dead = totals
+        self.stdout.write(self.style.SUCCESS(
+            f'{sent} sent, {retried} scheduled for retry, {dead} dead '
+            f'in {time.monotonic() - started:.3f}s.'
+        ))
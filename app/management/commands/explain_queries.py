@@ -0,0 +1,57 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from app.models import Reservation, Table, TableSlot, Waitlist
+
+
+class Command(BaseCommand):
+    help = 'Prints the query plan of every hot query and flags full table scans.'
+
+    def hot_queries(self):
+        """
+        The queries issued on the booking, waitlist and insights paths, with placeholder values,
+        and the tables each one is expected to scan.
+        """
+        today = datetime.date.today()
+        time = datetime.time(19, 0)
+        return {
+            'booking slot conflict': (TableSlot.objects.filter(table_id=1, date=today, time=time), set()),
+            # The floor plan is small; every other table in the anti-join must be probed by index
+            'available tables for slot': (Table.objects.available_at(today, time, party_size=2), {'app_table'}),
+            'own booking for slot': (Reservation.objects.filter(
+                user_id=1, table_id=1, date=today, time=time, status='booked'), set()),
+            'reservation history': (Reservation.objects.filter(user_id=1).order_by('date', 'time'), set()),
+            'upcoming reservations': (Reservation.objects.filter(date__gte=today).order_by('date', 'time'), set()),
+            'availability calendar': (Reservation.objects.filter(
+                date__range=(today, today + datetime.timedelta(days=13)), status='booked'), set()),
+            'waitlist membership': (Waitlist.objects.filter(
+                user_id=1, table_id=1, date=today, status__in=['waiting', 'notified']), set()),
+            # WaitlistQueues.load: every waiting entry for the dates and capacities being promoted
+            'waitlist queue': (Waitlist.objects.filter(
+                status='waiting', date__in=[today, today + datetime.timedelta(days=1)], table__capacity__in=[2, 4]
+            ).values_list('date', 'table__capacity', 'created_at', 'id'), set()),
+            'waitlist holds': (Waitlist.objects.filter(
+                status='notified', date__in=[today], table__capacity__in=[2, 4], hold_expires_at__gt=timezone.now()
+            ).values('date', 'table__capacity').annotate(entries=Count('id')), set()),
+        }
+
+    def handle(self, *args, **kwargs):
+        scans = 0
+        for name, (queryset, expected_scans) in self.hot_queries().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in queryset.explain().splitlines():
+                words = line.split()
+                # "SCAN <table>" without an index is a full table scan
+                if 'SCAN' in words and 'INDEX' not in words:
+                    table = words[words.index('SCAN') + 1]
+                    if table not in expected_scans:
+                        scans += 1
+                        self.stdout.write(self.style.WARNING(f'  {line}  <-- full scan'))
+                        continue
+                self.stdout.write(f'  {line}')
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f'{scans} unexpected full table scan(s) found.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No unexpected full table scans found.'))
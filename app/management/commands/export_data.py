@@ -0,0 +1,48 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import exports
+from app.serializers import ExportQuerySerializer
+
+
+class Command(BaseCommand):
+    help = 'Streams reservations or waitlist entries to a file or stdout as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--output', default='ndjson', choices=sorted(exports.OUTPUTS))
+        parser.add_argument('--start', help='First date to include (YYYY-MM-DD).')
+        parser.add_argument('--end', help='Last date to include (YYYY-MM-DD).')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output.')
+        parser.add_argument('--file', help='Write here instead of stdout.')
+
+    def handle(self, *args, **options):
+        query = ExportQuerySerializer(data={
+            key: options[key] for key in ('output', 'start', 'end', 'gzip') if options[key] is not None
+        })
+        if not query.is_valid():
+            raise CommandError(query.errors)
+        params = query.validated_data
+
+        started = time.monotonic()
+        queryset = exports.export_queryset(options['kind'], params.get('start'), params.get('end'))
+        encoder = exports.Encoder(options['kind'], params['output'], compress=params['gzip'])
+
+        written = 0
+        target = open(options['file'], 'wb') if options['file'] else sys.stdout.buffer
+        try:
+            for data in exports.stream(queryset, encoder):
+                target.write(data)
+                written += len(data)
+        finally:
+            if options['file']:
+                target.close()
+            else:
+                target.flush()
+
+        if options['file']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Wrote {written} bytes to {options["file"]} in {time.monotonic() - started:.3f}s.'
+            ))
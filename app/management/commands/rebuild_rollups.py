@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from app import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the insights rollup tables from reservations and verifies them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Compare the rollups without rebuilding them.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        if not options['verify_only']:
+            slots, guests = rollups.rebuild()
+            self.stdout.write(f'Rebuilt {slots} slot rows and {guests} guest rows '
+                              f'in {time.monotonic() - started:.3f}s.')
+
+        mismatches = rollups.verify()
+        for kind, key, stored, live in mismatches:
+            self.stderr.write(f'{kind} {key}: rollup has {stored}, reservations have {live}')
+
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} rollup rows disagree with reservations.')
+        self.stdout.write(self.style.SUCCESS('Rollups match the live aggregates.'))
@@ -0,0 +1,310 @@
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.benchmark import LoadGenerator
+from app.management.commands.benchmark_asgi import summarize
+from app.management.commands.seed_benchmark_data import EMAIL_DOMAIN, PASSWORD, STAFF_EMAIL
+from app.models import CustomUser, Reservation, Table, Waitlist
+
+PARTY_SIZES = (2, 2, 2, 4, 4, 6, 8)
+TIMES = ('12:00', '13:00', '18:00', '19:00', '19:30', '20:00', '21:00')
+# Compared against a baseline run, in percent
+COMPARED = ('requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def url(name, *args, **params):
+    path = reverse(name, args=args)
+    return f'{path}?{urlencode(params)}' if params else path
+
+
+def git(*args):
+    try:
+        result = subprocess.run(['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+class Fixture:
+    """
+    What requests are built from: a sample of seeded guests with their tokens,
+    the staff token, the tables in service and the next two weeks.
+    """
+
+    def __init__(self, rng, guests):
+        staff = CustomUser.objects.filter(email=STAFF_EMAIL).first()
+        if staff is None:
+            raise CommandError('No benchmark data; run seed_benchmark_data first.')
+        self.staff = str(AccessToken.for_user(staff))
+
+        seeded = CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}', is_staff=False)
+        bounds = seeded.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            raise CommandError('No seeded guests; run seed_benchmark_data first.')
+        ids = range(bounds['first'], bounds['last'] + 1)
+        users = seeded.filter(id__in=rng.sample(ids, min(guests, len(ids)))).order_by('id')
+        self.guests = [(user.pk, user.email, str(AccessToken.for_user(user))) for user in users]
+        self.tokens = {pk: token for pk, _, token in self.guests}
+
+        self.tables = list(Table.objects.filter(availability_status=True).order_by('id').values_list('id', flat=True))
+        today = timezone.localdate()
+        self.days = [(today + datetime.timedelta(days=offset)).isoformat() for offset in range(1, 15)]
+        # Upcoming bookings of the sampled guests, for the cancel endpoint to use up
+        self.bookings = list(Reservation.objects.filter(user_id__in=self.tokens, status='booked', date__gt=today)
+                             .order_by('id').values_list('id', 'user_id'))
+        rng.shuffle(self.bookings)
+        # Sets new accounts apart from those of earlier runs on the same database
+        self.run = format(time.time_ns(), 'x')
+
+    def guest(self, rng):
+        return rng.choice(self.guests)
+
+    def token(self, rng):
+        return self.guest(rng)[2]
+
+
+# Each builder returns one request, (method, path, body, token), or None when it has run out
+
+def list_tables(rng, fixture):
+    return 'GET', url('list_tables', party_size=rng.choice(PARTY_SIZES)), None, fixture.token(rng)
+
+
+def list_tables_at(rng, fixture):
+    path = url('list_tables', date=rng.choice(fixture.days), time=rng.choice(TIMES), party_size=rng.choice(PARTY_SIZES))
+    return 'GET', path, None, fixture.token(rng)
+
+
+def all_tables(rng, fixture):
+    return 'GET', url('all_tables'), None, fixture.token(rng)
+
+
+def availability_calendar(rng, fixture):
+    path = url('availability_calendar', start=rng.choice(fixture.days), party_size=rng.choice(PARTY_SIZES))
+    return 'GET', path, None, fixture.token(rng)
+
+
+def list_reservations(rng, fixture):
+    return 'GET', url('list_reservations'), None, fixture.token(rng)
+
+
+def reservation_insights(rng, fixture):
+    return 'GET', url('reservation_insights'), None, fixture.staff
+
+
+def export(rng, fixture):
+    day = rng.choice(fixture.days)
+    return 'GET', url('export', 'reservations', start=day, end=day), None, fixture.staff
+
+
+def metrics(rng, fixture):
+    return 'GET', url('metrics'), None, fixture.staff
+
+
+def login(rng, fixture):
+    _, email, _ = fixture.guest(rng)
+    return 'POST', url('login_view'), {'email': email, 'password': PASSWORD}, None
+
+
+def register_user(rng, fixture):
+    email = f'{fixture.run}-{rng.getrandbits(32):08x}@runs.{EMAIL_DOMAIN}'
+    return 'POST', url('register_user'), {'email': email, 'full_name': 'Bench Runner', 'password': PASSWORD}, None
+
+
+def create_reservation(rng, fixture):
+    body = {'date': rng.choice(fixture.days), 'time': rng.choice(TIMES)}
+    return 'POST', url('create_reservation', rng.choice(fixture.tables)), body, fixture.token(rng)
+
+
+def batch_reservations(rng, fixture):
+    day, time = rng.choice(fixture.days), rng.choice(TIMES)
+    slots = [{'table': table, 'date': day, 'time': time} for table in rng.sample(fixture.tables, min(2, len(fixture.tables)))]
+    return 'POST', url('batch_reservations'), {'slots': slots}, fixture.token(rng)
+
+
+def assign_reservation(rng, fixture):
+    body = {'party_size': rng.choice(PARTY_SIZES), 'date': rng.choice(fixture.days), 'time': rng.choice(TIMES)}
+    return 'POST', url('assign_reservation'), body, fixture.token(rng)
+
+
+def add_to_waitlist(rng, fixture):
+    return 'POST', url('add_to_waitlist', rng.choice(fixture.tables)), {'date': rng.choice(fixture.days)}, fixture.token(rng)
+
+
+def cancel_reservation(rng, fixture):
+    if not fixture.bookings:
+        return None
+    reservation_id, user_id = fixture.bookings.pop()
+    return 'DELETE', url('cancel-reservation', reservation_id), None, fixture.tokens[user_id]
+
+
+READS = {
+    'list_tables': list_tables,
+    'list_tables_at': list_tables_at,
+    'all_tables': all_tables,
+    'availability_calendar': availability_calendar,
+    'list_reservations': list_reservations,
+    'reservation_insights': reservation_insights,
+    'export': export,
+    'metrics': metrics,
+    'login': login,
+}
+
+# These change the data, so runs that include them are only comparable from a freshly seeded database
+WRITES = {
+    'register_user': register_user,
+    'create_reservation': create_reservation,
+    'batch_reservations': batch_reservations,
+    'assign_reservation': assign_reservation,
+    'add_to_waitlist': add_to_waitlist,
+    'cancel_reservation': cancel_reservation,
+}
+
+
+class Command(BaseCommand):
+    help = ('Drives each endpoint with concurrent requests from threads or processes, through the test client '
+            'or against a running server, and reports throughput and latency percentiles as JSON. '
+            'Run it on a database filled by seed_benchmark_data; the same seed sends the same requests, '
+            'so reports from different commits can be compared with --baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', help='Base URL of a running server (defaults to the in-process test client).')
+        parser.add_argument('--mode', choices=['threads', 'processes'], default='threads', help='What the workers are.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Workers sending requests at once.')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=20, help='Requests per endpoint sent before measuring.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=[*READS, *WRITES],
+                            help='Endpoint to run; repeatable (defaults to every read endpoint).')
+        parser.add_argument('--writes', action='store_true', help='Also run the endpoints that change data.')
+        parser.add_argument('--guests', type=int, default=200, help='Seeded guests to send requests as.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the requests sent.')
+        parser.add_argument('--cached', action='store_true', help='Leave the response cache on.')
+        parser.add_argument('--output', help='File to write the report to, as well as printing it.')
+        parser.add_argument('--baseline', help='An earlier report to compare against.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        names = options['endpoints'] or [*READS, *(WRITES if options['writes'] else ())]
+        fixture = Fixture(random.Random(options['seed']), options['guests'])
+        # Counted before the run, since the write endpoints change them
+        report = {
+            'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+            'started_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'data': {
+                'users': CustomUser.objects.count(),
+                'tables': len(fixture.tables),
+                'reservations': Reservation.objects.count(),
+                'booked': Reservation.objects.filter(status='booked').count(),
+                'waitlist': Waitlist.objects.count(),
+            },
+            'options': {
+                'target': options['server'] or 'test client',
+                'mode': options['mode'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'guests': len(fixture.guests),
+                'seed': options['seed'],
+                'cached': options['cached'],
+            },
+        }
+
+        # Every endpoint draws from its own generator, so its requests do not depend on which others run
+        plans = {}
+        for name in names:
+            build = READS.get(name) or WRITES[name]
+            rng = random.Random(f'{options["seed"]}:{name}')
+            requests = (build(rng, fixture) for _ in range(options['warmup'] + options['requests']))
+            plans[name] = [request for request in requests if request is not None]
+
+        # Run as production does, with no SQL logging or query budgets; with a cache
+        # timeout of 0 nothing is stored, so every read reaches the database
+        overrides = {'DEBUG': False, 'QUERY_BUDGET': {'MODE': 'off'}}
+        if not options['cached']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+
+        endpoints = {}
+        with override_settings(**overrides):
+            generator = LoadGenerator(options['mode'], options['concurrency'], options['server'], overrides)
+            try:
+                for name, requests in plans.items():
+                    warmup, measured = requests[:options['warmup']], requests[options['warmup']:]
+                    if not measured:
+                        self.stderr.write(f'Skipped {name}: nothing left to request.')
+                        continue
+                    if warmup:
+                        generator.run(warmup)
+                    endpoints[name] = self.summarize(*generator.run(measured))
+            finally:
+                generator.close()
+        report['endpoints'] = endpoints
+
+        if baseline is not None:
+            report['baseline'] = self.compare(report, baseline)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+    def summarize(self, timings, elapsed):
+        latencies = [seconds for seconds, _ in timings]
+        statuses = Counter(status for _, status in timings)
+        summary = summarize(latencies, elapsed)
+        summary['mean_ms'] = round(sum(latencies) / len(latencies) * 1000, 2)
+        summary['max_ms'] = round(max(latencies) * 1000, 2)
+        # Server errors and requests that got no response at all
+        summary['errors'] = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+        summary['statuses'] = {str(status): count for status, count in sorted(statuses.items())}
+        return summary
+
+    def compare(self, report, baseline):
+        """
+        The change from `baseline` of each endpoint both reports ran, in percent.
+        """
+        changes = {}
+        for name, summary in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if before is None:
+                continue
+            changes[name] = {
+                metric: round((summary[metric] - before[metric]) / before[metric] * 100, 1)
+                for metric in COMPARED if before.get(metric)
+            }
+        return {
+            'commit': baseline.get('commit'),
+            # Different data or load make the numbers meaningless side by side
+            'comparable': baseline.get('data') == report['data'] and baseline.get('options') == report['options'],
+            'change_percent': changes,
+        }
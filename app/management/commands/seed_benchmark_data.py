@@ -0,0 +1,256 @@
+import datetime
+import math
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app import rollups
+from app.availability import calendar_setting
+from app.models import CustomUser, Reservation, Table, TableSlot, Waitlist, slot_time
+from app.waitlist import waitlist_setting
+
+EMAIL_DOMAIN = 'bench.example.com'
+STAFF_EMAIL = f'staff@{EMAIL_DOMAIN}'
+# Every seeded user signs in with this, so run_benchmarks can log in as any of them
+PASSWORD = 'bench-password'
+
+# Share of tables by number of seats
+CAPACITIES = {2: 35, 4: 40, 6: 15, 8: 10}
+# Relative bookings by weekday, Monday first: quiet early week, busy Friday and Saturday
+WEEKDAYS = (0.6, 0.7, 0.8, 1.0, 1.5, 1.7, 1.1)
+# Relative bookings by hour of the day: a lunch peak and a larger dinner peak
+HOURS = {11: 2, 12: 6, 13: 5, 14: 2, 15: 1, 16: 1, 17: 3, 18: 7, 19: 9, 20: 8, 21: 4, 22: 2}
+MINUTES = (0, 0, 0, 15, 30, 30, 45)
+# Waitlist entries by status
+WAITLIST_STATUSES = {'waiting': 80, 'notified': 5, 'confirmed': 10, 'expired': 5}
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with users, tables, reservations and waitlist entries for benchmarking, '
+            'with bookings skewed towards weekends, meal times, the near future and a core of regulars. '
+            'Meant for an empty database (see DB_NAME); the same options and seed give the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000, help='Guests to create.')
+        parser.add_argument('--tables', type=int, default=200, help='Tables to have in all, counting existing ones.')
+        parser.add_argument('--reservations', type=int, default=500000, help='Reservations to create.')
+        parser.add_argument('--waitlist', type=int, default=50000, help='Waitlist entries to create.')
+        parser.add_argument('--past-days', type=int, default=365, help='Days of history before today.')
+        parser.add_argument('--future-days', type=int, default=60, help='Days bookable from today on.')
+        parser.add_argument('--cancelled', type=float, default=0.1, help='Share of reservations that are cancelled.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').exists():
+            raise CommandError('Benchmark data is already seeded; start from an empty database.')
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError(f'{connection.vendor} does not return ids from bulk inserts, which seeding relies on.')
+
+        self.rng = random.Random(options['seed'])
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.today = timezone.localdate()
+        self.now = timezone.now()
+        # When each (date, time) booked starts, as an aware datetime
+        self.starts = {}
+        self.days = [self.today + datetime.timedelta(days=offset)
+                     for offset in range(-options['past_days'], options['future_days'])]
+        started = time.monotonic()
+
+        users = self.seed_users(options['users'])
+        tables = self.seed_tables(options['tables'])
+        booked, cancelled = self.seed_reservations(users, tables, options['reservations'], options['cancelled'])
+        entries = self.seed_waitlist(users, tables, options['waitlist'])
+        slots, guests = rollups.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users, {len(tables)} tables, {booked} booked and {cancelled} cancelled '
+            f'reservations, {entries} waitlist entries and {slots} slot rollups '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def progress(self, kind, done, total):
+        if self.verbosity > 1:
+            self.stdout.write(f'{kind}: {done}/{total}')
+
+    def seed_users(self, count):
+        """
+        The guests' ids, weighted so a few regulars account for a large share of bookings.
+        """
+        # One hash for everyone: hashing each password would take longer than the rest put together
+        password = make_password(PASSWORD)
+        CustomUser.objects.create(email=STAFF_EMAIL, full_name='Bench Staff', password=password, is_staff=True)
+        ids = []
+        for first in range(0, count, self.batch_size):
+            batch = [
+                CustomUser(email=f'guest{n}@{EMAIL_DOMAIN}', full_name=f'Guest {n}', password=password)
+                for n in range(first, min(count, first + self.batch_size))
+            ]
+            with transaction.atomic():
+                ids += [user.pk for user in CustomUser.objects.bulk_create(batch)]
+            self.progress('Users', len(ids), count)
+        self.user_weights = list(accumulate(1 / (rank + 1) ** 0.7 for rank in range(len(ids))))
+        return ids
+
+    def seed_tables(self, count):
+        """
+        Top the tables up to `count`, returning (id, capacity) for all of them.
+        """
+        existing = Table.objects.count()
+        if existing < count:
+            first = (Table.objects.order_by('-table_number').values_list('table_number', flat=True).first() or 0) + 1
+            capacities = self.rng.choices(list(CAPACITIES), weights=list(CAPACITIES.values()), k=count - existing)
+            Table.objects.bulk_create(
+                [Table(table_number=first + n, capacity=capacity) for n, capacity in enumerate(capacities)],
+                batch_size=self.batch_size,
+            )
+        return list(Table.objects.filter(availability_status=True).order_by('id').values_list('id', 'capacity'))
+
+    def day_weights(self):
+        """
+        Cumulative weights of self.days: busier weekends, trade growing over the
+        past and bookings thinning out the further ahead a day is.
+        """
+        weights = []
+        for day in self.days:
+            offset = (day - self.today).days
+            if offset < 0:
+                trend = 1 + offset / (2 * len(self.days))
+            else:
+                trend = math.exp(-offset / 21)
+            weights.append(WEEKDAYS[day.weekday()] * trend)
+        return list(accumulate(weights))
+
+    def booking_times(self):
+        """
+        The times bookings are made for, and their cumulative weights, within opening hours.
+        """
+        opens = datetime.time.fromisoformat(calendar_setting('OPENS'))
+        closes = datetime.time.fromisoformat(calendar_setting('CLOSES'))
+        times, weights = [], []
+        for hour, weight in HOURS.items():
+            for minute in MINUTES:
+                value = datetime.time(hour, minute)
+                if opens <= value < closes:
+                    times.append(value)
+                    weights.append(weight)
+        if not times:
+            raise CommandError('No booking hours fall within CALENDAR opening hours.')
+        return times, list(accumulate(weights))
+
+    def created_at(self, date, at):
+        """
+        When a booking for `at` on `date` was made: mostly days ahead, never in the future.
+        """
+        starts = self.starts.get((date, at))
+        if starts is None:
+            starts = self.starts[date, at] = timezone.make_aware(datetime.datetime.combine(date, at))
+        lead = datetime.timedelta(hours=self.rng.expovariate(1 / 96))
+        return min(starts - lead, self.now - datetime.timedelta(seconds=self.rng.randrange(1, 86400)))
+
+    def seed_reservations(self, users, tables, count, cancelled_share):
+        """
+        Booked and cancelled reservations, each booked one with its TableSlot.
+
+        No two booked reservations share a table and slot, counting bookings already in the database.
+        """
+        if not tables:
+            raise CommandError('There are no tables in service to book.')
+        times, time_weights = self.booking_times()
+        # Shared time objects keep the set of taken slots small at millions of bookings
+        slot_of = {value: slot_time(value) for value in times}
+        slots_per_day = len(set(slot_of.values()))
+        to_book = round(count * (1 - cancelled_share))
+        if to_book > 0.8 * len(tables) * len(self.days) * slots_per_day:
+            raise CommandError(f'{to_book} bookings would fill over 80% of the slots of {len(tables)} tables '
+                               f'over {len(self.days)} days; add tables or days.')
+
+        day_weights = self.day_weights()
+        taken = set(TableSlot.objects.filter(date__range=(self.days[0], self.days[-1]))
+                    .values_list('table_id', 'date', 'time'))
+        booked = cancelled = skipped = 0
+        while booked + cancelled + skipped < count:
+            size = min(self.batch_size, count - booked - cancelled - skipped)
+            dates = self.rng.choices(self.days, cum_weights=day_weights, k=size)
+            ats = self.rng.choices(times, cum_weights=time_weights, k=size)
+            guests = self.rng.choices(users, cum_weights=self.user_weights, k=size)
+            batch = []
+            for date, at, user_id in zip(dates, ats, guests):
+                if self.rng.random() < cancelled_share:
+                    table_id = self.rng.choice(tables)[0]
+                    batch.append(Reservation(user_id=user_id, table_id=table_id, date=date, time=at,
+                                             status='cancelled', created_at=self.created_at(date, at)))
+                    continue
+                # A taken slot sends the party to another table at the same time, as a host
+                # would, and a slot taken at every table tried sends it to another time
+                for attempt in range(32):
+                    if attempt and attempt % 8 == 0:
+                        date = self.rng.choices(self.days, cum_weights=day_weights)[0]
+                        at = self.rng.choices(times, cum_weights=time_weights)[0]
+                    table_id = self.rng.choice(tables)[0]
+                    key = (table_id, date, slot_of[at])
+                    if key not in taken:
+                        taken.add(key)
+                        batch.append(Reservation(user_id=user_id, table_id=table_id, date=date, time=at,
+                                                 status='booked', created_at=self.created_at(date, at)))
+                        break
+                else:
+                    skipped += 1
+            with transaction.atomic():
+                reservations = Reservation.objects.bulk_create(batch)
+                TableSlot.objects.bulk_create([
+                    TableSlot(table_id=reservation.table_id, date=reservation.date,
+                              time=slot_of[reservation.time], reservation_id=reservation.pk)
+                    for reservation in reservations if reservation.status == 'booked'
+                ])
+            booked += sum(reservation.status == 'booked' for reservation in reservations)
+            cancelled += sum(reservation.status == 'cancelled' for reservation in reservations)
+            self.progress('Reservations', booked + cancelled + skipped, count)
+        if skipped:
+            self.stderr.write(f'Skipped {skipped} bookings that found no free table at any time tried.')
+        return booked, cancelled
+
+    def seed_waitlist(self, users, tables, count):
+        """
+        Waitlist entries for today and the days ahead, at most one active entry per guest, table and day.
+        """
+        upcoming = [day for day in self.days if day >= self.today]
+        if not upcoming:
+            return 0
+        weights = list(accumulate(WEEKDAYS[day.weekday()] * math.exp(-(day - self.today).days / 14) for day in upcoming))
+        hold = datetime.timedelta(minutes=waitlist_setting('HOLD_MINUTES'))
+        statuses = list(WAITLIST_STATUSES)
+        active = set()
+        created = skipped = 0
+        for first in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - first)
+            dates = self.rng.choices(upcoming, cum_weights=weights, k=size)
+            picked = self.rng.choices(statuses, weights=list(WAITLIST_STATUSES.values()), k=size)
+            guests = self.rng.choices(users, cum_weights=self.user_weights, k=size)
+            batch = []
+            for date, status, user_id in zip(dates, picked, guests):
+                table_id = self.rng.choice(tables)[0]
+                if status in ('waiting', 'notified'):
+                    if (user_id, table_id, date) in active:
+                        skipped += 1
+                        continue
+                    active.add((user_id, table_id, date))
+                created_at = self.now - datetime.timedelta(minutes=self.rng.expovariate(1 / 720))
+                hold_expires_at = None
+                if status == 'notified':
+                    hold_expires_at = self.now + hold * self.rng.random()
+                batch.append(Waitlist(user_id=user_id, table_id=table_id, date=date, status=status,
+                                      created_at=created_at, hold_expires_at=hold_expires_at))
+            with transaction.atomic():
+                Waitlist.objects.bulk_create(batch)
+            created += len(batch)
+            self.progress('Waitlist', first + size, count)
+        if skipped:
+            self.stderr.write(f'Skipped {skipped} waitlist entries that were already active for that guest, table and day.')
+        return created
@@ -0,0 +1,103 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.assignment import FreeTables
+
+# How often each party size shows up
+PARTY_SIZES = {1: 5, 2: 40, 3: 12, 4: 25, 5: 6, 6: 7, 7: 3, 8: 2}
+
+
+def parse_tables(spec, rng):
+    """
+    "2x10,4x8" -> ten 2-seat and eight 4-seat (capacity, table_number, table_id)
+    tuples, numbered in random order as tables on a real floor would be.
+    """
+    capacities = []
+    for part in spec.split(','):
+        capacity, count = (int(value) for value in part.lower().split('x'))
+        capacities += [capacity] * count
+    numbers = list(range(1, len(capacities) + 1))
+    rng.shuffle(numbers)
+    return [(capacity, number, number) for capacity, number in zip(capacities, numbers)]
+
+
+class Floor:
+    """
+    One slot's tables, assignable either by the best-fit index or by a first-fit scan.
+    """
+
+    def __init__(self, tables):
+        self.index = FreeTables(tables)
+        self.free = set(tables)
+        self.by_number = sorted(tables, key=lambda table: table[1])
+
+    def best_fit(self, party_size):
+        return self.index.best_fit(party_size)
+
+    def first_fit(self, party_size):
+        # What a client does without assignment: try tables in number order until one fits
+        for table in self.by_number:
+            if table[0] >= party_size and table in self.free:
+                return table
+        return None
+
+    def take(self, table):
+        self.index.take(table)
+        self.free.discard(table)
+
+
+class Command(BaseCommand):
+    help = 'Simulates table assignment per slot and reports seat utilization and assignment latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', default='2x10,4x10,6x6,8x4', help='capacityxcount, comma separated.')
+        parser.add_argument('--slots', type=int, default=2000, help='Slots to simulate.')
+        parser.add_argument('--demand', type=float, default=1.5, help='Parties arriving per table, per slot.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            tables = parse_tables(options['tables'], random.Random(options['seed']))
+        except ValueError:
+            raise CommandError('--tables must look like 2x10,4x8.')
+        sizes, weights = zip(*PARTY_SIZES.items())
+        arrivals = int(len(tables) * options['demand'])
+
+        results = {}
+        for strategy in ('best_fit', 'first_fit'):
+            rng = random.Random(options['seed'])
+            parties = seated = guests = seats = 0
+            latencies = []
+            for _ in range(options['slots']):
+                floor = Floor(tables)
+                assign = getattr(floor, strategy)
+                for party_size in rng.choices(sizes, weights, k=arrivals):
+                    parties += 1
+                    started = time.perf_counter()
+                    table = assign(party_size)
+                    latencies.append(time.perf_counter() - started)
+                    if table is None:
+                        continue
+                    floor.take(table)
+                    seated += 1
+                    guests += party_size
+                    seats += table[0]
+
+            centiles = statistics.quantiles(latencies, n=100)
+            results[strategy] = {
+                'parties': parties,
+                'seated': seated,
+                'acceptance': round(seated / parties, 4),
+                # Guests per seat on the tables that were given out
+                'seat_utilization': round(guests / seats, 4) if seats else None,
+                # Guests per seat across the whole floor
+                'floor_utilization': round(guests / (sum(table[0] for table in tables) * options['slots']), 4),
+                'p50_us': round(centiles[49] * 1e6, 3),
+                'p99_us': round(centiles[98] * 1e6, 3),
+            }
+
+        self.stdout.write(json.dumps({'tables': len(tables), 'arrivals_per_slot': arrivals, **results}, indent=2))
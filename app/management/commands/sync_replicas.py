@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copies the primary SQLite database onto each configured replica file, for running replicas locally.'
+
+    def handle(self, *args, **options):
+        aliases = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not aliases:
+            raise CommandError('No replicas configured; set DB_REPLICAS to one or more SQLite file paths.')
+
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('sync_replicas only copies SQLite databases.')
+
+        # Drop this process's replica connections so none holds a stale snapshot
+        for alias in aliases:
+            connections[alias].close()
+
+        source = sqlite3.connect(str(primary['NAME']))
+        try:
+            for alias in aliases:
+                started = time.monotonic()
+                target = sqlite3.connect(str(settings.DATABASES[alias]['NAME']))
+                try:
+                    # The online backup API copies a consistent snapshot while writers continue
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Copied the primary to {alias} in {time.monotonic() - started:.3f}s.'
+                ))
+        finally:
+            source.close()
@@ -0,0 +1,206 @@
+"""
+Per-route request metrics, exposed in the Prometheus text format.
+
+MetricsMiddleware records, for every request and by resolved URL name, the
+status code, latency (as a histogram) and response size. A sample of
+requests, METRICS['QUERY_SAMPLE_RATE'] of them, also counts database
+queries and their total time through an execute wrapper that every
+connection gets when it opens (see app/signals.py). The request being
+sampled is carried in a context variable, so queries run in sync_to_async
+threads are counted against it too, and unsampled queries cost one lookup.
+
+Aggregates are sharded per thread: each thread only ever writes its own
+shard, so recording takes no lock. A scrape adds the shards up. Figures are
+per process.
+"""
+import contextvars
+import random
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Share of requests whose database queries are counted and timed
+    'QUERY_SAMPLE_RATE': 1.0,
+    # Upper bounds of the latency histogram buckets, in seconds
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+}
+
+
+def metrics_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+class QueryRecord:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# The QueryRecord of the sampled request being handled, if any
+current_queries = contextvars.ContextVar('current_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    record = current_queries.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.seconds += perf_counter() - started
+
+
+def install(connection):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class RouteStats:
+    __slots__ = ('buckets', 'latency', 'statuses', 'bytes', 'sampled', 'queries', 'query_seconds')
+
+    def __init__(self, bucket_count):
+        # One count per bucket bound, plus +Inf
+        self.buckets = [0] * (bucket_count + 1)
+        self.latency = 0.0
+        self.statuses = {}
+        self.bytes = 0
+        self.sampled = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self.bounds = tuple(metrics_setting('BUCKETS'))
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def shard(self):
+        """
+        This thread's {route: RouteStats}; the lock is only taken the first time.
+        """
+        try:
+            return self.local.routes
+        except AttributeError:
+            routes = self.local.routes = {}
+            with self.lock:
+                self.shards.append(routes)
+            return routes
+
+    def record(self, route, status, latency, size, queries=None):
+        routes = self.shard()
+        stats = routes.get(route)
+        if stats is None:
+            stats = routes[route] = RouteStats(len(self.bounds))
+        stats.buckets[bisect_left(self.bounds, latency)] += 1
+        stats.latency += latency
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.bytes += size
+        if queries is not None:
+            stats.sampled += 1
+            stats.queries += queries.queries
+            stats.query_seconds += queries.seconds
+
+    def totals(self):
+        """
+        Every shard added up, as {route: RouteStats}.
+        """
+        with self.lock:
+            shards = list(self.shards)
+        merged = {}
+        for routes in shards:
+            for route, stats in list(routes.items()):
+                total = merged.get(route)
+                if total is None:
+                    total = merged[route] = RouteStats(len(self.bounds))
+                total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+                total.latency += stats.latency
+                for status, count in list(stats.statuses.items()):
+                    total.statuses[status] = total.statuses.get(status, 0) + count
+                total.bytes += stats.bytes
+                total.sampled += stats.sampled
+                total.queries += stats.queries
+                total.query_seconds += stats.query_seconds
+        return merged
+
+    def reset(self):
+        with self.lock:
+            for routes in self.shards:
+                routes.clear()
+
+
+registry = Registry()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+def response_size(response):
+    if response.streaming:
+        return 0
+    return len(response.content)
+
+
+def prometheus_text(prefix='flavorscape'):
+    """
+    Every metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    routes = sorted(registry.totals().items())
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+
+    family('requests_total', 'counter', 'Requests handled, by route and status code.')
+    for route, stats in routes:
+        for status, count in sorted(stats.statuses.items()):
+            lines.append(f'{prefix}_requests_total{{route="{route}",status="{status}"}} {count}')
+
+    family('request_duration_seconds', 'histogram', 'Time spent handling requests, by route.')
+    for route, stats in routes:
+        cumulative = 0
+        for bound, count in zip((*registry.bounds, '+Inf'), stats.buckets):
+            cumulative += count
+            lines.append(f'{prefix}_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_request_duration_seconds_sum{{route="{route}"}} {stats.latency:.6f}')
+        lines.append(f'{prefix}_request_duration_seconds_count{{route="{route}"}} {cumulative}')
+
+    family('response_bytes_total', 'counter', 'Response body bytes sent, by route; streamed bodies are not counted.')
+    for route, stats in routes:
+        lines.append(f'{prefix}_response_bytes_total{{route="{route}"}} {stats.bytes}')
+
+    family('db_sampled_requests_total', 'counter', 'Requests whose database queries were counted, by route.')
+    for route, stats in routes:
+        lines.append(f'{prefix}_db_sampled_requests_total{{route="{route}"}} {stats.sampled}')
+
+    family('db_queries_total', 'counter', 'Database queries run by sampled requests, by route.')
+    for route, stats in routes:
+        lines.append(f'{prefix}_db_queries_total{{route="{route}"}} {stats.queries}')
+
+    family('db_query_seconds_total', 'counter', 'Time spent in database queries by sampled requests, by route.')
+    for route, stats in routes:
+        lines.append(f'{prefix}_db_query_seconds_total{{route="{route}"}} {stats.query_seconds:.6f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def sample():
+    """
+    A QueryRecord if this request's queries should be counted, else None.
+    """
+    rate = metrics_setting('QUERY_SAMPLE_RATE')
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        return QueryRecord()
+    return None
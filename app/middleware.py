@@ -0,0 +1,121 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from . import budgets, metrics
+from .routers import replica_reads, replicas, stick_to_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class ReplicaStickinessMiddleware(MiddlewareMixin):
+    """
+    Start every request on the primary, and pin users who just wrote something to it.
+    """
+
+    def process_request(self, request):
+        # Worker threads are reused, so clear what the previous request chose
+        replica_reads.set(False)
+
+    def process_response(self, request, response):
+        replica_reads.set(False)
+        if not replicas() or request.method in SAFE_METHODS or response.status_code >= 400:
+            return response
+        # DRF copies the token-authenticated user onto the Django request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            stick_to_primary(user.pk)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record every request's latency, status and size per route (see app/metrics.py).
+
+    Runs natively under both WSGI and ASGI, so async views are not pushed
+    through a thread just to be measured. Put it first to time the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.metrics_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = metrics.sample()
+        token = metrics.current_queries.set(queries)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        self.record(request, response, perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = metrics.sample()
+        token = metrics.current_queries.set(queries)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        self.record(request, response, perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, latency, queries):
+        metrics.registry.record(
+            metrics.route_name(request), response.status_code, latency, metrics.response_size(response), queries
+        )
+
+
+class QueryBudgetMiddleware:
+    """
+    Warn or raise when a view runs more queries than its budget (see app/budgets.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if budgets.budget_setting('MODE') == 'off':
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def start(self):
+        # Share the record of a request MetricsMiddleware sampled, so its counts stay whole
+        record = metrics.current_queries.get()
+        if record is None:
+            record = metrics.QueryRecord()
+        return record, record.queries, metrics.current_queries.set(record)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        record, before, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        budgets.check(request, record.queries - before)
+        return response
+
+    async def __acall__(self, request):
+        record, before, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_queries.reset(token)
+        budgets.check(request, record.queries - before)
+        return response
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:03
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Slots were an hour long when this migration was written; kept here rather than read from
+# app.models or settings so that later changes to either cannot change what it backfills
+SLOT_MINUTES = 60
+
+
+def slot_time(value):
+    start = (value.hour * 60 + value.minute) // SLOT_MINUTES * SLOT_MINUTES
+    return datetime.time(start // 60, start % 60)
+
+
+def backfill_slots(apps, schema_editor):
+    Reservation = apps.get_model('app', 'Reservation')
+    Table = apps.get_model('app', 'Table')
+    TableSlot = apps.get_model('app', 'TableSlot')
+    # availability_status used to be cleared by every booking and never set again;
+    # from here on it means "in service", and bookings live in TableSlot
+    Table.objects.update(availability_status=True)
+    booked = Reservation.objects.filter(status='booked', table__isnull=False).order_by('created_at')
+    TableSlot.objects.bulk_create(
+        [
+            TableSlot(table_id=r.table_id, date=r.date, time=slot_time(r.time), reservation_id=r.id)
+            for r in booked.iterator()
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('reservation', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='slot', to='app.reservation')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='app.table')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'time'], name='tableslot_date_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('table', 'date', 'time'), name='unique_table_slot')],
+            },
+        ),
+        migrations.RunPython(backfill_slots, migrations.RunPython.noop),
+    ]
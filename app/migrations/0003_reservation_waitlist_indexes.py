@@ -0,0 +1,77 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def duplicates(queryset, fields):
+    """
+    Ids of the rows of `queryset` that repeat an earlier row's `fields`, the earliest created kept.
+    """
+    ids = []
+    clashes = queryset.values(*fields).annotate(n=Count('id')).filter(n__gt=1).order_by()
+    for clash in list(clashes):
+        rows = queryset.filter(**{field: clash[field] for field in fields}).order_by('created_at', 'id')
+        ids += list(rows.values_list('id', flat=True))[1:]
+    return ids
+
+
+def resolve_duplicates(apps, schema_editor):
+    """
+    Cancel double bookings and expire repeated waitlist entries left by the old
+    unchecked writes, so the unique constraints below can be added.
+    """
+    Reservation = apps.get_model('app', 'Reservation')
+    TableSlot = apps.get_model('app', 'TableSlot')
+    Waitlist = apps.get_model('app', 'Waitlist')
+
+    booked = Reservation.objects.filter(status='booked', table__isnull=False)
+    cancelled = duplicates(booked, ['table', 'date', 'time'])
+    for first in range(0, len(cancelled), 500):
+        batch = cancelled[first:first + 500]
+        Reservation.objects.filter(id__in=batch).update(status='cancelled')
+        TableSlot.objects.filter(reservation_id__in=batch).delete()
+
+    active = Waitlist.objects.filter(status__in=['waiting', 'notified'], table__isnull=False)
+    expired = duplicates(active, ['user', 'table', 'date'])
+    for first in range(0, len(expired), 500):
+        Waitlist.objects.filter(id__in=expired[first:first + 500]).update(status='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_tableslot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'table', 'date', 'time', 'status'], name='reservation_booking_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'date', 'time'], name='reservation_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['date', 'time'], name='reservation_date_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlist',
+            index=models.Index(fields=['user', 'table', 'date', 'status'], name='waitlist_member_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlist',
+            index=models.Index(fields=['table', 'date', 'status', 'created_at'], name='waitlist_queue_idx'),
+        ),
+        migrations.RunPython(resolve_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'booked')), fields=('table', 'date', 'time'), name='unique_booked_reservation'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlist',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['waiting', 'notified'])), fields=('user', 'table', 'date'), name='unique_active_waitlist_entry'),
+        ),
+    ]
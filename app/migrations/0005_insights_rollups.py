@@ -0,0 +1,63 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:09
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from app.models import slot_time
+
+
+def populate_rollups(apps, schema_editor):
+    Reservation = apps.get_model('app', 'Reservation')
+    SlotRollup = apps.get_model('app', 'SlotRollup')
+    GuestRollup = apps.get_model('app', 'GuestRollup')
+    booked = Reservation.objects.filter(status='booked')
+
+    slots = Counter()
+    for row in booked.values('date', 'time').annotate(n=Count('id')).order_by():
+        slots[(row['date'], slot_time(row['time']))] += row['n']
+    SlotRollup.objects.bulk_create(
+        [SlotRollup(date=date, time=time, bookings=n) for (date, time), n in slots.items()],
+        batch_size=1000,
+    )
+    GuestRollup.objects.bulk_create(
+        [GuestRollup(user_id=user_id, reservation_count=n)
+         for user_id, n in booked.values_list('user').annotate(n=Count('id')).order_by()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuestRollup',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reservation_rollup', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('reservation_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-reservation_count', 'user'], name='guest_rollup_count_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SlotRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('bookings', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'time'), name='unique_slot_rollup')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index simplejwt's OutstandingToken.expires_at so compact_tokens can find
+    expired tokens without scanning the whole table.
+    """
+
+    dependencies = [
+        ('app', '0005_insights_rollups'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS outstandingtoken_expires_idx '
+            'ON token_blacklist_outstandingtoken (expires_at);',
+            'DROP INDEX IF EXISTS outstandingtoken_expires_idx;',
+        ),
+    ]
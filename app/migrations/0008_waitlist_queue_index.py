@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_waitlist_hold'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='waitlist',
+            name='waitlist_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='waitlist',
+            index=models.Index(fields=['status', 'date', 'created_at'], name='waitlist_queue_idx'),
+        ),
+    ]
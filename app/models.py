@@ -1,4 +1,7 @@
+import datetime
+
 from django.db import models
+from django.db.models import Exists, OuterRef
 from django.conf import settings
 from django.utils.timezone import now
 
@@ -48,12 +51,36 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
 # Create your models here.
 
+def slot_time(value):
+    """
+    Round a reservation time down to the start of its booking slot.
+    """
+    minutes = getattr(settings, 'RESERVATION_SLOT_MINUTES', 60)
+    start = (value.hour * 60 + value.minute) // minutes * minutes
+    return datetime.time(start // 60, start % 60)
+
+
+class TableQuerySet(models.QuerySet):
+    def available_at(self, date, time, party_size=None):
+        """
+        Tables in service with no booking for the slot containing `time` on `date`.
+        """
+        booked = TableSlot.objects.filter(table=OuterRef('pk'), date=date, time=slot_time(time))
+        tables = self.filter(availability_status=True).exclude(Exists(booked))
+        if party_size:
+            tables = tables.filter(capacity__gte=party_size)
+        return tables
+
+
 # Models
 class Table(models.Model):
     table_number = models.IntegerField(unique=True)
     capacity = models.IntegerField()
+    # Whether the table is in service at all; per-slot bookings live in TableSlot.
     availability_status = models.BooleanField(default=True)
 
+    objects = TableQuerySet.as_manager()
+
     def __str__(self):
         return f"Table {self.table_number}"
 
@@ -66,18 +93,130 @@ class Reservation(models.Model):
     status = models.CharField(max_length=20, choices=[('booked', 'Booked'), ('cancelled', 'Cancelled')] ,default="cancelled")
     created_at = models.DateTimeField(default=now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'table', 'date', 'time', 'status'], name='reservation_booking_idx'),
+            models.Index(fields=['user', 'date', 'time'], name='reservation_user_date_idx'),
+            models.Index(fields=['date', 'time'], name='reservation_date_time_idx'),
+        ]
+        constraints = [
+            # At most one active booking per table and time
+            models.UniqueConstraint(
+                fields=['table', 'date', 'time'],
+                condition=models.Q(status='booked'),
+                name='unique_booked_reservation',
+            ),
+        ]
 
     def __str__(self):
         return f"Reservation for {self.user} on {self.date} at {self.time}"
 
 
+class TableSlot(models.Model):
+    """
+    One booked slot of a table on a given date.
+    """
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='slots')
+    date = models.DateField()
+    time = models.TimeField()
+    reservation = models.OneToOneField(Reservation, on_delete=models.CASCADE, null=True, blank=True, related_name='slot')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'date', 'time'], name='unique_table_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'time'], name='tableslot_date_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"Table {self.table_id} booked on {self.date} at {self.time}"
+
+
 class Waitlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     table = models.ForeignKey(Table, on_delete=models.SET_NULL, null=True)
     date = models.DateField()
-    status = models.CharField(max_length=50, default="waiting")  # waiting, notified, confirmed
+    status = models.CharField(max_length=50, default="waiting")  # waiting, notified, confirmed, expired
     created_at = models.DateTimeField(default=now)
+    # While notified, the table is held for this entry until then
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'table', 'date', 'status'], name='waitlist_member_idx'),
+            models.Index(fields=['status', 'date', 'created_at'], name='waitlist_queue_idx'),
+            models.Index(fields=['status', 'hold_expires_at'], name='waitlist_hold_idx'),
+        ]
+        constraints = [
+            # A user can only wait once for the same table and date
+            models.UniqueConstraint(
+                fields=['user', 'table', 'date'],
+                condition=models.Q(status__in=['waiting', 'notified']),
+                name='unique_active_waitlist_entry',
+            ),
+        ]
 
     def __str__(self):
         return f"Waitlist entry for {self.user}"
 
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the outbox dispatcher.
+    """
+    STATUS_CHOICES = [('pending', 'Pending'), ('sent', 'Sent'), ('dead', 'Dead')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+class SlotRollup(models.Model):
+    """
+    Number of active bookings per date and slot, maintained as reservations change.
+    """
+    date = models.DateField()
+    time = models.TimeField()
+    bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'time'], name='unique_slot_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.bookings} bookings on {self.date} at {self.time}"
+
+
+class GuestRollup(models.Model):
+    """
+    Number of active bookings per user, maintained as reservations change.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='reservation_rollup')
+    reservation_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-reservation_count', 'user'], name='guest_rollup_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.reservation_count} bookings by {self.user_id}"
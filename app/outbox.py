@@ -0,0 +1,177 @@
+"""
+Transactional email outbox.
+
+Emails are written to OutboxEmail in the same transaction as the change that
+caused them, and a dispatcher sends them later from a pool of worker threads.
+Each worker keeps one mail connection open for its whole batch. Failed sends
+are retried with exponential backoff until they run out of attempts and are
+left in the dead-letter state.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 100,
+    'WORKERS': 4,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    'MAX_BACKOFF_SECONDS': 3600,
+    # How long a claimed batch stays invisible to other dispatchers
+    'LEASE_SECONDS': 300,
+}
+
+
+def outbox_setting(name):
+    return getattr(settings, 'EMAIL_OUTBOX', {}).get(name, DEFAULTS[name])
+
+
+def enqueue(messages):
+    """
+    Queue EmailMessages for delivery. Call inside the transaction that caused them.
+    """
+    return OutboxEmail.objects.bulk_create([
+        OutboxEmail(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            to=list(message.to),
+        )
+        for message in messages
+    ])
+
+
+def backoff(attempts):
+    """
+    Delay before retrying a message that has failed `attempts` times.
+    """
+    delay = outbox_setting('BACKOFF_SECONDS') * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, outbox_setting('MAX_BACKOFF_SECONDS')))
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to `batch_size` due messages so concurrent dispatchers skip them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + timedelta(seconds=outbox_setting('LEASE_SECONDS'))
+        )
+    return batch
+
+
+class ConnectionPool:
+    """
+    One open mail connection per worker thread, closed together at the end of a run.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def get(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = get_connection()
+            connection.open()
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def discard(self):
+        """
+        Drop the current thread's connection, e.g. after the server hung up.
+        """
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            self.connections = []
+
+
+def send_one(pool, email):
+    """
+    Send one outbox row on the calling worker's connection. Returns the error, if any.
+    """
+    try:
+        connection = pool.get()
+        message = EmailMessage(
+            subject=email.subject,
+            body=email.body,
+            from_email=email.from_email,
+            to=email.to,
+            connection=connection,
+        )
+        connection.send_messages([message])
+    except Exception as e:
+        pool.discard()
+        return e
+    return None
+
+
+def dispatch(batch_size=None, workers=None):
+    """
+    Send one batch of due messages and record the outcome. Returns (sent, retried, dead).
+    """
+    batch = claim_batch(batch_size or outbox_setting('BATCH_SIZE'))
+    if not batch:
+        return 0, 0, 0
+
+    pool = ConnectionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=workers or outbox_setting('WORKERS')) as executor:
+            errors = list(executor.map(lambda email: send_one(pool, email), batch))
+    finally:
+        pool.close()
+
+    # Database writes stay on this thread; workers only talk to the mail server
+    now = timezone.now()
+    sent = retried = dead = 0
+    for email, error in zip(batch, errors):
+        email.attempts += 1
+        if error is None:
+            email.status = "sent"
+            email.sent_at = now
+            email.last_error = ''
+            sent += 1
+        elif email.attempts >= outbox_setting('MAX_ATTEMPTS'):
+            email.status = "dead"
+            email.last_error = str(error)
+            dead += 1
+            logger.error("Giving up on outbox email %s after %s attempts: %s", email.pk, email.attempts, error)
+        else:
+            email.next_attempt_at = now + backoff(email.attempts)
+            email.last_error = str(error)
+            retried += 1
+
+    OutboxEmail.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    return sent, retried, dead
@@ -0,0 +1,48 @@
+"""
+Read-only fast path for list endpoints.
+
+A ModelSerializer builds a model instance per row and then walks its fields
+one by one. A Projection asks the database for just the columns it needs with
+values() and turns each row dict into output with a formatter compiled once,
+when the Projection is created. Dates and times are left as objects for the
+renderer, which writes them in the same ISO format DRF's fields would.
+"""
+
+
+class Projection:
+    """
+    Output names mapped to the values() lookups they come from.
+
+    `converters` optionally maps output names to a callable applied to the value.
+    """
+
+    def __init__(self, fields, converters=None):
+        if not isinstance(fields, dict):
+            fields = {name: name for name in fields}
+        self.fields = fields
+        self.converters = converters or {}
+        self.format = self.compile()
+
+    def compile(self):
+        """
+        Build `lambda row: {'name': row['lookup'], ...}` so formatting a row is one dict display.
+        """
+        namespace = {}
+        items = []
+        for position, (name, lookup) in enumerate(self.fields.items()):
+            value = f'row[{lookup!r}]'
+            if name in self.converters:
+                namespace[f'convert{position}'] = self.converters[name]
+                value = f'convert{position}({value})'
+            items.append(f'{name!r}: {value}')
+        return eval(f'lambda row: {{{", ".join(items)}}}', namespace)
+
+    def lookups(self, *extra):
+        """
+        The values() arguments: every lookup used, plus `extra` ones such as the pagination ordering.
+        """
+        return list(dict.fromkeys([*self.fields.values(), *extra]))
+
+    def format_many(self, rows):
+        format = self.format
+        return [format(row) for row in rows]
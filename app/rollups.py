@@ -0,0 +1,129 @@
+"""
+Incrementally maintained booking counts behind ReservationInsightsView.
+
+Every booking adds one to its (date, slot) row and to its guest's row, and
+every cancellation takes one away, inside the same transaction as the
+reservation change. `rebuild` recomputes both tables from Reservation when
+they need repairing, e.g. after edits made through the admin.
+"""
+from collections import Counter
+
+from django.db import connections, router, transaction
+from django.db.models import Count
+
+from .cache import bump_generation
+from .models import GuestRollup, Reservation, SlotRollup, slot_time
+
+
+def _add(model, key_fields, field, counts):
+    """
+    Add n to `field` of the row for each key in {key: n}, creating missing rows, in one upsert.
+
+    Keys are tuples of values for `key_fields`, which must be unique together.
+    The addition happens in the database, so concurrent bookings cannot lose
+    each other's counts. ON CONFLICT ... DO UPDATE is SQLite and PostgreSQL syntax.
+    """
+    if not counts:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in (*key_fields, field)]
+    table = quote(model._meta.db_table)
+    target = quote(fields[-1].column)
+    row = f"({', '.join(['%s'] * len(fields))})"
+    params = []
+    for key, n in counts.items():
+        params += [f.get_db_prep_save(value, connection) for f, value in zip(fields, (*key, n))]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(quote(f.column) for f in fields)}) "
+        f"VALUES {', '.join([row] * len(counts))} "
+        f"ON CONFLICT ({', '.join(quote(f.column) for f in fields[:-1])}) "
+        f"DO UPDATE SET {target} = {table}.{target} + excluded.{target}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _apply(reservations, delta):
+    slots = Counter()
+    guests = Counter()
+    for reservation in reservations:
+        slots[(reservation.date, slot_time(reservation.time))] += delta
+        guests[(reservation.user_id,)] += delta
+    _add(SlotRollup, ('date', 'time'), 'bookings', slots)
+    _add(GuestRollup, ('user',), 'reservation_count', guests)
+
+
+def record_booking(reservation):
+    _apply([reservation], 1)
+
+
+def record_bookings(reservations):
+    """
+    record_booking for many reservations, in one query per rollup table however many there are.
+    """
+    _apply(reservations, 1)
+
+
+def record_cancellation(reservation):
+    _apply([reservation], -1)
+
+
+def live_counts():
+    """
+    The rollup contents computed from scratch: ({(date, slot): n}, {user_id: n}).
+    """
+    booked = Reservation.objects.filter(status="booked")
+    slots = Counter()
+    for row in booked.values('date', 'time').annotate(n=Count('id')).order_by():
+        slots[(row['date'], slot_time(row['time']))] += row['n']
+    guests = dict(booked.values_list('user').annotate(n=Count('id')).order_by())
+    return dict(slots), guests
+
+
+def stored_counts():
+    """
+    The rollup contents as stored, in the shape of live_counts(). Rows counted
+    down to zero stand for no bookings; any other row, negative ones included,
+    is compared.
+    """
+    slots = {(date, time): n for date, time, n in SlotRollup.objects.exclude(bookings=0).values_list(
+        'date', 'time', 'bookings')}
+    guests = dict(GuestRollup.objects.exclude(reservation_count=0).values_list('user_id', 'reservation_count'))
+    return slots, guests
+
+
+def rebuild():
+    """
+    Replace both rollup tables with counts recomputed from Reservation.
+    """
+    slots, guests = live_counts()
+    with transaction.atomic():
+        SlotRollup.objects.all().delete()
+        GuestRollup.objects.all().delete()
+        SlotRollup.objects.bulk_create(
+            [SlotRollup(date=date, time=time, bookings=n) for (date, time), n in slots.items()],
+            batch_size=1000,
+        )
+        GuestRollup.objects.bulk_create(
+            [GuestRollup(user_id=user_id, reservation_count=n) for user_id, n in guests.items()],
+            batch_size=1000,
+        )
+        # Bulk writes send no signals, so invalidate cached insights here
+        transaction.on_commit(bump_generation)
+    return len(slots), len(guests)
+
+
+def verify():
+    """
+    Differences between the stored rollups and the live aggregates, as
+    (kind, key, stored, live) tuples. Empty when they agree.
+    """
+    live_slots, live_guests = live_counts()
+    stored_slots, stored_guests = stored_counts()
+    mismatches = []
+    for kind, live, stored in (('slot', live_slots, stored_slots), ('guest', live_guests, stored_guests)):
+        for key in live.keys() | stored.keys():
+            if live.get(key, 0) != stored.get(key, 0):
+                mismatches.append((kind, key, stored.get(key, 0), live.get(key, 0)))
+    return mismatches
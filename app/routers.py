@@ -0,0 +1,73 @@
+"""
+Primary/replica database routing.
+
+Writes, and reads by default, go to the primary ('default'). Views that only
+read and can tolerate a little replication lag opt in with ReplicaReadMixin,
+and their queries go to one of settings.DATABASE_REPLICAS. Everything else,
+including anything inside a booking transaction, stays on the primary.
+
+A user who has just written is pinned to the primary for
+REPLICA_STICKY_SECONDS (see app/middleware.py), so they always see their
+own booking or cancellation in the lists that follow. Cached responses
+built from a lagging replica can outlive a write by up to
+RESPONSE_CACHE_TIMEOUT, so keep replicas close behind the primary.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY = 'default'
+
+# Whether queries in the current request may go to a replica
+replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def sticky_key(user_id):
+    return f'replica:sticky:{user_id}'
+
+
+def stick_to_primary(user_id):
+    """
+    Send this user's reads to the primary until the replicas have caught up.
+    """
+    cache.set(sticky_key(user_id), True, getattr(settings, 'REPLICA_STICKY_SECONDS', 10))
+
+
+def is_sticky(user_id):
+    return cache.get(sticky_key(user_id), False)
+
+
+class ReplicaReadMixin:
+    """
+    Let a read-only view query a replica, unless its user is pinned to the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication, so a pinned user is recognised
+        user = request.user
+        replica_reads.set(bool(replicas()) and not (user.is_authenticated and is_sticky(user.pk)))
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if replica_reads.get():
+            return random.choice(replicas())
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == PRIMARY
@@ -1,8 +1,18 @@
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from .models import *
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from . import hashing
+from .authentication import FlavorscapeRefreshToken
+from .projections import Projection
+from .availability import calendar_setting
 
 
 
@@ -11,12 +21,21 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True, required=True)
 
     def validate(self, data):
-        email = data.get('email')
-        password = data.get('password')
+        # Authenticate user; the hash comparison runs on the hashing pool
+        return self.login(hashing.authenticate(data.get('email'), data.get('password')))
+
+    async def alogin(self):
+        """
+        The validated data for an async view, raising ValidationError as is_valid would collect it.
 
-        # Authenticate user
-        user = authenticate(username=email, password=password)
+        Queries run on the thread-sensitive executor, whose connections Django
+        closes; the hash is awaited on the hashing pool.
+        """
+        data = await sync_to_async(self.to_internal_value)(self.initial_data)
+        user = await hashing.aauthenticate(data.get('email'), data.get('password'))
+        return await sync_to_async(self.login)(user)
 
+    def login(self, user):
         if user is None:
             raise serializers.ValidationError("Invalid email or password.")
 
@@ -24,7 +43,7 @@ class LoginSerializer(serializers.Serializer):
             raise serializers.ValidationError("User account is disabled.")
 
         # Create JWT tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = FlavorscapeRefreshToken.for_user(user)
         return {
             'refresh': str(refresh),
             'access': str(refresh.access_token),
@@ -35,6 +54,39 @@ class LoginSerializer(serializers.Serializer):
             }
         }
 
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = FlavorscapeRefreshToken
+
+
+class FastBlacklistTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    simplejwt's refresh, with the claims token-user mode reads taken from the
+    user as they are now rather than copied from the old token.
+    """
+    token_class = FlavorscapeRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = CustomUser.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        refresh.stamp(user)
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+
+        return data
+
+
 class LogoutSerializer(serializers.Serializer):
     refresh = serializers.CharField()
 
@@ -51,19 +103,21 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['email', 'full_name', 'password']
-
-    def validate_email(self, value):
-        """
-        Validate if the email already exists in the system.
-        """
-        if CustomUser.objects.filter(email=value).exists():
-            raise serializers.ValidationError("A user with this email already exists.")
-        return value
+        extra_kwargs = {
+            # Replaces the model's own unique check, so the email is looked up once
+            'email': {'validators': [UniqueValidator(
+                queryset=CustomUser.objects.all(), message="A user with this email already exists.",
+            )]},
+        }
 
     def create(self, validated_data):
+        # One hash on the hashing pool and one INSERT; create_user would hash and save on its own.
+        # Async views hash first and pass the result to save() as encoded_password.
         password = validated_data.pop('password')
-        user = CustomUser.objects.create_user(**validated_data)
-        user.set_password(password)
+        encoded = validated_data.pop('encoded_password', None)
+        user = CustomUser(**validated_data)
+        user.email = CustomUser.objects.normalize_email(user.email)
+        user.password = encoded or hashing.make_password(password)
         user.save()
         return user
 
@@ -73,6 +127,49 @@ class TableSerializer(serializers.ModelSerializer):
         model = Table
         fields = ['id', 'table_number', 'capacity', 'availability_status']
 
+
+# Same output as TableSerializer, from values() rows
+table_projection = Projection(TableSerializer.Meta.fields)
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    time = serializers.TimeField(required=False)
+    party_size = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, data):
+        if ('date' in data) != ('time' in data):
+            raise serializers.ValidationError("Date and time must be given together.")
+        return data
+
+class CalendarQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    slot_minutes = serializers.IntegerField(required=False, min_value=15, max_value=240)
+    party_size = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, data):
+        data.setdefault('start', timezone.localdate())
+        # Two weeks unless told otherwise
+        data.setdefault('end', data['start'] + datetime.timedelta(days=13))
+        data.setdefault('slot_minutes', getattr(settings, 'RESERVATION_SLOT_MINUTES', 60))
+        if data['end'] < data['start']:
+            raise serializers.ValidationError("end cannot be before start.")
+        max_days = calendar_setting('MAX_DAYS')
+        if (data['end'] - data['start']).days >= max_days:
+            raise serializers.ValidationError(f"The calendar covers at most {max_days} days.")
+        return data
+
+class ExportQuerySerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    gzip = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['end'] < data['start']:
+            raise serializers.ValidationError("end cannot be before start.")
+        return data
+
 class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
@@ -88,6 +185,89 @@ class ReservationSerializer(serializers.ModelSerializer):
         return reservation
 
 
+# Same output as ReservationSerializer, from values() rows
+reservation_projection = Projection(ReservationSerializer.Meta.fields)
+
+
+class AssignmentSerializer(serializers.Serializer):
+    party_size = serializers.IntegerField(min_value=1)
+    date = serializers.DateField()
+    time = serializers.TimeField()
+
+    def validate_date(self, value):
+        if value < timezone.now().date():
+            raise serializers.ValidationError("Reservation date cannot be in the past.")
+        return value
+
+
+class BatchSlotSerializer(serializers.Serializer):
+    table = serializers.IntegerField(min_value=1)
+    date = serializers.DateField()
+    time = serializers.TimeField()
+
+
+class RecurrenceSerializer(serializers.Serializer):
+    """
+    The same time on every table, repeated daily or weekly from `start_date`
+    for `count` occurrences or until `until` (inclusive).
+    """
+    STEP_DAYS = {'daily': 1, 'weekly': 7}
+
+    tables = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1)
+    start_date = serializers.DateField()
+    time = serializers.TimeField()
+    frequency = serializers.ChoiceField(choices=list(STEP_DAYS), default='weekly')
+    interval = serializers.IntegerField(min_value=1, default=1)
+    count = serializers.IntegerField(min_value=1, required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if ('count' in data) == ('until' in data):
+            raise serializers.ValidationError("Give exactly one of count or until.")
+        if 'until' in data and data['until'] < data['start_date']:
+            raise serializers.ValidationError("until cannot be before start_date.")
+        return data
+
+    def expand(self, data, limit):
+        """
+        The requested slots, stopping one past `limit` so oversized rules are cheap to reject.
+        """
+        step = datetime.timedelta(days=self.STEP_DAYS[data['frequency']] * data['interval'])
+        slots = []
+        date = data['start_date']
+        for _ in range(data.get('count', limit + 1)):
+            if 'until' in data and date > data['until']:
+                break
+            slots.extend({'table': table, 'date': date, 'time': data['time']} for table in data['tables'])
+            if len(slots) > limit:
+                break
+            date += step
+        return slots
+
+
+class BatchReservationSerializer(serializers.Serializer):
+    """
+    Either an explicit list of slots or a recurrence rule, expanded into `slots`.
+    """
+    slots = BatchSlotSerializer(many=True, required=False)
+    recurrence = RecurrenceSerializer(required=False)
+
+    def validate(self, data):
+        if ('slots' in data) == ('recurrence' in data):
+            raise serializers.ValidationError("Give either slots or recurrence.")
+
+        limit = getattr(settings, 'RESERVATION_BATCH_LIMIT', 100)
+        if 'recurrence' in data:
+            data['slots'] = self.fields['recurrence'].expand(data.pop('recurrence'), limit)
+        if not data['slots']:
+            raise serializers.ValidationError("The request does not cover any slots.")
+        if len(data['slots']) > limit:
+            raise serializers.ValidationError(f"A batch can book at most {limit} slots.")
+        if any(slot['date'] < timezone.now().date() for slot in data['slots']):
+            raise serializers.ValidationError("Reservation date cannot be in the past.")
+        return data
+
+
 class WaitlistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Waitlist
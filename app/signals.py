@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from Flavorscape.database import apply_pragmas
+
+from . import events, metrics
+from .assignment import index as assignment_index
+from .authentication import user_cache
+from .blacklist import announce_revocation, revoked_tokens
+from .cache import bump_generation
+from .models import CustomUser, Reservation, Table, TableSlot
+from .waitlist import queues as waitlist_queues
+
+
+@receiver([post_save, post_delete], sender=Table)
+@receiver([post_save, post_delete], sender=TableSlot)
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_responses(sender, **kwargs):
+    # Bump after commit so no reader can cache pre-commit data under the new generation
+    transaction.on_commit(bump_generation)
+
+
+@receiver([post_save, post_delete], sender=Table)
+def reset_assignment_index(sender, **kwargs):
+    # Capacity or service changes reshuffle every slot's free tables and the waitlist queues
+    transaction.on_commit(assignment_index.clear)
+    transaction.on_commit(waitlist_queues.clear)
+
+
+@receiver(post_save, sender=Table)
+def publish_table_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: events.publish_table(instance))
+
+
+@receiver(post_delete, sender=Table)
+def publish_table_removal(sender, instance, **kwargs):
+    transaction.on_commit(lambda: events.publish_table(instance, deleted=True))
+
+
+# Bookings and cancellations through app/booking.py, and slot edits in the admin
+@receiver(post_save, sender=TableSlot)
+def publish_slot_booked(sender, instance, **kwargs):
+    transaction.on_commit(lambda: events.publish_slot(instance.table_id, instance.date, instance.time, "booked"))
+
+
+@receiver(post_delete, sender=TableSlot)
+def publish_slot_freed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: events.publish_slot(instance.table_id, instance.date, instance.time, "free"))
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def evict_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+    # Evict again after commit in case a request re-cached the old row meanwhile
+    transaction.on_commit(lambda: user_cache.invalidate(instance.pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def remember_revoked_token(sender, instance, created, **kwargs):
+    if created:
+        revoked_tokens.add(instance.token.jti)
+        transaction.on_commit(announce_revocation)
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    apply_pragmas(connection)
+    metrics.install(connection)
@@ -1,31 +1,90 @@
-# from celery import shared_task
-# from django.core.mail import send_mail
-# from .models import  *
-
-# @shared_task
-# def check_table_availability_and_notify():
-#     """
-#     Check table availability and notify users on the waitlist.
-#     """
-#     unavailable_tables = Table.objects.filter(availability_status=False)
-
-#     for table in unavailable_tables:
-#         # Fetch the first user on the waitlist
-#         waitlist_entries = Waitlist.objects.filter(table=table, status="waiting").order_by('created_at')
-
-#         if waitlist_entries.exists():
-#             waitlist_entry = waitlist_entries.first()
-
-#             # Notify the user via email
-#             send_mail(
-#                 subject="Table Availability Notification",
-#                 message=f"Good news! Table {table.table_number} is now available on {waitlist_entry.date}. "
-#                         "Please confirm your reservation as soon as possible.",
-#                 from_email="no-reply@flavorscape.com",
-#                 recipient_list=[waitlist_entry.user.email],
-#                 fail_silently=True,
-#             )
-
-#             # Update the waitlist entry status
-#             waitlist_entry.status = "notified"
-#             waitlist_entry.save()
+"""
+Background jobs.
+
+Jobs go through `enqueue`, which hands them to the backend named by
+settings.TASK_BACKEND:
+
+- 'local' (default): a worker thread inside the current process.
+- 'celery': the Celery task of the same name, when Celery is installed.
+- 'sync': run inline, which is what the tests use.
+
+Job arguments must be JSON-friendly so every backend can carry them.
+"""
+import datetime
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+from . import waitlist
+from .models import Table
+
+logger = logging.getLogger(__name__)
+
+
+def promote_waitlist(table_id, date):
+    """
+    Promote the waitlist queue for the capacity of `table_id` on `date`, e.g. after the table was freed.
+    """
+    capacity = Table.objects.filter(pk=table_id).values_list('capacity', flat=True).first()
+    if capacity is None:
+        return 0
+    entries = waitlist.promote([(datetime.date.fromisoformat(date), capacity)])
+    if entries:
+        logger.info("Promoted %s waitlist entries for %s seats on %s", len(entries), capacity, date)
+    return len(entries)
+
+
+class LocalWorker:
+    """
+    A single daemon thread draining an in-process job queue.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='app-tasks', daemon=True)
+                self.thread.start()
+        self.queue.put((func, args))
+
+    def run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Background job %s%r failed", func.__name__, args)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+
+local_worker = LocalWorker()
+
+try:
+    from celery import shared_task
+except ImportError:
+    celery_tasks = {}
+else:
+    celery_tasks = {
+        'promote_waitlist': shared_task(name='app.tasks.promote_waitlist')(promote_waitlist),
+    }
+
+
+def enqueue(func, *args):
+    backend = getattr(settings, 'TASK_BACKEND', 'local')
+    if backend == 'sync':
+        return func(*args)
+    if backend == 'celery':
+        if not celery_tasks:
+            raise ImproperlyConfigured("TASK_BACKEND is 'celery' but Celery is not installed.")
+        return celery_tasks[func.__name__].delay(*args)
+    local_worker.submit(func, *args)
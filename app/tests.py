@@ -1,3 +1,1249 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from smtplib import SMTPServerDisconnected
+from time import monotonic
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import assignment, availability, events, hashing, metrics, outbox, rollups, tasks, waitlist
+from .authentication import FlavorscapeRefreshToken, UserCache
+from .blacklist import announce_revocation, revoked_tokens
+from .budgets import QueryBudgetExceeded
+from .booking import SlotUnavailable, book_slots, book_table, cancel_reservation
+from .models import (
+    CustomUser, GuestRollup, OutboxEmail, Reservation, SlotRollup, Table, TableSlot, Waitlist,
+)
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import ReservationSerializer, TableSerializer, reservation_projection, table_projection
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CreateReservationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.table = Table.objects.create(table_number=1, capacity=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_booking_claims_slot(self):
+        response = self.client.post(f'/api/reservation/{self.table.id}/', {'date': '2030-01-04', 'time': '19:15'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(TableSlot.objects.filter(table=self.table, date='2030-01-04', time='19:00').exists())
+
+    def test_taken_slot_is_a_conflict(self):
+        self.client.post(f'/api/reservation/{self.table.id}/', {'date': '2030-01-04', 'time': '19:15'})
+        response = self.client.post(f'/api/reservation/{self.table.id}/', {'date': '2030-01-04', 'time': '19:45'})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_unknown_table_is_not_found(self):
+        response = self.client.post('/api/reservation/999/', {'date': '2030-01-04', 'time': '19:00'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch_refuses_table_taken_out_of_service(self):
+        other = Table.objects.create(table_number=2, capacity=2)
+        # Read in service by the view, then withdrawn before the booking transaction
+        Table.objects.filter(pk=other.pk).update(availability_status=False)
+        slots = [(self.table, datetime.date(2030, 1, 4), datetime.time(19)),
+                 (other, datetime.date(2030, 1, 4), datetime.time(19))]
+
+        with self.assertRaises(SlotUnavailable) as caught:
+            book_slots(self.user, slots)
+
+        self.assertEqual(caught.exception.conflicts, [(*slots[1], 'not in service')])
+        self.assertFalse(Reservation.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AssignReservationTests(TestCase):
+    def setUp(self):
+        assignment.index.clear()
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.small = Table.objects.create(table_number=1, capacity=2)
+        self.large = Table.objects.create(table_number=2, capacity=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Load the slot, then take the best fit out of service the way another worker would
+        assignment.index.best_fit(datetime.date(2030, 1, 4), datetime.time(19), 2)
+        Table.objects.filter(pk=self.small.pk).update(availability_status=False)
+
+    def assign(self):
+        return self.client.post(reverse('assign_reservation'), {'party_size': 2, 'date': '2030-01-04', 'time': '19:00'})
+
+    def test_table_out_of_service_is_not_booked(self):
+        response = self.assign()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['reservation']['table'], self.large.table_number)
+        self.assertFalse(Reservation.objects.filter(table=self.small).exists())
+
+    def test_roster_expires_after_ttl(self):
+        later = monotonic() + assignment.assignment_setting('TTL') + 1
+        with mock.patch.object(assignment, 'monotonic', return_value=later):
+            fit = assignment.index.best_fit(datetime.date(2030, 1, 4), datetime.time(19), 2)
+
+        self.assertEqual(fit, (4, 2, self.large.pk))
+        self.assertNotIn(self.small.pk, assignment.index.tables)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, PASSWORD_HASHING={'POOL': 'thread', 'WORKERS': 1})
+class LoginRegistrationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+
+    def test_login(self):
+        response = self.client.post(reverse('login_view'), {'email': 'diner@example.com', 'password': 'pass-1234'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['email'], 'diner@example.com')
+        self.assertEqual(hashing.pool.pending, 0)
+
+    def test_login_errors(self):
+        response = self.client.post(reverse('login_view'), {'email': 'diner@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'non_field_errors': ['Invalid email or password.']})
+
+        response = self.client.post(reverse('login_view'), {'password': 'pass-1234'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.data)
+
+    def test_register(self):
+        response = self.client.post(reverse('register_user'), {
+            'email': 'New@Example.com', 'full_name': 'New Diner', 'password': 'pass-1234'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(CustomUser.objects.get(email='New@example.com').check_password('pass-1234'))
+
+    def test_register_taken_email(self):
+        response = self.client.post(reverse('register_user'), {
+            'email': 'diner@example.com', 'full_name': 'Diner', 'password': 'pass-1234'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CustomUser.objects.count(), 1)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, AUTH_USER_CACHE={'SHARED': True})
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+
+    def test_callers_get_a_copy(self):
+        users = UserCache()
+        users.set(self.user.pk, self.user, users.version(self.user.pk))
+        self.user.full_name = 'Changed'
+        users.get(self.user.pk).full_name = 'Changed'
+
+        self.assertEqual(users.get(self.user.pk).full_name, 'Diner')
+
+    def test_eviction_reaches_other_workers(self):
+        here, there = UserCache(), UserCache()
+        here.set(self.user.pk, self.user, here.version(self.user.pk))
+        self.assertIsNotNone(there.get(self.user.pk))
+
+        here.invalidate(self.user.pk)
+
+        self.assertIsNone(there.get(self.user.pk))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, AUTH_USER_CACHE={'TOKEN_USER': True})
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.refresh = str(FlavorscapeRefreshToken.for_user(self.user))
+
+    def test_refresh_stamps_current_claims(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(email='renamed@example.com', full_name='Renamed', is_staff=True)
+
+        response = APIClient().post(reverse('token_refresh'), {'refresh': self.refresh})
+
+        self.assertEqual(response.status_code, 200)
+        for token in (AccessToken(response.data['access']), FlavorscapeRefreshToken(response.data['refresh'])):
+            self.assertEqual((token['email'], token['full_name'], token['is_staff']),
+                             ('renamed@example.com', 'Renamed', True))
+
+    def test_token_blacklisted_elsewhere_is_refused(self):
+        revoked_tokens.clear()
+        revoked_tokens.is_revoked('loaded')
+        # Written without the signal, as another process's write would be as far as this one can tell,
+        # and announced through the shared cache as that process's signal does
+        outstanding = OutstandingToken.objects.get(jti=FlavorscapeRefreshToken(self.refresh)['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        announce_revocation()
+
+        response = APIClient().post(reverse('token_refresh'), {'refresh': self.refresh})
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_unrevoked_token_is_checked_without_queries(self):
+        revoked_tokens.clear()
+        revoked_tokens.is_revoked('loaded')
+
+        with self.assertNumQueries(0):
+            self.assertFalse(revoked_tokens.is_revoked(FlavorscapeRefreshToken(self.refresh)['jti']))
+        # Until the sync interval has passed
+        with override_settings(TOKEN_BLACKLIST={'SYNC_SECONDS': 0}), self.assertNumQueries(1):
+            self.assertFalse(revoked_tokens.is_revoked('unknown'))
+
+    def test_inactive_user_cannot_refresh(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        response = APIClient().post(reverse('token_refresh'), {'refresh': self.refresh})
+
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   EMAIL_OUTBOX={'MAX_ATTEMPTS': 2, 'BACKOFF_SECONDS': 30})
+class OutboxDispatchTests(TestCase):
+    def setUp(self):
+        waitlist.queues.clear()
+
+    def queue(self):
+        return outbox.enqueue([EmailMessage('Table Available', 'Hello', to=['diner@example.com'])])[0]
+
+    def fail_sends(self):
+        return mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                          side_effect=SMTPServerDisconnected('Connection unexpectedly closed'))
+
+    def test_promoted_entry_is_emailed(self):
+        user = CustomUser.objects.create(email='diner@example.com', full_name='Diner')
+        table = Table.objects.create(table_number=1, capacity=2)
+        Waitlist.objects.create(user=user, table=table, date=datetime.date(2030, 1, 4))
+
+        self.assertEqual(tasks.promote_waitlist(table.id, '2030-01-04'), 1)
+        self.assertEqual(outbox.dispatch(workers=2), (1, 0, 0))
+
+        self.assertEqual([message.to for message in mail.outbox], [['diner@example.com']])
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+        self.assertIsNotNone(email.sent_at)
+
+    def test_failed_send_is_retried_after_backoff(self):
+        email = self.queue()
+
+        with self.fail_sends():
+            started = timezone.now()
+            self.assertEqual(outbox.dispatch(), (0, 1, 0))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('Connection unexpectedly closed', email.last_error)
+        self.assertGreaterEqual(email.next_attempt_at, started + datetime.timedelta(seconds=30))
+        # Not due again until the backoff has passed
+        self.assertEqual(outbox.dispatch(), (0, 0, 0))
+        self.assertEqual(mail.outbox, [])
+
+    def test_last_attempt_is_dead_lettered(self):
+        email = self.queue()
+
+        with self.fail_sends():
+            outbox.dispatch()
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.dispatch(), (0, 0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', 2))
+        # Dead letters are never claimed again
+        self.assertEqual(outbox.dispatch(), (0, 0, 0))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, TASK_BACKEND='sync')
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.table = Table.objects.create(table_number=1, capacity=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('create_reservation', args=[self.table.id]), {'date': '2030-01-04', 'time': '19:15'})
+        self.reservation = Reservation.objects.get()
+
+    def counts(self):
+        slot = SlotRollup.objects.get(date='2030-01-04', time='19:00').bookings
+        return slot, GuestRollup.objects.get(user=self.user).reservation_count
+
+    def test_booking_is_counted(self):
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(rollups.verify(), [])
+
+    def test_cancellation_is_uncounted_once(self):
+        stale = Reservation.objects.get()
+        self.assertTrue(cancel_reservation(self.reservation))
+        # A second cancellation, from a copy read before the first, changes nothing
+        self.assertFalse(cancel_reservation(stale))
+        response = self.client.delete(reverse('cancel-reservation', args=[self.reservation.id]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertFalse(TableSlot.objects.exists())
+        self.assertEqual(rollups.verify(), [])
+
+    def test_verify_finds_drift_and_rebuild_repairs_it(self):
+        SlotRollup.objects.update(bookings=-1)
+        GuestRollup.objects.update(reservation_count=3)
+
+        self.assertEqual(sorted(rollups.verify()), [
+            ('guest', self.user.pk, 3, 1),
+            ('slot', (datetime.date(2030, 1, 4), datetime.time(19)), -1, 1),
+        ])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', verify_only=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(rollups.rebuild(), (1, 1))
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(rollups.verify(), [])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, TASK_BACKEND='sync')
+class WaitlistTests(TestCase):
+    date = datetime.date(2030, 1, 4)
+
+    def setUp(self):
+        waitlist.queues.clear()
+        self.owner = CustomUser.objects.create_user('owner@example.com', 'pass-1234', full_name='Owner')
+        self.tables = [Table.objects.create(table_number=i, capacity=2) for i in (1, 2)]
+        self.reservations = book_slots(self.owner, [(table, self.date, datetime.time(19)) for table in self.tables])
+        self.diners = [
+            CustomUser.objects.create_user(f'diner{i}@example.com', 'pass-1234', full_name=f'Diner {i}')
+            for i in range(3)
+        ]
+        # Joined in reverse order of their ids, so the queue order cannot come from those
+        start = timezone.now()
+        self.entries = [
+            Waitlist.objects.create(user=diner, table=self.tables[0], date=self.date,
+                                    created_at=start + datetime.timedelta(minutes=2 - i))
+            for i, diner in enumerate(self.diners)
+        ]
+        self.entries.reverse()
+
+    def statuses(self):
+        return [Waitlist.objects.get(pk=entry.pk).status for entry in self.entries]
+
+    def free_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel_reservation(self.reservations.pop())
+
+    def test_freed_table_notifies_head_of_queue_only(self):
+        self.assertEqual(waitlist.openings([(self.date, 2)]), {(self.date, 2): 0})
+
+        self.free_table()
+
+        self.assertEqual(self.statuses(), ['notified', 'waiting', 'waiting'])
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        # The one free table is held for the entry notified
+        self.assertEqual(waitlist.openings([(self.date, 2)]), {(self.date, 2): 0})
+
+        self.free_table()
+
+        self.assertEqual(self.statuses(), ['notified', 'notified', 'waiting'])
+
+    def test_held_table_cannot_be_booked_by_someone_else(self):
+        self.free_table()
+        client = APIClient()
+        client.force_authenticate(self.entries[1].user)
+
+        response = client.post(reverse('create_reservation', args=[self.tables[1].id]),
+                               {'date': '2030-01-04', 'time': '12:00'})
+
+        self.assertEqual(response.status_code, 409)
+        with self.assertRaises(SlotUnavailable) as caught:
+            book_slots(self.entries[1].user, [(self.tables[1], self.date, datetime.time(12))])
+        self.assertEqual(caught.exception.conflicts, [(self.tables[1], self.date, datetime.time(12),
+                                                       'held for the waitlist')])
+        # The table already booked that day is not one the hold covers
+        book_table(self.entries[1].user, self.tables[0], self.date, datetime.time(12))
+
+        client.force_authenticate(self.entries[0].user)
+        response = client.post(reverse('create_reservation', args=[self.tables[1].id]),
+                               {'date': '2030-01-04', 'time': '12:00'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.statuses(), ['confirmed', 'waiting', 'waiting'])
+
+    def test_expired_hold_passes_to_next_in_line(self):
+        self.free_table()
+        Waitlist.objects.filter(status="notified").update(hold_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        expired, promoted = waitlist.expire_holds()
+
+        self.assertEqual((expired, promoted), (1, [self.entries[1]]))
+        self.assertEqual(self.statuses(), ['expired', 'notified', 'waiting'])
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+        Waitlist.objects.filter(status="notified").update(hold_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        waitlist.expire_holds()
+        Waitlist.objects.filter(status="notified").update(hold_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        waitlist.expire_holds()
+
+        self.assertEqual(self.statuses(), ['expired', 'expired', 'expired'])
+        # With nobody left holding it, anyone may book the table
+        book_table(self.owner, self.tables[1], self.date, datetime.time(12))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, TASK_BACKEND='sync')
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.table = Table.objects.create(table_number=1, capacity=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tables(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('all_tables'), **headers)
+
+    def assertRefreshedAfter(self, write):
+        etag = self.tables()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = self.tables(etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.tables()['ETag']
+
+        response = self.tables(etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.tables(f'"other", {etag}').status_code, 304)
+        self.assertEqual(self.tables('"other"').status_code, 200)
+
+    def test_booking_changes_etag(self):
+        self.assertRefreshedAfter(lambda: self.client.post(
+            reverse('create_reservation', args=[self.table.id]), {'date': '2030-01-04', 'time': '19:00'}
+        ))
+
+    def test_cancellation_changes_etag(self):
+        reservation = book_table(self.user, self.table, datetime.date(2030, 1, 4), datetime.time(19))
+
+        self.assertRefreshedAfter(lambda: self.client.delete(reverse('cancel-reservation', args=[reservation.id])))
+        self.assertEqual(Reservation.objects.get().status, 'cancelled')
+
+    def test_table_save_changes_etag(self):
+        def resize():
+            self.table.capacity = 6
+            self.table.save()
+
+        response = self.assertRefreshedAfter(resize)
+
+        self.assertEqual([table['capacity'] for table in response.data['results']], [6])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.tables = [Table.objects.create(table_number=i, capacity=4) for i in range(1, 4)]
+        # Ties on (date, time) across tables, so pages also split on the id
+        self.reservations = book_slots(self.user, [
+            (table, datetime.date(2030, 1, day), datetime.time(hour))
+            for day in (5, 4) for hour in (20, 19) for table in self.tables
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def cursor(self, position):
+        return KeysetPagination(ordering=('date', 'time', 'id')).encode_cursor(position)
+
+    def walk(self, url, section=None):
+        """
+        Every row of every page from `url` on, and the number of pages.
+        """
+        rows = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.data[section] if section else response.data
+            rows += page['results']
+            url = page['next']
+            pages += 1
+        return rows, pages
+
+    def test_next_links_walk_every_row_once_in_order(self):
+        in_order = sorted(self.reservations, key=lambda reservation: (reservation.date, reservation.time, reservation.id))
+
+        rows, pages = self.walk(reverse('list_reservations') + '?page_size=5')
+
+        self.assertEqual(pages, 3)
+        self.assertEqual([(row['date'], row['time']) for row in rows],
+                         [(reservation.date, reservation.time) for reservation in in_order])
+
+        # The insights list the ids, so ties split across pages show up as well
+        self.user.is_staff = True
+        self.user.save()
+        rows, pages = self.walk(reverse('reservation_insights') + '?page_size=5', 'upcoming_reservations')
+
+        self.assertEqual(pages, 3)
+        self.assertEqual([row['id'] for row in rows], [reservation.id for reservation in in_order])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ['not base64!', self.cursor([1, 2]), self.cursor(['not a date', '19:00:00', 1]),
+                       self.cursor({'date': '2030-01-04'})]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('list_reservations'), {'cursor': cursor})
+
+                self.assertEqual(response.status_code, 404)
+
+    def test_page_size_is_clamped(self):
+        def page(size):
+            return len(self.client.get(reverse('list_reservations'), {'page_size': size}).data['results'])
+
+        self.assertEqual(page(0), 1)
+        self.assertEqual(page('many'), len(self.reservations))
+        with mock.patch.object(KeysetPagination, 'max_page_size', 5):
+            self.assertEqual(page(100), 5)
+
+    def test_insights_sections_page_independently(self):
+        guests = [CustomUser.objects.create_user(f'guest{i}@example.com', 'pass-1234', full_name=f'Guest {i}')
+                  for i in range(2)]
+        book_slots(guests[0], [(self.tables[0], datetime.date(2030, 1, 6), datetime.time(19))])
+        staff = CustomUser.objects.create_user('staff@example.com', 'pass-1234', full_name='Staff', is_staff=True)
+        self.client.force_authenticate(staff)
+
+        first = self.client.get(reverse('reservation_insights'), {'page_size': 1}).data
+        second = self.client.get(first['guest_trends']['next']).data
+
+        self.assertEqual([row['user'] for row in first['guest_trends']['results']], [self.user.pk])
+        self.assertEqual([row['user'] for row in second['guest_trends']['results']], [guests[0].pk])
+        self.assertIsNone(second['guest_trends']['next'])
+        # The upcoming reservations stay on their first page
+        self.assertEqual(second['upcoming_reservations']['results'], first['upcoming_reservations']['results'])
+
+        third = self.client.get(second['upcoming_reservations']['next']).data
+
+        self.assertEqual(third['guest_trends']['results'], second['guest_trends']['results'])
+        self.assertNotEqual(third['upcoming_reservations']['results'], first['upcoming_reservations']['results'])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, EXPORT_CHUNK_SIZE=1, EXPORT_BUFFER_BYTES=16)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.diner = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.table = Table.objects.create(table_number=7, capacity=4)
+        self.reservations = book_slots(self.diner, [
+            (self.table, datetime.date(2030, 1, day), datetime.time(19)) for day in (4, 5, 6)
+        ])
+        self.entry = Waitlist.objects.create(user=self.diner, table=self.table, date=datetime.date(2030, 1, 5))
+        staff = CustomUser.objects.create_user('staff@example.com', 'pass-1234', full_name='Staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+
+    def export(self, kind, **params):
+        response = self.client.get(reverse('export', args=[kind]), params)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_is_filtered_by_date(self):
+        response, content = self.export('reservations', start='2030-01-05', end='2030-01-06')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="reservations.ndjson"')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [reservation.id for reservation in self.reservations[1:]])
+        self.assertEqual(rows[0], {
+            'id': self.reservations[1].id,
+            'user_id': self.diner.id,
+            'user_email': 'diner@example.com',
+            'table_number': 7,
+            'date': '2030-01-05',
+            'time': '19:00:00',
+            'status': 'booked',
+            'created_at': rows[0]['created_at'],
+        })
+
+    def test_csv_has_a_header_row(self):
+        response, content = self.export('waitlist', output='csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], ['id', 'user_id', 'user_email', 'table_number', 'date', 'status', 'created_at'])
+        self.assertEqual(rows[1][:6], [str(self.entry.id), str(self.diner.id), 'diner@example.com', '7', '2030-01-05',
+                                       'waiting'])
+        self.assertEqual(len(rows), 2)
+
+    def test_gzip_is_only_sent_when_asked_for(self):
+        _, plain = self.export('reservations', output='csv')
+        response, compressed = self.export('reservations', output='csv', gzip='true')
+
+        self.assertEqual(plain.count(b'\n'), 4)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="reservations.csv.gz"')
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_bad_requests_are_refused(self):
+        self.assertEqual(self.client.get(reverse('export', args=['guests'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export', args=['reservations']),
+                                         {'start': '2030-01-06', 'end': '2030-01-04'}).status_code, 400)
+        self.client.force_authenticate(self.diner)
+        self.assertEqual(self.client.get(reverse('export', args=['reservations'])).status_code, 403)
+
+
+class ProjectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email='diner@example.com', full_name='Diner')
+        self.tables = [Table.objects.create(table_number=i, capacity=2 * i, availability_status=i != 2)
+                       for i in (1, 2, 3)]
+        book_slots(self.user, [(self.tables[0], datetime.date(2030, 1, 4), datetime.time(19, 30)),
+                               (self.tables[2], datetime.date(2031, 12, 31), datetime.time(7))])
+
+    def assertRendersLikeSerializer(self, projection, serializer_class, queryset):
+        renderer = FastJSONRenderer()
+        projected = projection.format_many(queryset.values(*projection.lookups()))
+        serialized = serializer_class(queryset, many=True).data
+
+        self.assertEqual(renderer.render(projected), renderer.render(serialized))
+
+    def test_table_projection_matches_serializer(self):
+        self.assertRendersLikeSerializer(table_projection, TableSerializer, Table.objects.order_by('id'))
+
+    def test_reservation_projection_matches_serializer(self):
+        self.assertRendersLikeSerializer(reservation_projection, ReservationSerializer, Reservation.objects.order_by('id'))
+
+    def test_list_view_matches_serializer(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(reverse('all_tables'))
+
+        serialized = TableSerializer(Table.objects.order_by('table_number'), many=True).data
+        self.assertEqual(json.loads(response.content)['results'], json.loads(FastJSONRenderer().render(serialized)))
+
+
+class AvailabilityCalendarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email='diner@example.com', full_name='Diner')
+        self.small = Table.objects.create(table_number=1, capacity=2)
+        self.large = Table.objects.create(table_number=2, capacity=4)
+        book_slots(self.user, [(self.small, datetime.date(2030, 1, 5), datetime.time(19, 15)),
+                               (self.large, datetime.date(2030, 1, 5), datetime.time(12))])
+        cancel_reservation(Reservation.objects.get(table=self.large))
+
+    def calendar(self, now=datetime.datetime(2029, 1, 1), **options):
+        options.setdefault('slot_minutes', 60)
+        return availability.build_calendar(datetime.date(2030, 1, 4), datetime.date(2030, 1, 6),
+                                           now=timezone.make_aware(now), **options)
+
+    def test_booked_slots_are_cleared(self):
+        calendar = self.calendar()
+
+        # 11:00 to 23:00 in hours; the 19:00 slot is bit 8
+        self.assertEqual(len(calendar['slots']), 12)
+        self.assertEqual(calendar['slots'][8], '19:00')
+        self.assertEqual(calendar['days']['2030-01-04'], {'any': 'fff', 'tables': ['fff', 'fff']})
+        # The cancelled booking leaves its slot free
+        self.assertEqual(calendar['days']['2030-01-05'], {'any': 'fff', 'tables': ['eff', 'fff']})
+
+    def test_booking_clears_every_slot_it_overlaps(self):
+        calendar = self.calendar(slot_minutes=30)
+
+        self.assertEqual(calendar['days']['2030-01-05']['tables'][0], format(0xffffff & ~(0b11 << 16), 'x'))
+
+    def test_party_size_limits_the_tables(self):
+        calendar = self.calendar(party_size=3)
+
+        self.assertEqual([table['id'] for table in calendar['tables']], [self.large.id])
+        self.assertEqual(calendar['days']['2030-01-05'], {'any': 'fff', 'tables': ['fff']})
+
+    def test_started_slots_are_not_free(self):
+        calendar = self.calendar(now=datetime.datetime(2030, 1, 5, 13, 30))
+
+        self.assertEqual(calendar['days']['2030-01-04'], {'any': '0', 'tables': ['0', '0']})
+        # 11:00, 12:00 and 13:00 have started
+        self.assertEqual(calendar['days']['2030-01-05'], {'any': 'ff8', 'tables': ['ef8', 'ff8']})
+        self.assertEqual(calendar['days']['2030-01-06'], {'any': 'fff', 'tables': ['fff', 'fff']})
+
+    def test_view_serves_the_calendar(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(reverse('availability_calendar'), {'start': '2030-01-05', 'end': '2030-01-05'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['days'], {'2030-01-05': {'any': 'fff', 'tables': ['eff', 'fff']}})
+        self.assertEqual(client.get(reverse('availability_calendar'),
+                                    {'start': '2030-01-05', 'end': '2030-01-04'}).status_code, 400)
+
+
+@override_settings(EVENTS={'HISTORY': 3, 'RETRY_MS': 1000, 'HEARTBEAT': 15})
+class TableEventsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email='diner@example.com', full_name='Diner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(events, 'broadcaster', events.Broadcaster())
+        self.broadcaster = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ids = [events.publish('slot', {'table': 1, 'status': 'booked', 'n': n}) for n in range(4)]
+
+    def stream(self, last_event_id=None):
+        headers = {} if last_event_id is None else {'HTTP_LAST_EVENT_ID': str(last_event_id)}
+        response = self.client.get(reverse('table_events'), **headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_missed_events_are_replayed(self):
+        self.assertEqual(self.stream(self.ids[1]), 'retry: 1000\n\n' + ''.join(
+            events.encode(event_id, 'slot', {'table': 1, 'status': 'booked', 'n': n})
+            for n, event_id in enumerate(self.ids) if n > 1
+        ))
+
+    def test_client_up_to_date_gets_nothing_to_replay(self):
+        self.assertEqual(self.stream(self.ids[-1]), 'retry: 1000\n\n')
+        self.assertEqual(self.stream(), f'retry: 1000\n\nid: {self.ids[-1]}\n\n')
+
+    def test_events_gone_from_the_buffer_reset(self):
+        reset = f'retry: 1000\n\n{events.encode(self.ids[-1], "reset", {})}'
+
+        # Only the last three are kept: all that a client at ids[0] missed, but not ids[0] itself
+        self.assertEqual(self.stream(self.ids[0]).count('event: slot'), 3)
+        self.assertEqual(self.stream(self.ids[0] - 1), reset)
+        # Ids from another process, before or after this one's
+        self.assertEqual(self.stream(self.ids[0] - 1000), reset)
+        self.assertEqual(self.stream(self.ids[-1] + 1), reset)
+
+    async def test_live_stream_replays_then_follows(self):
+        stream = events.astream(self.ids[2])
+        try:
+            self.assertEqual(await anext(stream), 'retry: 1000\n\n')
+            self.assertIn(f'id: {self.ids[3]}\n', await anext(stream))
+            event_id = events.publish('table', {'id': 1, 'deleted': True})
+
+            self.assertEqual(await anext(stream), events.encode(event_id, 'table', {'id': 1, 'deleted': True}))
+        finally:
+            await stream.aclose()
+        self.assertEqual(self.broadcaster.subscribers, set())
+
+
+@override_settings(METRICS={'QUERY_SAMPLE_RATE': 1.0, 'BUCKETS': (0.5, 60.0)})
+class MetricsTests(TestCase):
+    sample = re.compile(r'^flavorscape_[a-z_]+\{route="[^"]+"(,(status|le)="[^"]+")?\} [0-9.]+$')
+
+    def setUp(self):
+        cache.clear()
+        # A registry of its own, built with the bucket bounds above
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.diner = CustomUser.objects.create(email='diner@example.com', full_name='Diner')
+        self.staff = CustomUser.objects.create(email='staff@example.com', full_name='Staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.diner)
+
+    def test_metrics_are_for_staff_only(self):
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('flavorscape_', response.content.decode())
+
+    def test_prometheus_text(self):
+        Table.objects.create(table_number=1, capacity=4)
+        self.client.get(reverse('all_tables'))
+        self.client.get(reverse('all_tables'))
+        self.client.post(reverse('create_reservation', args=[999]), {'date': '2030-01-04', 'time': '19:00'})
+        self.client.get(reverse('metrics'))
+        self.client.force_authenticate(self.staff)
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        families = []
+        for line in lines:
+            if line.startswith('# HELP '):
+                families.append(line.split()[2])
+            elif line.startswith('# TYPE '):
+                self.assertEqual(line.split()[2], families[-1])
+                self.assertIn(line.split()[3], ('counter', 'histogram'))
+            else:
+                self.assertRegex(line, self.sample)
+                self.assertTrue(line.startswith(families[-1]), line)
+        self.assertEqual(len(families), len(set(families)))
+
+        for line in [
+            'flavorscape_requests_total{route="all_tables",status="200"} 2',
+            'flavorscape_requests_total{route="create_reservation",status="404"} 1',
+            'flavorscape_requests_total{route="metrics",status="403"} 1',
+            'flavorscape_request_duration_seconds_bucket{route="all_tables",le="60.0"} 2',
+            'flavorscape_request_duration_seconds_bucket{route="all_tables",le="+Inf"} 2',
+            'flavorscape_request_duration_seconds_count{route="all_tables"} 2',
+            'flavorscape_db_sampled_requests_total{route="all_tables"} 2',
+        ]:
+            self.assertIn(line, lines)
+        size = int(next(line for line in lines if line.startswith(
+            'flavorscape_response_bytes_total{route="all_tables"}')).split()[-1])
+        self.assertGreater(size, 0)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ConcurrentReservationTests(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        self.table = Table.objects.create(table_number=1, capacity=4)
+        self.users = [
+            CustomUser.objects.create_user(f'diner{i}@example.com', 'pass-1234', full_name=f'Diner {i}')
+            for i in range(self.threads)
+        ]
+
+    def test_one_table_many_diners(self):
+        barrier = threading.Barrier(self.threads)
+
+        def book(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                response = client.post(f'/api/reservation/{self.table.id}/', {'date': '2030-01-04', 'time': '19:00'})
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            codes = list(pool.map(book, self.users))
+
+        self.assertEqual(codes.count(201), 1)
+        self.assertEqual(codes.count(409), self.threads - 1)
+        self.assertEqual(Reservation.objects.filter(status='booked').count(), 1)
+        self.assertEqual(TableSlot.objects.count(), 1)
+
+
+REPLICA = 'replica_test'
+# A replica alias mirroring the test database, as replica_databases() configures them for tests.
+# It is registered on import so the test runner sets it up, and only routed to where
+# DATABASE_REPLICAS names it.
+connections.settings[REPLICA] = {**connections.settings['default'], 'TEST': {'MIRROR': 'default'}}
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The replica alias has a connection of its own, so only committed rows reach it.
+    """
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('diner@example.com', 'pass-1234', full_name='Diner')
+        self.table = Table.objects.create(table_number=1, capacity=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_reservations(self):
+        """
+        The reservations listed, and the queries run on the primary and on the replica.
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get(reverse('list_reservations'))
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        _, primary, replica = self.list_reservations()
+
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        response = self.client.post(reverse('create_reservation', args=[self.table.id]),
+                                    {'date': '2030-01-04', 'time': '19:00'})
+        self.assertEqual(response.status_code, 201)
+
+        data, primary, replica = self.list_reservations()
+
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        self.assertEqual(len(data['results']), 1)
+
+    def test_cached_replica_reads_are_not_served_after_a_write(self):
+        self.client.post(reverse('create_reservation', args=[self.table.id]), {'date': '2030-01-04', 'time': '19:00'})
+        other = APIClient()
+        other.force_authenticate(CustomUser.objects.create_user('other@example.com', 'pass-1234', full_name='Other'))
+        # Cached from the replica under the generation the booking started
+        self.assertEqual(other.get(reverse('all_tables')).status_code, 200)
+
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get(reverse('all_tables'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(primary), 0)
+        self.assertEqual(len(replica), 0)
+
+
+SEED_DATE = datetime.date.today() + datetime.timedelta(days=7)
+
+
+def seed(size):
+    """
+    `size` diners with three days of bookings and a waitlist entry each, 4 * size tables
+    and a member of staff. Returns (diner, staff, tables).
+    """
+    password = make_password('pass-1234')
+    tables = Table.objects.bulk_create(
+        Table(table_number=number, capacity=2 + 2 * (number % 3)) for number in range(1, 4 * size + 1)
+    )
+    diners = CustomUser.objects.bulk_create(
+        CustomUser(email=f'diner{i}@example.com', full_name=f'Diner {i}', password=password) for i in range(size)
+    )
+    staff = CustomUser.objects.create(email='staff@example.com', full_name='Staff', password=password, is_staff=True)
+    for i, diner in enumerate(diners):
+        book_slots(diner, [
+            (tables[i], SEED_DATE + datetime.timedelta(days=day), datetime.time(12 + i % 8)) for day in range(3)
+        ])
+    # Spread over more (date, capacity) waitlist queues the bigger the dataset
+    Waitlist.objects.bulk_create(
+        Waitlist(user=diner, table=tables[i], date=SEED_DATE + datetime.timedelta(days=i % 5))
+        for i, diner in enumerate(diners)
+    )
+    return diners[0], staff, tables
+
+
+# Queries per request of each route, with its on-commit hooks, whatever the amount of data
+ROUTE_QUERIES = {
+    'register_user': 2,
+    'login_view': 2,
+    'logout_view': 6,
+    'list_tables': 1,
+    'all_tables': 1,
+    'availability_calendar': 2,
+    'table_events': 0,
+    'create_reservation': 10,
+    'batch_reservations': 11,
+    'assign_reservation': 11,
+    'cancel-reservation': 20,
+    'add_to_waitlist': 15,
+    'list_reservations': 1,
+    'reservation_insights': 4,
+    'export': 1,
+    'metrics': 0,
+    'check_availability': 27,
+}
+
+query_count_settings = override_settings(
+    PASSWORD_HASHERS=FAST_HASHERS,
+    PASSWORD_HASHING={'POOL': 'inline'},
+    TASK_BACKEND='sync',
+    QUERY_BUDGET={'MODE': 'raise'},
+    METRICS={'QUERY_SAMPLE_RATE': 1.0},
+)
+
+
+class RouteQueryCountMixin:
+    """
+    Every route against seeded data of `size`, checked against ROUTE_QUERIES.
+
+    Subclasses seed different sizes, so a query count that grows with the data
+    fails one of them. Views also run under QueryBudgetMiddleware in 'raise' mode.
+    """
+    size = None
+
+    def setUp(self):
+        # Start every test with the same cold in-process caches
+        cache.clear()
+        assignment.index.clear()
+        waitlist.queues.clear()
+        revoked_tokens.clear()
+        self.diner, self.staff, self.tables = seed(self.size)
+        self.client = APIClient()
+        self.client.force_authenticate(self.diner)
+        self.staff_client = APIClient()
+        self.staff_client.force_authenticate(self.staff)
+        self.day = SEED_DATE.isoformat()
+
+    def assertRouteQueries(self, name, request):
+        """
+        Run `request` and its on-commit hooks, reading any streamed body, in ROUTE_QUERIES[name] queries.
+        """
+        with self.assertNumQueries(ROUTE_QUERIES[name]), self.captureOnCommitCallbacks(execute=True):
+            response = request()
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        return response
+
+    def test_logout(self):
+        refresh = str(FlavorscapeRefreshToken.for_user(self.diner))
+        response = self.assertRouteQueries('logout_view', lambda: self.client.post(
+            reverse('logout_view'), {'refresh': refresh}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_available_tables(self):
+        response = self.assertRouteQueries('list_tables', lambda: self.client.get(
+            reverse('list_tables'), {'date': self.day, 'time': '12:00', 'party_size': 2}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_all_tables(self):
+        response = self.assertRouteQueries('all_tables', lambda: self.client.get(reverse('all_tables')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_availability_calendar(self):
+        response = self.assertRouteQueries('availability_calendar', lambda: self.client.get(
+            reverse('availability_calendar'), {'start': self.day}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['tables']), len(self.tables))
+
+    def test_table_events(self):
+        response = self.assertRouteQueries('table_events', lambda: self.client.get(reverse('table_events')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_reservation(self):
+        response = self.assertRouteQueries('create_reservation', lambda: self.client.post(
+            reverse('create_reservation', args=[self.tables[-1].id]), {'date': self.day, 'time': '20:00'}))
+        self.assertEqual(response.status_code, 201)
+
+    def test_batch_reservations(self):
+        # One slot, then many across several dates and times: the count must not grow with the batch
+        free = self.tables[self.size:]
+        for batch in (free[-1:], free[:-1][:3 * self.size]):
+            slots = [
+                {'table': table.id, 'date': (SEED_DATE + datetime.timedelta(days=i % 3)).isoformat(),
+                 'time': f'{12 + i % 10}:00'}
+                for i, table in enumerate(batch)
+            ]
+            with self.subTest(slots=len(slots)):
+                response = self.assertRouteQueries('batch_reservations', lambda: self.client.post(
+                    reverse('batch_reservations'), {'slots': slots}, format='json'))
+                self.assertEqual(response.status_code, 201)
+
+    def test_assign_reservation(self):
+        response = self.assertRouteQueries('assign_reservation', lambda: self.client.post(
+            reverse('assign_reservation'), {'party_size': 2, 'date': self.day, 'time': '22:00'}))
+        self.assertEqual(response.status_code, 201)
+
+    def test_cancel_reservation(self):
+        reservation = Reservation.objects.filter(user=self.diner, status='booked').first()
+        response = self.assertRouteQueries('cancel-reservation', lambda: self.client.delete(
+            reverse('cancel-reservation', args=[reservation.id])))
+        self.assertEqual(response.status_code, 200)
+
+    def test_join_waitlist(self):
+        response = self.assertRouteQueries('add_to_waitlist', lambda: self.client.post(
+            reverse('add_to_waitlist', args=[self.tables[-1].id]), {'date': self.day}))
+        self.assertEqual(response.status_code, 201)
+
+    def test_list_reservations(self):
+        response = self.assertRouteQueries('list_reservations', lambda: self.client.get(reverse('list_reservations')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_insights(self):
+        response = self.assertRouteQueries('reservation_insights', lambda: self.staff_client.get(
+            reverse('reservation_insights')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_export(self):
+        response = self.assertRouteQueries('export', lambda: self.staff_client.get(
+            reverse('export', args=['reservations'])))
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics(self):
+        response = self.assertRouteQueries('metrics', lambda: self.staff_client.get(reverse('metrics')))
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_availability(self):
+        # The first diner's hold has just run out and staff wait behind them; everyone else is still waiting
+        Waitlist.objects.filter(user=self.diner).update(status='notified', hold_expires_at=timezone.now())
+        Waitlist.objects.create(user=self.staff, table=self.tables[0], date=SEED_DATE)
+        with self.assertNumQueries(ROUTE_QUERIES['check_availability']), \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command('check_availability', stdout=io.StringIO())
+        self.assertEqual(Waitlist.objects.get(user=self.diner).status, 'expired')
+        self.assertFalse(Waitlist.objects.filter(status='waiting').exists())
+
+
+@query_count_settings
+class SmallDatasetQueryTests(RouteQueryCountMixin, TestCase):
+    size = 2
+
+
+@query_count_settings
+class LargeDatasetQueryTests(RouteQueryCountMixin, TestCase):
+    size = 30
+
+
+class AuthQueryCountMixin:
+    """
+    Registration and login, which await password hashes off the request thread.
+
+    Their counts are read from the per-route counts MetricsMiddleware keeps,
+    which follow a request onto whichever thread runs its queries. Both need
+    committed data, hence TransactionTestCase.
+    """
+    size = None
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        seed(self.size)
+        self.client = APIClient()
+
+    def assertRouteQueries(self, name, request):
+        response = request()
+        stats = metrics.registry.totals()[name]
+        self.assertEqual(stats.sampled, 1)
+        self.assertEqual(stats.queries, ROUTE_QUERIES[name], f'{name} ran {stats.queries} queries')
+        return response
+
+    def test_register(self):
+        response = self.assertRouteQueries('register_user', lambda: self.client.post(reverse('register_user'), {
+            'email': 'new@example.com', 'full_name': 'New Diner', 'password': 'pass-1234'}))
+        self.assertEqual(response.status_code, 201)
+
+    def test_login(self):
+        response = self.assertRouteQueries('login_view', lambda: self.client.post(reverse('login_view'), {
+            'email': 'diner0@example.com', 'password': 'pass-1234'}))
+        self.assertEqual(response.status_code, 200)
+
+
+@query_count_settings
+class SmallDatasetAuthQueryTests(AuthQueryCountMixin, TransactionTestCase):
+    size = 2
+
+
+@query_count_settings
+class LargeDatasetAuthQueryTests(AuthQueryCountMixin, TransactionTestCase):
+    size = 30
+
+
+@override_settings(QUERY_BUDGET={'MODE': 'raise', 'ROUTES': {'all_tables': 0}})
+class QueryBudgetMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(email='diner@example.com', full_name='Diner'))
+
+    def test_over_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('all_tables'))
+
+    @override_settings(QUERY_BUDGET={'MODE': 'warn', 'ROUTES': {'all_tables': 0}})
+    def test_over_budget_warns(self):
+        with self.assertLogs('app.budgets', 'WARNING'):
+            response = self.client.get(reverse('all_tables'))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class SeedBenchmarkDataTests(TestCase):
+    def seed(self):
+        call_command('seed_benchmark_data', users=50, tables=10, reservations=2000, waitlist=300,
+                     past_days=30, future_days=14, batch_size=500, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_seeded_data_is_consistent(self):
+        self.seed()
+
+        self.assertEqual(CustomUser.objects.count(), 51)
+        self.assertEqual(Table.objects.count(), 10)
+        self.assertGreater(Waitlist.objects.count(), 200)
+        booked = Reservation.objects.filter(status='booked')
+        self.assertGreater(booked.count(), 1000)
+        # Every booking holds its own slot, and the rollups agree with the bookings
+        self.assertEqual(TableSlot.objects.filter(reservation__in=booked).count(), booked.count())
+        self.assertEqual(TableSlot.objects.count(), booked.count())
+        self.assertEqual(rollups.verify(), [])
+
+    def test_seeding_twice_is_refused(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+@override_settings(QUERY_BUDGET={'MODE': 'raise', 'ROUTES': {}})
+class ConnectionSetupQueryTests(TransactionTestCase):
+    def test_opening_a_connection_is_not_charged_to_the_request(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(email='diner@example.com', full_name='Diner'))
+        connection.close()
+
+        response = client.get(reverse('all_tables'))
+        self.assertEqual(response.status_code, 200)
+
+
+class DataMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_booked_tables_are_put_back_in_service(self):
+        apps = self.migrate([('app', '0001_initial')])
+        user = apps.get_model('app', 'CustomUser').objects.create(email='diner@example.com', password='')
+        Table = apps.get_model('app', 'Table')
+        # Before TableSlot, a booking took its table out with availability_status=False
+        booked = Table.objects.create(table_number=1, capacity=4, availability_status=False)
+        Table.objects.create(table_number=2, capacity=2, availability_status=False)
+        apps.get_model('app', 'Reservation').objects.create(
+            user=user, table=booked, date='2030-01-04', time='19:15', status='booked')
+
+        apps = self.migrate([('app', '0002_tableslot')])
+
+        self.assertFalse(apps.get_model('app', 'Table').objects.filter(availability_status=False).exists())
+        slot = apps.get_model('app', 'TableSlot').objects.get()
+        self.assertEqual((slot.table_id, str(slot.date), str(slot.time)), (booked.pk, '2030-01-04', '19:00:00'))
+
+    def test_duplicates_are_resolved_before_the_unique_constraints(self):
+        apps = self.migrate([('app', '0002_tableslot')])
+        user = apps.get_model('app', 'CustomUser').objects.create(email='diner@example.com', password='')
+        other = apps.get_model('app', 'CustomUser').objects.create(email='other@example.com', password='')
+        table = apps.get_model('app', 'Table').objects.create(table_number=1, capacity=4)
+        Reservation = apps.get_model('app', 'Reservation')
+        Waitlist = apps.get_model('app', 'Waitlist')
+        now = timezone.now()
+        # What the unchecked booking and waitlist writes let through
+        first = Reservation.objects.create(user=user, table=table, date='2030-01-04', time='19:00', status='booked',
+                                           created_at=now)
+        double = Reservation.objects.create(user=other, table=table, date='2030-01-04', time='19:00', status='booked',
+                                            created_at=now + datetime.timedelta(seconds=1))
+        entry = Waitlist.objects.create(user=user, table=table, date='2030-01-04', status='waiting', created_at=now)
+        repeat = Waitlist.objects.create(user=user, table=table, date='2030-01-04', status='notified',
+                                         created_at=now + datetime.timedelta(seconds=1))
+
+        apps = self.migrate([('app', '0003_reservation_waitlist_indexes')])
+
+        statuses = dict(apps.get_model('app', 'Reservation').objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {first.pk: 'booked', double.pk: 'cancelled'})
+        statuses = dict(apps.get_model('app', 'Waitlist').objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {entry.pk: 'waiting', repeat.pk: 'expired'})
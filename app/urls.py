@@ -10,14 +10,20 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout_view'),
     path('tables/avaliable/', AvailableTablesView.as_view(), name='list_tables'),
     path('tables/all/', AllTablesView.as_view(), name='all_tables'),
+    path('tables/calendar/', AvailabilityCalendarView.as_view(), name='availability_calendar'),
+    path('tables/events/', TableEventsView.as_view(), name='table_events'),
 
 
     path('reservation/<int:table_id>/', CreateReservationView.as_view(), name='create_reservation'),
+    path('reservations/batch/', BatchReservationView.as_view(), name='batch_reservations'),
+    path('reservations/assign/', AssignReservationView.as_view(), name='assign_reservation'),
     path('reservations/cancel/<int:reservation_id>/', CancelReservationView.as_view(), name='cancel-reservation'),
 
     path('waitlist/join/<int:table_id>/', WaitlistView.as_view(), name='add_to_waitlist'),
     path('reservations/', ListReservationsView.as_view(), name='list_reservations'),
     path('insights/', ReservationInsightsView.as_view(), name='reservation_insights'),
+    path('exports/<str:kind>/', ExportView.as_view(), name='export'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
 
 
@@ -1,19 +1,36 @@
+import datetime
 
 from .serializers import *
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Count
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.db.models import Q, Sum
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import authenticate
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.response import Response
-from .models import Reservation, Table, Waitlist, CustomUser
+from rest_framework.views import APIView
+from .models import Reservation, Table, TableSlot, Waitlist, CustomUser, GuestRollup, SlotRollup, slot_time
+from .authentication import FlavorscapeRefreshToken
+from . import assignment, events, exports, hashing, metrics, tasks, waitlist
+from .availability import build_calendar
+from .booking import SlotUnavailable, book_slots, book_table, cancel_reservation
+from .budgets import query_budget
+from .async_views import AsyncAPIView, AsyncGenericAPIView, AsyncListAPIView
+from .cache import CachedResponseMixin
+from .pagination import KeysetPagination
+from .renderers import EventStreamRenderer, FastJSONRenderer
+from .routers import ReplicaReadMixin
 # from drf_yasg.utils import swagger_auto_schema
 # from drf_yasg import openapi
 
 
-class RegisterUserView(generics.CreateAPIView):
+@query_budget(2)
+class RegisterUserView(AsyncAPIView, generics.CreateAPIView):
     """
     Handle user registration by accepting email, full name, and password.
     """
@@ -28,10 +45,16 @@ class RegisterUserView(generics.CreateAPIView):
     #         400: openapi.Response('Validation error occurred.'),
     #     }
     # )
-    def post(self, request, *args, **kwargs):
-        return super().post(request, *args, **kwargs)
+    async def post(self, request, *args, **kwargs):
+        # Queries on the thread-sensitive executor; the hash is awaited so no thread waits on the pool
+        serializer = self.get_serializer(data=request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        encoded = await hashing.amake_password(serializer.validated_data['password'])
+        await sync_to_async(serializer.save)(encoded_password=encoded)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
 
 
+@query_budget(7)
 class LogoutView(generics.GenericAPIView):
     """
     Logout view to blacklist a refresh token.
@@ -55,7 +78,7 @@ class LogoutView(generics.GenericAPIView):
             
             try:
                 # Blacklist the refresh token
-                token = RefreshToken(refresh_token)
+                token = FlavorscapeRefreshToken(refresh_token)
                 token.blacklist()
                 
                 return Response({'detail': 'Logout successful'}, status=status.HTTP_200_OK)
@@ -65,7 +88,8 @@ class LogoutView(generics.GenericAPIView):
             # If the serializer is not valid, return errors
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class LoginView(generics.GenericAPIView):
+@query_budget(2)
+class LoginView(AsyncGenericAPIView):
     """
     Login view to generate JWT tokens for users.
     """
@@ -76,37 +100,110 @@ class LoginView(generics.GenericAPIView):
     #     request_body=LoginSerializer,
     #     responses={200: openapi.Response('Login successful.'), 401: openapi.Response('Invalid credentials.')}
     # )
-    def post(self, request):
+    async def post(self, request):
         serializer = LoginSerializer(data=request.data)
-        if serializer.is_valid():
-            return Response(serializer.validated_data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = await serializer.alogin()
+        except serializers.ValidationError as e:
+            return Response(serializers.as_serializer_error(e), status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 
-class AvailableTablesView(generics.ListAPIView):
+@query_budget(2)
+class AvailableTablesView(ReplicaReadMixin, CachedResponseMixin, AsyncListAPIView):
     """
-    Retrieve a list of all available tables.
+    Retrieve the tables that are free for a slot.
+
+    With `date` and `time` query parameters only tables with no booking in that
+    slot are returned; `party_size` further limits the list to tables that fit.
     """
     permission_classes = [IsAuthenticated]
     # authentication_classes = [TokenAuthentication]
-    queryset = Table.objects.filter(availability_status=True)
     serializer_class = TableSerializer
+    projection = table_projection
+    keyset_ordering = ('table_number',)
+
+    def get_queryset(self):
+        query = AvailabilityQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        if 'date' in params:
+            return Table.objects.available_at(params['date'], params['time'], params.get('party_size'))
+
+        tables = Table.objects.filter(availability_status=True)
+        if params.get('party_size'):
+            tables = tables.filter(capacity__gte=params['party_size'])
+        return tables
 
     # @swagger_auto_schema(
     #     operation_description='Retrieve a list of available tables.',
     #     tags=['Tables'],
     #     responses={200: TableSerializer(many=True)},
     # )
-    def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+@query_budget(3)
+class AvailabilityCalendarView(ReplicaReadMixin, CachedResponseMixin, AsyncGenericAPIView):
+    """
+    Free slots per table and day over a date range, as hex bitmaps.
+
+    Bit j (least significant first) of a day's bitmap is set when `slots[j]` is
+    free; `any` is set where at least one table is. Query parameters: `start`,
+    `end` (two weeks by default), `slot_minutes` and `party_size`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, *args, **kwargs):
+        query = CalendarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return await self.cached_response(request, lambda: self.build(query.validated_data))
+
+    async def build(self, params):
+        return Response(await sync_to_async(build_calendar)(
+            params['start'], params['end'], params['slot_minutes'], params.get('party_size')
+        ))
+
+@query_budget(1)
+class TableEventsView(AsyncAPIView):
+    """
+    Server-sent events for every change to tables and slot bookings.
 
-class AllTablesView(generics.ListAPIView):
+    "slot" events carry a table id, date, time and status (booked or free);
+    "table" events a table's fields, or its id and deleted: true. Clients
+    resume with the Last-Event-ID header and get a "reset" event, meaning
+    refetch everything, when the events they missed are no longer kept.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, EventStreamRenderer]
+
+    async def get(self, request, *args, **kwargs):
+        last_event_id = events.parse_event_id(
+            request.headers.get('Last-Event-ID', request.query_params.get('last_event_id')))
+        # Under WSGI an open stream would hold a worker thread, so it only replays and closes
+        if isinstance(request._request, ASGIRequest):
+            content = events.astream(last_event_id)
+        else:
+            content = events.stream(last_event_id)
+        response = StreamingHttpResponse(content, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+@query_budget(2)
+class AllTablesView(ReplicaReadMixin, CachedResponseMixin, AsyncListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = TableSerializer
+    projection = table_projection
     queryset = Table.objects.all()
+    keyset_ordering = ('table_number',)
 
 
+# Two more when another guest holds a table of that size on that day
+@query_budget(13)
 class CreateReservationView(generics.CreateAPIView):
     """
     Create a reservation for the authenticated user, given a table ID.
@@ -119,40 +216,33 @@ class CreateReservationView(generics.CreateAPIView):
     #     responses={201: ReservationSerializer, 400: openapi.Response('Error')}
     # )
     def post(self, request, table_id, *args, **kwargs):
-        table = Table.objects.get(id=table_id, availability_status=True)
-        date = request.data.get('date')
-        time = request.data.get('time')
-        tb = request.data.get('table')
-
-        if tb:
-            raise ValueError("Table is not required in the request body.")
-        
-
-        # Check if user already has a reservation for this table at the specified time
-        existing_reservation = Reservation.objects.filter(
-            user=request.user, 
-            table=table, 
-            date=date, 
-            time=time, 
-            status="booked"
-        ).exists()
-
-        if existing_reservation:
-            return Response({"error": "You already have a reservation for this table at the specified time."},
+        if request.data.get('table'):
+            return Response({"error": "Table is not required in the request body."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Proceed to create the reservation
-        reservation = Reservation.objects.create(
-            user=request.user,
-            table=table,
-            date=date,
-            time=time,
-            status="booked"
-        )
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        date = serializer.validated_data['date']
+        time = serializer.validated_data['time']
+
+        table = Table.objects.filter(id=table_id, availability_status=True).first()
+        if table is None:
+            return Response({"error": "Table not found or not in service."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Mark the table as unavailable
-        table.availability_status = False
-        table.save()
+        # Claim the slot and write the reservation atomically; a concurrent booking loses with a 409
+        try:
+            reservation = book_table(request.user, table, date, time)
+        except SlotUnavailable as e:
+            own_booking = TableSlot.objects.filter(
+                table=table,
+                date=date,
+                time=slot_time(time),
+                reservation__user_id=request.user.pk,
+            ).exists()
+            if own_booking:
+                return Response({"error": "You already have a reservation for this table at the specified time."},
+                                status=status.HTTP_409_CONFLICT)
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
 
         return Response(
             {
@@ -168,13 +258,117 @@ class CreateReservationView(generics.CreateAPIView):
         )
 
 
+# Two more when another guest holds a table of that size on that day, and each
+# table lost to a concurrent booking or a hold costs a failed booking of up to 8 queries
+@query_budget(14 + 4 * 8)
+class AssignReservationView(generics.GenericAPIView):
+    """
+    Book the smallest free table that seats the party, for the authenticated user.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = AssignmentSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        party_size = serializer.validated_data['party_size']
+        date = serializer.validated_data['date']
+        time = serializer.validated_data['time']
+
+        for _ in range(getattr(settings, 'ASSIGNMENT_ATTEMPTS', 5)):
+            fit = assignment.index.best_fit(date, time, party_size)
+            if fit is None:
+                break
+            capacity, table_number, table_id = fit
+            table = Table(id=table_id, table_number=table_number, capacity=capacity, availability_status=True)
+            try:
+                reservation = book_table(request.user, table, date, time)
+            except SlotUnavailable:
+                # Booked by another worker since the index last looked, or held for the waitlist; try the next fit
+                assignment.index.claim(table_id, date, time)
+                continue
+            return Response(
+                {
+                    "message": "Reservation created successfully.",
+                    "reservation": {
+                        "id": reservation.id,
+                        "table": table_number,
+                        "capacity": capacity,
+                        "date": reservation.date,
+                        "time": reservation.time,
+                    },
+                },
+                status=status.HTTP_201_CREATED
+            )
+
+        return Response({"error": f"No table for {party_size} is free on {date} at {slot_time(time)}."},
+                        status=status.HTTP_409_CONFLICT)
+
+
+# The same number of queries whatever the number of slots, two more when another guest holds a table
+@query_budget(14)
+class BatchReservationView(generics.GenericAPIView):
+    """
+    Book many slots at once, from a list or a recurrence rule, all or nothing.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = BatchReservationSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = serializer.validated_data['slots']
+
+        table_ids = {slot['table'] for slot in requested}
+        tables = Table.objects.filter(availability_status=True).in_bulk(table_ids)
+        missing = sorted(table_ids - set(tables))
+        if missing:
+            return Response({"error": "Tables not found or not in service.", "tables": missing},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        slots = [(tables[slot['table']], slot['date'], slot['time']) for slot in requested]
+        try:
+            reservations = book_slots(request.user, slots)
+        except SlotUnavailable as e:
+            return Response(
+                {
+                    "error": f"{e} Nothing was booked.",
+                    "conflicts": [
+                        {"table": table.id, "date": date, "time": time, "reason": reason}
+                        for table, date, time, reason in e.conflicts
+                    ],
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+
+        return Response(
+            {
+                "message": f"{len(reservations)} reservations created successfully.",
+                "reservations": [
+                    {
+                        "id": reservation.id,
+                        "table": reservation.table.table_number,
+                        "date": reservation.date,
+                        "time": reservation.time,
+                    }
+                    for reservation in reservations
+                ],
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+
+@query_budget(21)
 class CancelReservationView(generics.DestroyAPIView):
     """
     Cancel a reservation for the logged in user.
     """
     permission_classes = [IsAuthenticated]
-    queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    lookup_url_kwarg = 'reservation_id'
+
+    def get_queryset(self):
+        return Reservation.objects.filter(user_id=self.request.user.pk)
 
     # @swagger_auto_schema(
     #     manual_parameters=[
@@ -186,25 +380,19 @@ class CancelReservationView(generics.DestroyAPIView):
         try:
             reservation = self.get_object()
 
-            if reservation.status == "cancelled":
+            # Release the slot so the table can be booked again; only one of concurrent cancellations does
+            if not cancel_reservation(reservation):
                 return Response({"error": "This reservation is already cancelled."}, status=status.HTTP_400_BAD_REQUEST)
 
-            reservation.status = "cancelled"
-            reservation.save()
-
-            # Mark the table as available
-            table = reservation.table
-            table.availability_status = True
-            table.save()
-
             return Response({"message": "Reservation cancelled successfully."}, status=status.HTTP_200_OK)
-        except Reservation.DoesNotExist:
+        except (Reservation.DoesNotExist, Http404):
             return Response({"error": "Reservation not found or you do not have permission to cancel it."},
                             status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(16)
 class WaitlistView(generics.CreateAPIView):
     """
     Add the authenticated user to the waitlist for a specific table.
@@ -239,9 +427,13 @@ class WaitlistView(generics.CreateAPIView):
 
         if not date:
             return Response({"error": "Date is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date = datetime.date.fromisoformat(str(date))
+        except ValueError:
+            return Response({"error": "Date must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
 
         existing_waitlist = Waitlist.objects.filter(
-            user=request.user,
+            user_id=request.user.pk,
             table=table,
             date=date,
             status__in=["waiting", "notified"]
@@ -251,12 +443,21 @@ class WaitlistView(generics.CreateAPIView):
             return Response({"error": "You are already on the waitlist for this table and date."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        waitlist_entry = Waitlist.objects.create(
-            user=request.user,
-            table=table,
-            date=date,
-            status="waiting"
-        )
+        try:
+            waitlist_entry = Waitlist.objects.create(
+                user_id=request.user.pk,
+                table=table,
+                date=date,
+                status="waiting"
+            )
+        except IntegrityError:
+            # Lost a race with a concurrent join for the same table and date
+            return Response({"error": "You are already on the waitlist for this table and date."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Join the queue for tables of this size, and promote it in case one is already free
+        transaction.on_commit(lambda: waitlist.queues.push(waitlist_entry, table.capacity))
+        transaction.on_commit(lambda: tasks.enqueue(tasks.promote_waitlist, table.id, date.isoformat()))
 
         return Response(
             {
@@ -272,7 +473,8 @@ class WaitlistView(generics.CreateAPIView):
         )
 
 
-class ReservationInsightsView(generics.GenericAPIView):
+@query_budget(5)
+class ReservationInsightsView(ReplicaReadMixin, CachedResponseMixin, AsyncGenericAPIView):
     """
     Get insights like peak booking times, guest trends, and upcoming reservations for managers.
     """
@@ -302,29 +504,43 @@ class ReservationInsightsView(generics.GenericAPIView):
     #         403: "Forbidden: Requires authentication and staff privileges."
     #     },
     # )
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         if not request.user.is_staff:
             return Response({'detail': 'Authentication and staff privileges required.'}, status=status.HTTP_403_FORBIDDEN)
 
-        current_time = timezone.now()
-
-        # Get insights for reservations
-        peak_times_by_hour = Reservation.objects.filter(date__gte=current_time).values('time').annotate(
-            count=Count('id')).order_by('-count')
-        peak_times_by_day = Reservation.objects.filter(date__gte=current_time).values('date').annotate(
-            count=Count('id')).order_by('-count')
+        return await self.cached_response(request, self.build_insights)
 
-        guest_trends = Reservation.objects.values('user').annotate(
-            reservation_count=Count('id')).order_by('-reservation_count')
+    async def build_insights(self):
+        current_time = timezone.now()
+        today = current_time.date()
+
+        # Peaks and guest trends come from the rollup tables, which are kept up to date on every
+        # booking and cancellation, so no request aggregates over the whole reservation table
+        peak_times_by_hour = [row async for row in SlotRollup.objects.filter(date__gte=today).values('time').annotate(
+            count=Sum('bookings')).filter(count__gt=0).order_by('-count')]
+        peak_times_by_day = [row async for row in SlotRollup.objects.filter(date__gte=today).values('date').annotate(
+            count=Sum('bookings')).filter(count__gt=0).order_by('-count')]
+
+        # The two unbounded sections are paginated independently, each with its own cursor
+        guests = KeysetPagination(ordering=('-reservation_count', 'user'), cursor_query_param='guests_cursor')
+        guest_trends = await guests.apaginate_queryset(
+            GuestRollup.objects.filter(reservation_count__gt=0).values('user', 'reservation_count'),
+            self.request,
+        )
 
-        upcoming_reservations = Reservation.objects.filter(date__gte=current_time.date(), time__gte=current_time.time()) \
-            .order_by('date', 'time')
+        upcoming = KeysetPagination(ordering=('date', 'time', 'id'), cursor_query_param='upcoming_cursor')
+        upcoming_reservations = await upcoming.apaginate_queryset(
+            Reservation.objects.filter(
+                Q(date__gt=today) | Q(date=today, time__gte=current_time.time())
+            ).values('id', 'user', 'table__table_number', 'date', 'time'),
+            self.request,
+        )
 
         insights = {
             'peak_times_by_hour': peak_times_by_hour,
             'peak_times_by_day': peak_times_by_day,
-            'guest_trends': guest_trends,
-            'upcoming_reservations': upcoming_reservations.values('id', 'user', 'table__table_number', 'date', 'time')
+            'guest_trends': guests.get_paginated_data(guest_trends),
+            'upcoming_reservations': upcoming.get_paginated_data(upcoming_reservations),
         }
 
         return Response(insights)
@@ -332,18 +548,21 @@ class ReservationInsightsView(generics.GenericAPIView):
 
 
 
-class ListReservationsView(generics.ListAPIView):
+@query_budget(2)
+class ListReservationsView(ReplicaReadMixin, AsyncListAPIView):
     """
     List all reservations for the logged-in user.
     """
     serializer_class = ReservationSerializer
+    projection = reservation_projection
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('date', 'time', 'id')
 
     def get_queryset(self):
         """
         This method returns the reservations related to the authenticated user.
         """
-        return Reservation.objects.filter(user=self.request.user)
+        return Reservation.objects.filter(user_id=self.request.user.pk)
 
     # @swagger_auto_schema(
     #     responses={
@@ -351,7 +570,7 @@ class ListReservationsView(generics.ListAPIView):
     #         401: "Unauthorized: Authentication required."
     #     }
     # )
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         """
         Handle GET requests to list the reservations for the authenticated user.
         """
@@ -359,4 +578,55 @@ class ListReservationsView(generics.ListAPIView):
         if not request.user.is_authenticated:
             return Response({'detail': 'Authentication required.'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        return super().get(request, *args, **kwargs)
\ No newline at end of file
+        return await super().get(request, *args, **kwargs)
+
+
+@query_budget(2)
+class ExportView(ReplicaReadMixin, APIView):
+    """
+    Stream every reservation or waitlist entry as NDJSON or CSV, for staff.
+
+    Query parameters: output (ndjson or csv), start and end (dates, inclusive)
+    and gzip (true for a compressed download).
+    """
+
+    def get(self, request, kind):
+        if not request.user.is_staff:
+            return Response({'detail': 'Authentication and staff privileges required.'}, status=status.HTTP_403_FORBIDDEN)
+        if kind not in exports.EXPORTS:
+            return Response({"error": f"Unknown export '{kind}'."}, status=status.HTTP_404_NOT_FOUND)
+
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        options = query.validated_data
+
+        # Bind the database now: the rows are read after the request has been handled
+        queryset = exports.export_queryset(kind, options.get('start'), options.get('end'))
+        queryset = queryset.using(router.db_for_read(queryset.model))
+        encoder = exports.Encoder(kind, options['output'], compress=options['gzip'])
+
+        # ASGI only streams async iterators; it would buffer a sync one in full
+        if isinstance(request._request, ASGIRequest):
+            content = exports.astream(queryset, encoder)
+        else:
+            content = exports.stream(queryset, encoder)
+
+        content_type, extension = exports.OUTPUTS[options['output']]
+        filename = f'{kind}.{extension}'
+        if options['gzip']:
+            content_type, filename = 'application/gzip', f'{filename}.gz'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+@query_budget(1)
+class MetricsView(APIView):
+    """
+    Per-route request metrics of this process in the Prometheus text format, for staff.
+    """
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return Response({'detail': 'Authentication and staff privileges required.'}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,275 @@
+"""
+Waitlist matching.
+
+Entries queue per (date, table capacity) in `created_at` order, so anyone
+waiting for a table of that size on that day can take any such table that
+frees up. When capacity frees up, only as many head-of-queue entries as
+there are free tables are moved to "notified", each with a hold lasting
+WAITLIST['HOLD_MINUTES']. While a hold lasts, bookings by anyone else may
+not take the tables it covers (see held_conflicts). A hold that runs out
+expires the entry and the table passes to the next one in line.
+
+Each queue is a heap of (created_at, entry id), loaded the first time it
+is needed (one query for all the queues a promotion needs) and kept in this
+process for WAITLIST['TTL'] seconds. Entries that left the queue elsewhere are skipped when popped:
+promotion only claims an entry that is still "waiting" in the database.
+"""
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import outbox
+from .models import Table, TableSlot, Waitlist
+
+DEFAULTS = {
+    'HOLD_MINUTES': 15,
+    # (date, capacity) queues kept before the least recently used is dropped
+    'MAX_QUEUES': 4096,
+    'TTL': 60,
+}
+
+
+def waitlist_setting(name):
+    return getattr(settings, 'WAITLIST', {}).get(name, DEFAULTS[name])
+
+
+class WaitlistQueues:
+    def __init__(self):
+        self.queues = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, keys):
+        """
+        A heap for each (date, capacity) in `keys`, from one query.
+        """
+        heaps = {key: [] for key in keys}
+        rows = Waitlist.objects.filter(
+            status="waiting", date__in={date for date, _ in keys}, table__capacity__in={capacity for _, capacity in keys}
+        ).values_list('date', 'table__capacity', 'created_at', 'id')
+        for date, capacity, created_at, entry_id in rows:
+            heap = heaps.get((date, capacity))
+            if heap is not None:
+                heap.append((created_at, entry_id))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        return heaps
+
+    def heaps(self, keys):
+        """
+        The heap of each (date, capacity) in `keys`; call with the lock held.
+        """
+        now = monotonic()
+        stale = [key for key in keys if key not in self.queues or self.queues[key][1] < now]
+        if stale:
+            expires = now + waitlist_setting('TTL')
+            for key, heap in self.load(stale).items():
+                self.queues[key] = (heap, expires)
+        heaps = {}
+        for key in keys:
+            heaps[key] = self.queues[key][0]
+            self.queues.move_to_end(key)
+        while len(self.queues) > waitlist_setting('MAX_QUEUES'):
+            self.queues.popitem(last=False)
+        return heaps
+
+    def pop(self, wanted):
+        """
+        Remove up to `count` entry ids from the head of each (date, capacity) queue in {key: count}.
+        """
+        with self.lock:
+            heaps = self.heaps(list(wanted))
+            return {
+                key: [heapq.heappop(heaps[key])[1] for _ in range(min(count, len(heaps[key])))]
+                for key, count in wanted.items()
+            }
+
+    def push(self, entry, capacity):
+        """
+        Add a new waiting entry to its queue, if that queue is loaded.
+        """
+        with self.lock:
+            key = (entry.date, capacity)
+            if key in self.queues:
+                heapq.heappush(self.queues[key][0], (entry.created_at, entry.pk))
+
+    def forget(self, keys):
+        with self.lock:
+            for key in keys:
+                self.queues.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.queues.clear()
+
+
+queues = WaitlistQueues()
+
+
+def openings(buckets):
+    """
+    For each (date, capacity) in `buckets`, the tables of that capacity in service and
+    unbooked that day, less those already held for a notified entry; three queries in all.
+    """
+    dates = {date for date, _ in buckets}
+    capacities = {capacity for _, capacity in buckets}
+    in_service = Counter(
+        Table.objects.filter(availability_status=True, capacity__in=capacities).values_list('capacity', flat=True)
+    )
+    booked = {
+        (row['date'], row['table__capacity']): row['tables']
+        for row in TableSlot.objects.filter(
+            date__in=dates, table__availability_status=True, table__capacity__in=capacities
+        ).values('date', 'table__capacity').annotate(tables=Count('table', distinct=True))
+    }
+    held = {
+        (row['date'], row['table__capacity']): row['entries']
+        for row in Waitlist.objects.filter(
+            status="notified", date__in=dates, table__capacity__in=capacities, hold_expires_at__gt=timezone.now()
+        ).values('date', 'table__capacity').annotate(entries=Count('id'))
+    }
+    return {
+        (date, capacity): max(0, in_service[capacity] - booked.get((date, capacity), 0) - held.get((date, capacity), 0))
+        for date, capacity in buckets
+    }
+
+
+def held_conflicts(user, slots):
+    """
+    The (table, date, time, reason) of every slot in `slots` that would take
+    a table held for someone else's notified entry.
+
+    Booking a table with no other booking that day takes it out of the
+    openings its (date, capacity) queue was promoted against, so that is
+    refused once the tables left would not cover the other guests' holds.
+    One query when nobody else holds a table of those sizes on those dates,
+    three otherwise.
+    """
+    dates = {date for _, date, _ in slots}
+    capacities = {table.capacity for table, _, _ in slots}
+    held = Counter(
+        Waitlist.objects.filter(
+            status="notified", date__in=dates, table__capacity__in=capacities, hold_expires_at__gt=timezone.now()
+        ).exclude(user_id=user.pk).values_list('date', 'table__capacity')
+    )
+    if not held:
+        return []
+    in_service = Counter(
+        Table.objects.filter(availability_status=True, capacity__in=capacities).values_list('capacity', flat=True)
+    )
+    booked = set(
+        TableSlot.objects.filter(date__in=dates, table__availability_status=True, table__capacity__in=capacities)
+        .values_list('table_id', 'date', 'table__capacity').distinct()
+    )
+    tables_booked = Counter((date, capacity) for _, date, capacity in booked)
+    free = {key: in_service[key[1]] - tables_booked[key] for key in held}
+
+    conflicts = []
+    for table, date, time in slots:
+        key = (date, table.capacity)
+        if key not in held or (table.pk, date, table.capacity) in booked:
+            continue
+        if free[key] - 1 < held[key]:
+            conflicts.append((table, date, time, "held for the waitlist"))
+        else:
+            free[key] -= 1
+            booked.add((table.pk, date, table.capacity))
+    return conflicts
+
+
+def promote(buckets):
+    """
+    Notify as many head-of-queue entries of each (date, capacity) in `buckets` as it has openings.
+
+    The number of queries does not depend on the number of buckets.
+    """
+    buckets = set(buckets)
+    if not buckets:
+        return []
+    try:
+        with transaction.atomic():
+            wanted = {key: count for key, count in openings(buckets).items() if count}
+            promoted = []
+            while wanted:
+                popped = queues.pop(wanted)
+                ids = [entry_id for entry_ids in popped.values() for entry_id in entry_ids]
+                if not ids:
+                    break
+                # Entries cancelled, expired or promoted by another process are no longer waiting
+                entries = list(Waitlist.objects.filter(pk__in=ids, status="waiting")
+                               .select_for_update(skip_locked=True, of=('self',))
+                               .select_related('user', 'table').order_by('created_at'))
+                promoted += entries
+                claimed = Counter((entry.date, entry.table.capacity) for entry in entries)
+                # Queues that gave up stale entries and may hold more try again
+                wanted = {
+                    key: count - claimed[key] for key, count in wanted.items()
+                    if len(popped[key]) == count and claimed[key] < count
+                }
+            if promoted:
+                notify(promoted)
+    except Exception:
+        # The popped entries are still waiting; reload their queues next time
+        queues.forget(buckets)
+        raise
+    return promoted
+
+
+def expire_holds():
+    """
+    Expire notified entries whose hold has run out and promote the next in line for each.
+
+    Returns the number expired and the entries promoted in their place.
+    """
+    with transaction.atomic():
+        lapsed = Waitlist.objects.filter(status="notified", hold_expires_at__lte=timezone.now())
+        buckets = {(date, capacity) for date, capacity in lapsed.values_list('date', 'table__capacity')
+                   if capacity is not None}
+        expired = lapsed.update(status="expired")
+    return expired, promote(buckets)
+
+
+def confirm(user, dates):
+    """
+    Close `user`'s notified entries on `dates` once they have booked.
+    """
+    return Waitlist.objects.filter(user_id=user.pk, date__in=dates, status="notified").update(status="confirmed")
+
+
+def notification_email(entry, connection=None):
+    """
+    The "table available" email for a waitlist entry loaded with its user and table.
+    """
+    hold = ''
+    if entry.hold_expires_at:
+        hold = f' The table is held for you until {timezone.localtime(entry.hold_expires_at):%H:%M}.'
+    return EmailMessage(
+        subject='Table Available Notification',
+        body=f'Dear {entry.user.full_name},\n\n'
+             f'A table for {entry.table.capacity} is now available on {entry.date}.{hold}\n'
+             f'Please log in to confirm your reservation.',
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[entry.user.email],
+        connection=connection,
+    )
+
+
+def notify(entries):
+    """
+    Mark `entries` as notified with a hold and queue their emails in the same transaction.
+    """
+    hold_expires_at = timezone.now() + timedelta(minutes=waitlist_setting('HOLD_MINUTES'))
+    with transaction.atomic():
+        for entry in entries:
+            entry.status = "notified"
+            entry.hold_expires_at = hold_expires_at
+        Waitlist.objects.bulk_update(entries, ['status', 'hold_expires_at'])
+        outbox.enqueue(notification_email(entry) for entry in entries)
+    return entries